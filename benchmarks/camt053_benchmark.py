@@ -0,0 +1,81 @@
+"""Benchmarks the CAMT.053 importer against a large generated statement.
+
+Usage: python -m benchmarks.camt053_benchmark [entries]
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from invoices.invoice.helpers import CAMT053_processor
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+  <BkToCstmrStmt>
+    <GrpHdr><MsgId>benchmark</MsgId><CreDtTm>2022-01-01T00:00:00</CreDtTm></GrpHdr>
+    <Stmt>
+      <Id>benchmark</Id>
+      <Acct><Id><IBAN>NL00ABNA0123456789</IBAN></Id></Acct>
+"""
+ENTRY = """      <Ntry>
+        <Amt Ccy="EUR">%(amount)d.%(cents)02d</Amt>
+        <CdtDbtInd>CRDT</CdtDbtInd>
+        <BookgDt><Dt>2022-01-01</Dt></BookgDt>
+        <AcctSvcrRef>N%(number)d</AcctSvcrRef>
+        <NtryDtls>
+          <TxDtls>
+            <Refs><EndToEndId>E2E%(number)d</EndToEndId></Refs>
+            <RltdPties>
+              <Dbtr><Nm>Client %(number)d</Nm></Dbtr>
+              <DbtrAcct><Id><IBAN>NL00RABO%(number)010d</IBAN></Id></DbtrAcct>
+            </RltdPties>
+            <RmtInf><Ustrd>Payment for invoice 2022-%(sequence)03d</Ustrd></RmtInf>
+          </TxDtls>
+        </NtryDtls>
+      </Ntry>
+"""
+FOOTER = """    </Stmt>
+  </BkToCstmrStmt>
+</Document>
+"""
+
+
+def generate_statement(f, entries):
+    f.write(HEADER.encode())
+    for number in range(entries):
+        f.write(
+            (
+                ENTRY
+                % {
+                    "amount": number % 1000,
+                    "cents": number % 100,
+                    "number": number,
+                    "sequence": number % 1000,
+                }
+            ).encode()
+        )
+    f.write(FOOTER.encode())
+
+
+def main(entries=100000):
+    with tempfile.TemporaryFile() as f:
+        generate_statement(f, entries)
+        size = f.tell()
+        f.seek(0)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        references = sum(1 for _ in CAMT053_processor([]).iter_references(f))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(f"statement: {entries} entries, {size / 1024 / 1024:.1f} MiB")
+    print(f"references: {references}")
+    print(f"parse time: {elapsed:.2f}s ({entries / elapsed:.0f} entries/s)")
+    print(f"peak memory: {peak / 1024 / 1024:.2f} MiB")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,93 @@
+"""Compares reading current clients through the isCurrent marker with the
+MAX(ID) GROUP BY join that was used before.
+
+Fills the client table with `clients` clients of `versions` versions each,
+100k versions by default. Runs against the database from config.ini,
+everything is rolled back afterwards.
+
+Usage: python -m benchmarks.client_versions_benchmark [clients] [versions]
+"""
+
+import sys
+import time
+
+from invoices import load_config
+from invoices.clients.model import Client
+from invoices.common.helpers import connect
+
+FIRST_NUMBER = 1000000
+CHUNK = 1000
+REPEATS = 5
+
+MAX_ID_JOIN = """
+    SELECT `client`.*
+    FROM `client`
+    JOIN (SELECT MAX(`ID`) AS `max`
+          FROM `client`
+          GROUP BY `clientNumber`) AS `versions`
+      ON (`client`.`ID` = `versions`.`max`)
+    WHERE %s
+"""
+IS_CURRENT = """
+    SELECT `client`.*
+    FROM `client`
+    WHERE `client`.`isCurrent` = 1 AND %s
+"""
+
+
+def fill(connection, clients, versions):
+    rows = []
+    for number in range(FIRST_NUMBER, FIRST_NUMBER + clients):
+        for version in range(versions):
+            rows.append(
+                "(%d, 'client %d version %d', 'city', '1234AB', "
+                "'client@example.com', '12345678', 'address', %s)"
+                % (number, number, version, "1" if version == versions - 1 else "NULL")
+            )
+    with connection as cursor:
+        for start in range(0, len(rows), CHUNK):
+            cursor.Execute(
+                "INSERT INTO `client` (`clientNumber`, `name`, `city`, `postalCode`, "
+                "`email`, `telephone`, `address`, `isCurrent`) VALUES "
+                + ", ".join(rows[start : start + CHUNK])
+            )
+
+
+def measure(connection, statement, condition):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        with connection as cursor:
+            rows = cursor.Execute(statement % condition)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(rows)
+
+
+def main(clients=10000, versions=10):
+    connection = connect(load_config().options["mysql"])
+    Client.autocommit(connection, False)
+    try:
+        fill(connection, clients, versions)
+        middle = FIRST_NUMBER + clients // 2
+        cases = (
+            ("all current clients", "1"),
+            ("one client by number", "`client`.`clientNumber` = %d" % middle),
+        )
+        print(f"{clients * versions} client versions")
+        print(f"{'query':>22} {'MAX(ID) join':>14} {'isCurrent':>12} {'speedup':>8}")
+        for name, condition in cases:
+            joined, joined_rows = measure(connection, MAX_ID_JOIN, condition)
+            current, current_rows = measure(connection, IS_CURRENT, condition)
+            assert joined_rows == current_rows
+            print(
+                f"{name:>22} {joined * 1000:>12.1f}ms {current * 1000:>10.1f}ms "
+                f"{joined / current:>7.1f}x"
+            )
+    finally:
+        Client.rollback(connection)
+        connection.close()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,72 @@
+"""Compares adding invoice lines one by one with the multi-row insert.
+
+Runs against the database from config.ini, everything is rolled back afterwards.
+
+Usage: python -m benchmarks.invoice_products_benchmark [repeats]
+"""
+
+import sys
+import time
+
+from invoices import load_config
+from invoices.common.helpers import connect
+from invoices.invoice.model import InvoiceProduct
+
+LINE_COUNTS = (10, 100, 1000)
+
+
+def products(count):
+    return [
+        {
+            "invoice": 1,
+            "name": "product %d" % number,
+            "price": "12.50",
+            "vat_percentage": 21,
+            "quantity": 2,
+        }
+        for number in range(count)
+    ]
+
+
+def one_by_one(connection, lines):
+    for product in lines:
+        InvoiceProduct.Create(connection, product)
+
+
+def multi_row(connection, lines):
+    InvoiceProduct.CreateMany(connection, lines)
+
+
+def measure(connection, insert, count, repeats):
+    best = None
+    for _ in range(repeats):
+        lines = products(count)
+        start = time.perf_counter()
+        insert(connection, lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(repeats=5):
+    connection = connect(load_config().options["mysql"])
+    InvoiceProduct.autocommit(connection, False)
+    try:
+        with connection as cursor:
+            # The lines reference an invoice that does not exist.
+            cursor.Execute("SET FOREIGN_KEY_CHECKS=0")
+        print(f"{'lines':>6} {'one by one':>12} {'multi-row':>12} {'speedup':>8}")
+        for count in LINE_COUNTS:
+            single = measure(connection, one_by_one, count, repeats)
+            multi = measure(connection, multi_row, count, repeats)
+            print(
+                f"{count:>6} {single * 1000:>10.1f}ms {multi * 1000:>10.1f}ms "
+                f"{single / multi:>7.1f}x"
+            )
+    finally:
+        InvoiceProduct.rollback(connection)
+        connection.close()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -1,17 +1,28 @@
+import atexit
 import os
+import time
+from urllib.parse import urlsplit
 
 # Third-party modules
 import uweb3
 
 from invoices.clients.urls import urls as client_urls
+from invoices.common import helpers as common_helpers
+from invoices.common import instrumentation, metrics, pool, slowqueries
+from invoices.invoice import model as invoice_model
 from invoices.invoice.urls import urls as invoice_urls
+from invoices.login import passwords
 from invoices.login.urls import urls as login_urls
 from invoices.mollie.urls import urls as mollie_urls
+from invoices.search.urls import urls as search_urls
 from invoices.settings.urls import urls as setting_urls
 
 # Application
 from . import basepages
 
+# Called when the process that runs the application stops, see run_cleanups.
+_cleanups = []
+
 
 def main():
     """Creates a uWeb3 application.
@@ -22,14 +33,23 @@ def main():
     - The routes iterable, where each 2-tuple defines a url-pattern and the
       name of a presenter method which should handle it.
     - The execution path, internally used to find templates etc.
+
+    All templates are compiled before the application is returned, so a
+    template with an error stops the start. The time that took is logged.
+
+    The cleanups of the new application replace those of an application that
+    was created before, run_cleanups runs them when the process stops.
     """
+    start = time.perf_counter()
     urls = (
         setting_urls
         + login_urls
         + client_urls
         + invoice_urls
         + mollie_urls
+        + search_urls
         + [
+            ("/metrics", "RequestMetrics", "GET"),
             # Helper files
             ("(/styles/.*)", "Static"),
             ("(/js/.*)", "Static"),
@@ -38,8 +58,170 @@ def main():
             ("(/.*)", "RequestInvalidcommand"),
         ]
     )
-    return uweb3.uWeb(
+    options = load_config().options
+    cleanups = [configure_sequences(options), configure_pool(options)]
+    instrumentation.install()
+    configure_metrics(options, urls)
+    configure_slow_queries(options)
+    cleanups.append(configure_logins(options))
+    configure_imports(options)
+    templates = basepages.preload_templates()
+    app = uweb3.uWeb(
         basepages.PageMaker,
         urls,
         os.path.dirname(__file__),
     )
+    _cleanups[:] = [cleanup for cleanup in cleanups if cleanup is not None]
+    report_startup(time.perf_counter() - start, templates)
+    return app
+
+
+def run_cleanups():
+    """Runs the cleanups of the current application, the newest first.
+
+    This runs at exit, worker processes that end with os._exit call it
+    themselves. Every cleanup runs once, also when another one fails.
+    """
+    while _cleanups:
+        cleanup = _cleanups.pop()
+        try:
+            cleanup()
+        except Exception as error:
+            uweb3.logging.error("Cleanup %r failed: %s", cleanup, error)
+
+
+atexit.register(run_cleanups)
+
+
+def report_startup(duration, templates):
+    """Logs the startup time and the compile time of the templates.
+
+    Arguments:
+      @ duration: float
+        Seconds it took to create the application.
+      @ templates: list(tuple)
+        Template names and their compile time, from preload_templates.
+    """
+    compiled = sum(seconds for _name, seconds in templates)
+    uweb3.logging.info(
+        "Application created in %.0fms, %d templates compiled in %.0fms",
+        duration * 1000,
+        len(templates),
+        compiled * 1000,
+    )
+    slowest = sorted(templates, key=lambda template: template[1], reverse=True)
+    uweb3.logging.info(
+        "Template compile times: %s",
+        ", ".join("%s %.1fms" % (name, seconds * 1000) for name, seconds in slowest),
+    )
+
+
+def load_config():
+    """Returns the settings from config.ini, as uweb3 hands them to the PageMaker."""
+    return uweb3.SettingsManager("config", os.path.join(os.path.dirname(__file__), ""))
+
+
+def configure_sequences(options):
+    """Sets up block allocation of pro forma numbers when it is enabled.
+
+    With `mode = block` in the [sequence] section every process reserves
+    `block_size` pro forma numbers at once. Legal invoice numbers are always
+    allocated one at a time so they stay without gaps.
+
+    Returns the cleanup that hands back the unused numbers, None when blocks
+    are not used.
+    """
+    sequence = options.get("sequence", {})
+    if sequence.get("mode", "counter") != "block":
+        return None
+    allocator = invoice_model.BlockAllocator(
+        invoice_model.SequenceCounter.PRO_FORMA,
+        int(sequence.get("block_size", 20)),
+        lambda: common_helpers.connect(options["mysql"]),
+    )
+    invoice_model.ProFormaSequenceTable.allocator = allocator
+    return allocator.Close
+
+
+def configure_pool(options):
+    """Sets up the database connection pool when a [pool] section is present.
+
+    Without it every request uses the connection that uweb3 manages. Returns
+    the cleanup that closes the pool, None without a pool.
+    """
+    settings = options.get("pool")
+    if not settings:
+        return None
+    connection_pool = pool.configure(
+        lambda: common_helpers.connect(options["mysql"]),
+        size=int(settings.get("size", 10)),
+        timeout=float(settings.get("timeout", 5)),
+        max_lifetime=float(settings.get("max_lifetime", 3600)),
+        check_interval=float(settings.get("check_interval", 1)),
+    )
+    return connection_pool.Close
+
+
+def configure_metrics(options, urls):
+    """Sets up the metrics that are served on /metrics.
+
+    Calls to the warehouse and to Mollie are reported under those names, other
+    external services under their host name.
+    """
+    settings = options.get("metrics", {})
+    if settings.get("enabled", "true") != "true":
+        return
+    dependencies = {"api.mollie.com": "mollie"}
+    warehouse = urlsplit(options.get("general", {}).get("warehouse_api", "")).hostname
+    if warehouse:
+        dependencies[warehouse] = "warehouse"
+    metrics.configure(settings.get("directory"), urls, dependencies)
+
+
+def configure_imports(options):
+    """Sets where uploaded bank statements wait for the import worker.
+
+    The web and worker processes have to share the directory, so it has to be
+    on the host that runs them all.
+    """
+    directory = options.get("imports", {}).get("directory")
+    if directory:
+        invoice_model.ImportJob.directory = directory
+
+
+def configure_slow_queries(options):
+    """Sets up the slow query log from the [slow_queries] section of the config."""
+    settings = options.get("slow_queries", {})
+    if settings.get("enabled", "true") != "true":
+        return
+    slowqueries.configure(
+        threshold_ms=float(settings.get("threshold_ms", 100)),
+        path=settings.get("log"),
+        explain_sample=float(settings.get("explain_sample", 0)),
+        explain_interval=float(settings.get("explain_interval", 300)),
+        max_bytes=int(settings.get("max_bytes", 10485760)),
+        backups=int(settings.get("backups", 5)),
+    )
+
+
+def configure_logins(options):
+    """Sets up password hashing and login throttling from the [login] section.
+
+    Returns the cleanup that stops the hash workers.
+    """
+    settings = options.get("login", {})
+    rounds = settings.get("rounds")
+    hasher = passwords.PasswordHasher(
+        workers=int(settings.get("hash_workers", 2)),
+        queue_size=int(settings.get("hash_queue_size", 16)),
+        timeout=float(settings.get("hash_timeout", 10)),
+        rounds=int(rounds) if rounds else None,
+    )
+    throttle = passwords.LoginThrottle(
+        ip_attempts=int(settings.get("ip_attempts", 20)),
+        ip_per_minute=float(settings.get("ip_per_minute", 10)),
+        account_attempts=int(settings.get("account_attempts", 5)),
+        account_per_minute=float(settings.get("account_per_minute", 1)),
+    )
+    passwords.configure(hasher, throttle)
+    return hasher.Close
@@ -1,12 +1,115 @@
+import os
+import threading
 import time
 from http import HTTPStatus
 
 import uweb3
+from uweb3 import templateparser
 
 import invoices.login.model as login_model
+from invoices.common import cache, instrumentation, metrics
+from invoices.common import model as common_model
+from invoices.common import pool, slowqueries
 from invoices.invoice.model import PRO_FORMA_PREFIX
 
 API_VERSION = "/api/v1"
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
+LIST_PAGE_SIZE = 50
+
+_parser = None
+_parser_lock = threading.Lock()
+
+
+def register_functions(parser):
+    """Registers the template functions that do not depend on a request."""
+    parser.RegisterFunction("CentRound", lambda x: "%.2f" % x if x else None)
+    parser.RegisterFunction("items", lambda x: x.items())
+    parser.RegisterFunction("DateOnly", lambda x: str(x)[0:10])
+    parser.RegisterFunction(
+        "isProForma", lambda x: bool(str(x).startswith(PRO_FORMA_PREFIX))
+    )
+
+
+def shared_parser():
+    """Returns the template parser that all requests of this process share.
+
+    Parsed templates are kept by the parser, so templates that were loaded
+    before the server forks its workers are shared with all of them.
+    """
+    global _parser
+    with _parser_lock:
+        if _parser is None:
+            _parser = templateparser.Parser(path=TEMPLATE_DIR)
+            register_functions(_parser)
+        return _parser
+
+
+class TemplateError(Exception):
+    """A template could not be compiled."""
+
+
+def preload_templates():
+    """Compiles all templates into a new shared parser.
+
+    The new parser replaces the current one, so this also reloads templates that
+    changed on disk. The current parser is kept when a template fails to compile.
+
+    Raises:
+      TemplateError: A template could not be compiled, with its name.
+
+    Returns:
+      list(tuple): The name of every template and the seconds it took to compile.
+    """
+    global _parser
+    parser = templateparser.Parser(path=TEMPLATE_DIR)
+    register_functions(parser)
+    timings = []
+    for root, _dirs, files in os.walk(TEMPLATE_DIR):
+        for filename in files:
+            name = os.path.relpath(os.path.join(root, filename), TEMPLATE_DIR)
+            begin = time.perf_counter()
+            try:
+                parser.AddTemplate(name)
+            except Exception as error:
+                raise TemplateError("%s: %s" % (name, error)) from error
+            timings.append((name, time.perf_counter() - begin))
+    with _parser_lock:
+        _parser = parser
+    return sorted(timings)
+
+
+class RequestParser:
+    """Template parser for a single request on top of the shared parser.
+
+    Tags registered on it are only visible to templates parsed for this
+    request, so concurrent requests never see each other's user or xsrf token.
+    Everything else is handled by the shared parser.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.tags = {}
+
+    def RegisterTag(self, tag, value):
+        self.tags[tag] = value
+
+    def Parse(self, template, *args, **replacements):
+        profile = instrumentation.current()
+        if profile is None:
+            return self.parser.Parse(template, *args, **dict(self.tags, **replacements))
+        # Templates that are parsed from within another template, such as the
+        # header, are part of the render time of the outer template.
+        profile.render_depth += 1
+        begin = time.perf_counter()
+        try:
+            return self.parser.Parse(template, *args, **dict(self.tags, **replacements))
+        finally:
+            profile.render_depth -= 1
+            if not profile.render_depth:
+                profile.Add("render", time.perf_counter() - begin)
+
+    def __getattr__(self, name):
+        return getattr(self.parser, name)
 
 
 class PageMaker(
@@ -15,18 +118,60 @@ class PageMaker(
 ):
     """Holds all the request handlers for the application"""
 
+    _pooled = None
+    _release = None
+    _parser = None
+    _profile_token = None
+    _started = None
+    _identity_token = None
+    _instrumented = None
+    _session = None
+
     def __init__(self, *args, **kwds):
         super(PageMaker, self).__init__(*args, **kwds)
 
+    @property
+    def connection(self):
+        """The database connection for this request.
+
+        When a connection pool is configured the first use borrows a connection
+        from the pool, it is handed back after the request. Otherwise this is the
+        connection uweb3 manages, which is always available as connection_manager
+        for the session cookies.
+        """
+        if self._pooled is None and pool.get() is not None:
+            # The connection also returns to the pool when the request failed.
+            self._pooled, self._release = pool.get().Borrow(self)
+        if self._pooled is not None:
+            connection = self._pooled.connection
+        else:
+            connection = self.connection_manager
+        if self._profile_token is None and slowqueries.get() is None:
+            return connection
+        if self._instrumented is None or self._instrumented[0] is not connection:
+            self._instrumented = (
+                connection,
+                instrumentation.InstrumentedConnection(connection),
+            )
+        return self._instrumented[1]
+
+    @connection.setter
+    def connection(self, value):
+        self.connection_manager = value
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            self._parser = RequestParser(shared_parser())
+        return self._parser
+
     def _PostInit(self):
         """Sets up all the default vars"""
+        self._started = time.perf_counter()
+        self._identity_token = common_model.start_identity_map()
+        if self.instrumentation_options.get("enabled", "true") == "true":
+            self._profile_token = instrumentation.start(self.req.method, self.req.path)
         self.validatexsrf()
-        self.parser.RegisterFunction("CentRound", lambda x: "%.2f" % x if x else None)
-        self.parser.RegisterFunction("items", lambda x: x.items())
-        self.parser.RegisterFunction("DateOnly", lambda x: str(x)[0:10])
-        self.parser.RegisterFunction(
-            "isProForma", lambda x: bool(str(x).startswith(PRO_FORMA_PREFIX))
-        )
         self.parser.RegisterTag("year", time.strftime("%Y"))
         self.parser.RegisterTag(
             "header", self.parser.JITTag(lambda: self.parser.Parse("parts/header.html"))
@@ -48,20 +193,158 @@ class PageMaker(
                 "Access-Control-Allow-Origin": "*",
             }
         )
+        if self._identity_token is not None:
+            common_model.end_identity_map(self._identity_token)
+            self._identity_token = None
+        if self._instrumented is not None:
+            self._instrumented[1].ExplainSlowQueries()
+            self._instrumented = None
+        if self._release is not None:
+            self._release()
+            self._pooled = self._release = None
+        if self._profile_token is not None:
+            profile = instrumentation.finish(self._profile_token)
+            self._profile_token = None
+            response.headers["Server-Timing"] = profile.ServerTiming()
+            instrumentation.report(profile, self.instrumentation_options)
+        if self._started is not None:
+            # Recorded also when the Server-Timing instrumentation is turned off.
+            metrics.observe_request(
+                self.req.path,
+                self.req.method,
+                getattr(response, "httpcode", None) or 200,
+                time.perf_counter() - self._started,
+            )
+            self._started = None
+        if metrics.store() is not None:
+            if pool.get() is not None:
+                metrics.observe_pool(pool.get().Stats())
+            metrics.observe_caches(c.Stats() for c in cache.caches)
+            metrics.store().Flush()
         return response
 
+    @property
+    def instrumentation_options(self):
+        return self.options.get("instrumentation", {})
+
+    def RequestMetrics(self):
+        """Returns the metrics of all worker processes for Prometheus.
+
+        When the [metrics] section of the config has a token, it has to be
+        passed as the token query argument. Without a token only requests from
+        the same host are served.
+        """
+        if not metrics.allowed(
+            self.options.get("metrics", {}).get("token"),
+            self.get.getfirst("token", ""),
+            self.req.env.get("REMOTE_ADDR", ""),
+        ):
+            return uweb3.Response(
+                "Invalid token", content_type="text/plain", httpcode=403
+            )
+        if metrics.store() is None:
+            return self.RequestInvalidcommand(command="/metrics")
+        return uweb3.Response(
+            metrics.store().Render(), content_type="text/plain; version=0.0.4"
+        )
+
+    def ListPage(self, cls, page_size=LIST_PAGE_SIZE, **kwds):
+        """Returns the page of cls.List that the page query argument asks for.
+
+        The total is counted with the COUNT_STRATEGY of cls, so on large tables
+        it can be an estimate.
+
+        Returns:
+          dict: The records, the total and the numbers of the previous and the
+          next page, 0 when there is none.
+        """
+        try:
+            page = max(1, int(self.get.getfirst("page", 1)))
+        except ValueError:
+            page = 1
+        total, *records = cls.List(
+            self.connection,
+            limit=page_size,
+            offset=(page - 1) * page_size,
+            yield_unlimited_total_first=True,
+            **kwds,
+        )
+        return {
+            "records": records,
+            "total": total,
+            "previous_page": page - 1,
+            "next_page": page + 1 if page * page_size < total else 0,
+        }
+
+    @property
+    def session_options(self):
+        return self.options.get("session", {})
+
+    def StartSession(self, user):
+        """Logs in the user with a new session cookie."""
+        lifetime = int(
+            self.session_options.get("lifetime", login_model.SESSION_LIFETIME)
+        )
+        self._session = login_model.Session.Start(
+            self.connection_manager, user, lifetime
+        )
+
     def _ReadSession(self):
-        """Attempts to read the session for this user from his session cookie"""
+        """Attempts to read the session for this user from his session cookie
+
+        The signed cookie holds the user ID and whether the user is active, so the
+        user table is only read once the last check is older than the verify
+        interval, or when a privileged action calls VerifySession.
+        """
         try:
-            user = login_model.Session(self.connection)
+            session = login_model.Session(self.connection_manager)
+            state = login_model.SessionState.FromCookie(str(session))
+            if state is None:
+                # An old style cookie with only the user ID, replaced once checked.
+                expires = int(time.time()) + login_model.SESSION_LIFETIME
+                user = int(str(session))
+                state = login_model.SessionState(user, True, expires, 0, "")
         except Exception:
             raise ValueError("Session cookie invalid")
+        if state.Expired():
+            raise ValueError("Session expired")
+        # The revocation list is cached, so this rarely needs the database. It
+        # uses the connection uweb3 manages to not borrow one from the pool.
+        if state.token and login_model.SessionRevocation.IsRevoked(
+            self.connection_manager, state.token
+        ):
+            raise ValueError("Session revoked")
+        self._session = state
+        interval = int(
+            self.session_options.get("verify_interval", login_model.VERIFY_INTERVAL)
+        )
+        if state.NeedsVerification(interval):
+            return self.VerifySession()
+        if not state.active:
+            raise ValueError("User not active, session invalid")
+        return login_model.SessionUser(self.connection_manager, state)
+
+    def VerifySession(self):
+        """Checks the user of the session in the database and returns it.
+
+        The cookie is renewed with the time of this check. Privileged actions
+        use this through the verified_session decorator, so they never depend on
+        a cookie that may be outdated. Returns None without a valid session.
+        """
+        if self._session is None:
+            return None
         try:
-            user = login_model.User.FromPrimary(self.connection, int(str(user)))
+            user = login_model.User.FromPrimary(self.connection, self._session.user)
         except uweb3.model.NotExistError:
             return None
         if user["active"] != "true":
             raise ValueError("User not active, session invalid")
+        if not self._session.token:
+            # Old style cookies can not be revoked, they get a new session.
+            self.StartSession(user)
+        else:
+            self._session = self._session.Verified(True)
+            login_model.Session.Store(self.connection_manager, self._session)
         return user
 
     def RequestInvalidcommand(self, command=None, error=None, httpcode=404):
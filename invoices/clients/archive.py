@@ -0,0 +1,74 @@
+"""Moves superseded client versions to the clientHistory table.
+
+Every change to a client adds a version to the client table. Versions that
+were replaced and are older than the retention period are moved to
+clientHistory in small batches, each in a transaction of its own. Versions
+that invoices or recurring invoices refer to are kept. Client.History still
+returns all versions.
+
+Run it from cron, for example once a day:
+
+    python -m invoices.clients.archive --days 365
+"""
+
+import argparse
+import datetime
+import sys
+import time
+
+from invoices import load_config
+from invoices.clients.model import Client
+from invoices.common import helpers as common_helpers
+from invoices.common.cache import clients as client_cache
+
+BATCH_SIZE = 1000
+RETENTION_DAYS = 365
+
+
+def archive_versions(connection, before, batch_size=BATCH_SIZE):
+    """Archives all superseded versions created before a date.
+
+    Returns:
+      int: The number of versions that were moved.
+    """
+    archived = 0
+    while True:
+        with common_helpers.transaction(connection, Client):
+            moved = Client.ArchiveVersions(connection, before, batch_size)
+        archived += moved
+        if moved < batch_size:
+            if archived:
+                client_cache.Invalidate(connection)
+            return archived
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Moves superseded client versions to clientHistory."
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=RETENTION_DAYS,
+        help="keep versions younger than this many days in the client table",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    options = load_config().options
+    connection = common_helpers.connect(options["mysql"])
+    try:
+        start = time.perf_counter()
+        before = datetime.datetime.now() - datetime.timedelta(days=args.days)
+        archived = archive_versions(connection, before, args.batch_size)
+        print(
+            f"Archived {archived} client versions in "
+            f"{time.perf_counter() - start:.1f}s."
+        )
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -58,14 +58,31 @@ class PageMaker(basepages.PageMaker):
         client.Save()
         return client
 
+    @uweb3.decorators.loggedin
+    @uweb3.decorators.ContentType("application/json")
+    @json_error_wrapper
+    def RequestClientHistory(self, client=None):
+        """Returns all versions of a client, including the archived ones.
+
+        Takes:
+          client: int
+        """
+        client_number = RequestClientSchema().load({"client": client})
+        return {
+            "versions": model.Client.History(self.connection, client_number["client"])
+        }
+
     @uweb3.decorators.loggedin
     @uweb3.decorators.checkxsrf
     @uweb3.decorators.TemplateParser("clients/clients.html")
     def RequestClientsPage(self):
+        page = self.ListPage(model.Client)
         return {
             "title": "Clients",
             "page_id": "clients",
-            "clients": list(model.Client.List(self.connection)),
+            "clients": page["records"],
+            "previous_page": page["previous_page"],
+            "next_page": page["next_page"],
         }
 
     @uweb3.decorators.loggedin
@@ -1,14 +1,59 @@
 import uweb3
 
 from invoices.common import model as common_model
+from invoices.common.cache import clients as client_cache
 
 
 class Client(common_model.RichVersionedRecord):
-    """Abstraction class for Clients stored in the database."""
+    """Abstraction class for Clients stored in the database.
+
+    Clients are read through a process wide LRU cache by ID and by client
+    number, creating or saving a client invalidates it in all processes.
+    """
 
     _RECORD_KEY = "clientNumber"
+    _IDENTITY_MAPPED = True
+    COUNT_STRATEGY = common_model.COUNT_ESTIMATE
     MIN_NAME_LENGTH = 5
     MAX_NAME_LENGTH = 100
+    # The columns that are kept for archived versions in clientHistory.
+    HISTORY_FIELDS = (
+        "ID",
+        "clientNumber",
+        "name",
+        "city",
+        "postalCode",
+        "email",
+        "telephone",
+        "address",
+        "dateCreated",
+    )
+
+    @classmethod
+    def Create(cls, connection, record):
+        client = super().Create(connection, record)
+        client_cache.Invalidate(connection)
+        return client
+
+    def Save(self, *args, **kwargs):
+        result = super().Save(*args, **kwargs)
+        client_cache.Invalidate(self.connection)
+        return result
+
+    def _RecordInsert(self, cursor):
+        # Every version gets its own creation date.
+        self.pop("dateCreated", None)
+        super()._RecordInsert(cursor)
+
+    @classmethod
+    def _LoadPrimary(cls, connection, pkey_value):
+        """Returns the client version with the given ID."""
+        record = client_cache.Get(
+            connection,
+            ("ID", int(pkey_value)),
+            lambda: dict(super(Client, cls)._LoadPrimary(connection, pkey_value)),
+        )
+        return cls(connection, dict(record))
 
     @classmethod
     def IsFirstClient(cls, connection):
@@ -20,9 +65,33 @@ class Client(common_model.RichVersionedRecord):
                 == 0
             )
 
+    @classmethod
+    def ExistingIDs(cls, connection, ids):
+        """Returns the set of the given client IDs that exist."""
+        ids = {int(x) for x in ids}
+        if not ids:
+            return set()
+        with connection as cursor:
+            found = cursor.Select(
+                table=cls.TableName(),
+                fields="ID",
+                conditions="ID IN (%s)" % ", ".join(str(x) for x in ids),
+                escape=False,
+            )
+        return {row["ID"] for row in found}
+
     @classmethod
     def FromClientNumber(cls, connection, clientnumber):
         """Returns the client belonging to the given clientnumber."""
+        record = client_cache.Get(
+            connection,
+            ("clientNumber", int(clientnumber)),
+            lambda: cls._RecordFromClientNumber(connection, clientnumber),
+        )
+        return cls(connection, dict(record))
+
+    @classmethod
+    def _RecordFromClientNumber(cls, connection, clientnumber):
         client = list(
             Client.List(
                 connection,
@@ -35,4 +104,77 @@ class Client(common_model.RichVersionedRecord):
             raise cls.NotExistError(
                 "There is no client with clientnumber %r." % clientnumber
             )
-        return cls(connection, client[0])
+        return dict(client[0])
+
+    @classmethod
+    def History(cls, connection, clientnumber):
+        """Returns all versions of a client, the oldest first.
+
+        Archived versions are read from clientHistory, they have a dateArchived
+        and no isCurrent.
+        """
+        fields = ", ".join("`%s`" % field for field in cls.HISTORY_FIELDS)
+        with connection as cursor:
+            versions = cursor.Execute(
+                """
+                SELECT %(fields)s, `isCurrent`, NULL AS `dateArchived`
+                FROM `client`
+                WHERE `clientNumber` = %(number)d
+                UNION ALL
+                SELECT %(fields)s, NULL AS `isCurrent`, `dateArchived`
+                FROM `clientHistory`
+                WHERE `clientNumber` = %(number)d
+                ORDER BY `ID`
+                """
+                % {"fields": fields, "number": int(clientnumber)}
+            )
+        if not versions:
+            raise cls.NotExistError(
+                "There is no client with clientnumber %r." % clientnumber
+            )
+        return [dict(version) for version in versions]
+
+    @classmethod
+    def ArchiveVersions(cls, connection, before, limit=1000):
+        """Moves superseded versions created before a date to clientHistory.
+
+        Versions that an invoice or a recurring invoice refers to stay in the
+        client table. Call this within a transaction.
+
+        Arguments:
+          @ connection: sqltalk.connection
+          @ before: datetime.datetime
+            Only versions created before this are archived.
+          % limit: int ~~ 1000
+            The maximum number of versions to move.
+
+        Returns:
+          int: The number of versions that were moved.
+        """
+        with connection as cursor:
+            versions = cursor.Execute(
+                """
+                SELECT `ID`
+                FROM `client`
+                WHERE `isCurrent` IS NULL
+                  AND `dateCreated` < %(before)s
+                  AND NOT EXISTS (SELECT 1 FROM `invoice`
+                                  WHERE `invoice`.`client` = `client`.`ID`)
+                  AND NOT EXISTS (SELECT 1 FROM `recurringInvoice`
+                                  WHERE `recurringInvoice`.`client` = `client`.`ID`)
+                ORDER BY `ID`
+                LIMIT %(limit)d
+                FOR UPDATE
+                """
+                % {"before": connection.EscapeValues(before), "limit": limit}
+            )
+            ids = ", ".join(str(version["ID"]) for version in versions)
+            if not ids:
+                return 0
+            fields = ", ".join("`%s`" % field for field in cls.HISTORY_FIELDS)
+            cursor.Execute(
+                "INSERT INTO `clientHistory` (%s) "
+                "SELECT %s FROM `client` WHERE `ID` IN (%s)" % (fields, fields, ids)
+            )
+            cursor.Execute("DELETE FROM `client` WHERE `ID` IN (%s)" % ids)
+        return len(versions)
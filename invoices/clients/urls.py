@@ -1,3 +1,4 @@
+from invoices.basepages import API_VERSION
 from invoices.clients import clients
 
 urls = [
@@ -8,5 +9,10 @@ urls = [
         (clients.PageMaker, "RequestRequestSaveClientPage"),
         "POST",
     ),
+    (
+        f"{API_VERSION}/clients/([0-9]+)/history",
+        (clients.PageMaker, "RequestClientHistory"),
+        "GET",
+    ),
     ("/client/(.*)", (clients.PageMaker, "RequestClientPage")),
 ]
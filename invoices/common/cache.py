@@ -0,0 +1,111 @@
+"""Process wide caches for records that rarely change."""
+
+import threading
+import time
+from collections import OrderedDict
+
+# All caches of the process, for the metrics.
+caches = []
+
+
+class VersionedCache:
+    """Read-through cache that is shared by all requests in a process.
+
+    Every cache has a version counter in the `cacheVersion` table. Invalidating
+    the cache bumps that counter, and every process compares its own version
+    with the stored one at most once every `check_interval` seconds, so all
+    worker processes drop their stale values shortly after a change.
+
+    Only plain row data should be cached, records hold on to the connection of
+    the request that loaded them. With a max_size the least recently used values
+    are dropped once the cache is full.
+    """
+
+    def __init__(self, name, check_interval=5, max_size=None):
+        self.name = name
+        self.check_interval = check_interval
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+        self._version = None
+        self._checked = 0
+        # Counts how often the values were dropped, see Get.
+        self._generation = 0
+        self._counters = dict.fromkeys(("hits", "misses", "evictions"), 0)
+        caches.append(self)
+
+    def Get(self, connection, key, loader):
+        """Returns the cached value for key, calling loader when it is missing.
+
+        Exceptions raised by the loader are passed on and nothing is cached.
+        When the cache is cleared while the loader runs its value may already be
+        stale, it is returned but not cached.
+        """
+        self._Validate(connection)
+        with self._lock:
+            if key in self._values:
+                self._counters["hits"] += 1
+                self._values.move_to_end(key)
+                return self._values[key]
+            self._counters["misses"] += 1
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._values[key] = value
+            if self.max_size is not None and len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+                self._counters["evictions"] += 1
+        return value
+
+    def Invalidate(self, connection):
+        """Clears this cache in the current process and in all other processes."""
+        with connection as cursor:
+            cursor.Execute(
+                """
+                INSERT INTO cacheVersion (name, version)
+                VALUES (%s, 1)
+                ON DUPLICATE KEY UPDATE version = version + 1
+                """
+                % connection.EscapeValues(self.name)
+            )
+        self.Clear()
+
+    def Clear(self):
+        """Clears the values cached by this process."""
+        with self._lock:
+            self._values = OrderedDict()
+            self._version = None
+            self._checked = 0
+            self._generation += 1
+
+    def Stats(self):
+        """Returns the size of the cache and its hit and miss counters."""
+        with self._lock:
+            stats = dict(self._counters, name=self.name, size=len(self._values))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _Validate(self, connection):
+        """Drops the cached values when another process invalidated the cache."""
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        with connection as cursor:
+            version = cursor.Execute(
+                "SELECT version FROM cacheVersion WHERE name = %s"
+                % connection.EscapeValues(self.name)
+            )
+        version = version[0]["version"] if version else 0
+        with self._lock:
+            if version != self._version:
+                self._values = OrderedDict()
+                self._version = version
+                self._generation += 1
+            self._checked = now
+
+
+lookup_tables = VersionedCache("lookup_tables")
+clients = VersionedCache("clients", max_size=1000)
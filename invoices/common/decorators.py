@@ -1,3 +1,4 @@
+import hmac
 from http import HTTPStatus
 
 import requests
@@ -31,6 +32,53 @@ def RequestWrapper(f):
     return wrapper
 
 
+def apikey_required(f):
+    """Decorator that only allows API requests that carry the configured apikey.
+
+    The key is read from the `apikey` field of the request body and compared to
+    the `apikey` option in the `[api]` section of the config.
+    """
+
+    def wrapper(*args, **kwargs):
+        pagemaker = args[0]
+        expected = pagemaker.options.get("api", {}).get("apikey")
+        given = pagemaker.post.get("apikey") if pagemaker.post else None
+        if not expected or not given or not hmac.compare_digest(expected, str(given)):
+            return uweb3.Response(
+                {
+                    "error": True,
+                    "errors": ["Invalid apikey"],
+                    "http_status": HTTPStatus.FORBIDDEN,
+                },
+                httpcode=HTTPStatus.FORBIDDEN,
+            )
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+def verified_session(f):
+    """Decorator for privileged actions, checks the session user in the database.
+
+    Other requests trust the session cookie until its verify interval passed,
+    these always see a user that was deactivated or removed. Without a valid
+    session the user is sent to the login page.
+    """
+
+    def wrapper(*args, **kwargs):
+        pagemaker = args[0]
+        try:
+            user = pagemaker.VerifySession()
+        except ValueError:
+            user = None
+        if user is None:
+            return pagemaker.req.Redirect("/login", httpcode=303)
+        pagemaker._user = user
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
 def json_error_wrapper(func):
     def wrapper_schema_validation(*args, **kwargs):
         try:
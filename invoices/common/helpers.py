@@ -1,6 +1,8 @@
 import decimal
 from contextlib import contextmanager
 
+from uweb3.libs.sqltalk import mysql
+
 
 def round_price(d):
     if not isinstance(d, decimal.Decimal):
@@ -31,3 +33,23 @@ def transaction(connection, cls):
         cls.autocommit(
             connection, True
         )  # This is important, if we do not turn this back on connection will not commit any queries in other requests.
+
+
+def connect(mysql_options):
+    """Opens a new database connection outside of the request cycle.
+
+    Background workers and command line tools can not use the connection that
+    uweb3 hands to the PageMaker, so they use this to connect with the same
+    settings as the application.
+
+    Arguments:
+      @ mysql_options: dict
+        The [mysql] section of the application config.
+    """
+    return mysql.Connect(
+        host=mysql_options.get("host", "localhost"),
+        user=mysql_options["user"],
+        passwd=mysql_options["password"],
+        db=mysql_options["database"],
+        charset="utf8",
+    )
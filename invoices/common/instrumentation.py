@@ -0,0 +1,236 @@
+"""Accounting of where the time of a request goes.
+
+A RequestProfile is started for every request by the PageMaker. Database
+queries are timed by InstrumentedConnection, outgoing HTTP calls by a hook on
+requests.Session, template rendering by the RequestParser and other external
+calls, such as sending mail, with the `timed` context manager. Everything is
+recorded on the profile of the current request, code that runs outside of a
+request is not affected. Queries that run through an InstrumentedConnection are
+also checked by the slow query log when it is configured.
+"""
+
+import contextlib
+import contextvars
+import time
+
+import requests
+import uweb3
+
+from invoices.common import metrics, slowqueries
+
+_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """The timings that were collected for a single request."""
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.duration = None
+        self.queries = []  # (sql, seconds)
+        self.timings = {}  # category: [count, seconds]
+        self.render_depth = 0
+
+    def AddQuery(self, sql, duration):
+        self.queries.append((sql, duration))
+        self.Add("db", duration)
+
+    def Add(self, category, duration):
+        timing = self.timings.setdefault(category, [0, 0.0])
+        timing[0] += 1
+        timing[1] += duration
+
+    def Finish(self):
+        self.duration = time.perf_counter() - self.start
+        return self
+
+    def ServerTiming(self):
+        """Returns the value for the Server-Timing response header."""
+        metrics = [
+            '%s;dur=%.1f;desc="%d calls"' % (category, seconds * 1000, count)
+            for category, (count, seconds) in sorted(self.timings.items())
+        ]
+        metrics.append("total;dur=%.1f" % ((self.duration or 0) * 1000))
+        return ", ".join(metrics)
+
+    def Summary(self):
+        parts = ["%s %s took %.0fms" % (self.method, self.path, self.duration * 1000)]
+        parts.extend(
+            "%s: %d in %.0fms" % (category, count, seconds * 1000)
+            for category, (count, seconds) in sorted(self.timings.items())
+        )
+        return ", ".join(parts)
+
+
+def start(method, path):
+    """Starts the profile of a request, returns a token for finish."""
+    return _profile.set(RequestProfile(method, path))
+
+
+def finish(token):
+    """Ends the profile that start returned the token for and returns it."""
+    profile = _profile.get()
+    _profile.reset(token)
+    return profile.Finish() if profile else None
+
+
+def current():
+    """Returns the profile of the running request, None outside of a request."""
+    return _profile.get()
+
+
+@contextlib.contextmanager
+def timed(category, dependency=None):
+    """Records the time spent in the block under category, for example "mail".
+
+    With a dependency name the call is also counted in the dependency metrics,
+    as an error when the block raised an exception.
+    """
+    begin = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        duration = time.perf_counter() - begin
+        profile = _profile.get()
+        if profile is not None:
+            profile.Add(category, duration)
+        if dependency:
+            metrics.observe_dependency(dependency, duration, error)
+
+
+def report(profile, options):
+    """Logs a request that was slower or ran more queries than configured.
+
+    Arguments:
+      @ profile: RequestProfile
+        A finished profile.
+      @ options: dict
+        The [instrumentation] section of the config, with `slow_request_ms`
+        (default 500) and `max_queries` (default 50).
+    """
+    slow = profile.duration * 1000 > float(options.get("slow_request_ms", 500))
+    chatty = len(profile.queries) > int(options.get("max_queries", 50))
+    if not slow and not chatty:
+        return False
+    uweb3.logging.warning(
+        "Slow request: %s\n%s",
+        profile.Summary(),
+        "\n".join(
+            "  %.1fms %s" % (duration * 1000, sql) for sql, duration in profile.queries
+        ),
+    )
+    return True
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times every query method that is called on it."""
+
+    QUERY_METHODS = frozenset(("Execute", "Select", "Insert", "Update", "Delete"))
+
+    def __init__(self, cursor, explain=None):
+        self._cursor = cursor
+        self._explain = explain
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if name not in self.QUERY_METHODS:
+            return attribute
+
+        def timed_query(*args, **kwargs):
+            begin = time.perf_counter()
+            result = attribute(*args, **kwargs)
+            duration = time.perf_counter() - begin
+            profile = _profile.get()
+            slow_log = slowqueries.get()
+            if profile is None and slow_log is None:
+                return result
+            sql = _query_text(name, result, args, kwargs)
+            if profile is not None:
+                profile.AddQuery(sql, duration)
+            if slow_log is not None:
+                slow = slow_log.Record(sql, duration)
+                if slow is not None and self._explain is not None:
+                    self._explain.append(slow)
+            return result
+
+        return timed_query
+
+
+class InstrumentedConnection:
+    """Connection proxy that hands out InstrumentedCursors.
+
+    Everything else is passed on to the wrapped connection, so it can be used by
+    the models like any other connection. Slow queries that are to be explained
+    wait until ExplainSlowQueries is called, so the EXPLAIN does not run in the
+    middle of a transaction.
+    """
+
+    def __init__(self, connection):
+        object.__setattr__(self, "_connection", connection)
+        object.__setattr__(self, "_slow_queries", [])
+
+    def __enter__(self):
+        return InstrumentedCursor(self._connection.__enter__(), self._slow_queries)
+
+    def __exit__(self, *exc_info):
+        return self._connection.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+
+    def ExplainSlowQueries(self):
+        """Explains and logs the slow queries that were sampled."""
+        queries = list(self._slow_queries)
+        del self._slow_queries[:]
+        for query in queries:
+            slowqueries.get().Explain(self._connection, query)
+
+
+def _query_text(method, result, args, kwargs):
+    """Returns the SQL of a query, or a description when it is not known."""
+    query = getattr(result, "query", None)
+    if query:
+        return query.decode("utf-8", "replace") if isinstance(query, bytes) else query
+    if method == "Execute" and args:
+        return str(args[0])
+    table = kwargs.get("table") or (args[0] if args else "")
+    return "%s %s" % (method.upper(), table)
+
+
+def _timed_send(send):
+    def timed_send(self, request, **kwargs):
+        begin = time.perf_counter()
+        error = True
+        try:
+            response = send(self, request, **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            duration = time.perf_counter() - begin
+            profile = _profile.get()
+            if profile is not None:
+                profile.Add("http", duration)
+            metrics.observe_dependency(
+                metrics.dependency_name(request.url), duration, error
+            )
+
+    timed_send.instrumented = True
+    return timed_send
+
+
+def install():
+    """Times all HTTP requests made through the requests library.
+
+    The calls are recorded on the request profile and in the dependency metrics.
+    """
+    if not getattr(requests.Session.send, "instrumented", False):
+        requests.Session.send = _timed_send(requests.Session.send)
@@ -0,0 +1,370 @@
+"""Request and dependency metrics in the Prometheus text format.
+
+Every process collects its metrics in memory and writes them to a file of its
+own in the metrics directory at most once per FLUSH_INTERVAL seconds. The
+/metrics page merges the files of all processes, so the numbers cover all
+workers of the pre-forking server. Counters and histograms of workers that
+exited are kept, gauges are only reported for running processes.
+"""
+
+import hmac
+import ipaddress
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FLUSH_INTERVAL = 1
+
+HELP = {
+    "invoices_request_duration_seconds": (
+        "histogram",
+        "Time spent handling requests, per route pattern.",
+    ),
+    "invoices_requests_total": ("counter", "Handled requests per status code."),
+    "invoices_dependency_duration_seconds": (
+        "histogram",
+        "Time spent on calls to external services.",
+    ),
+    "invoices_dependency_errors_total": (
+        "counter",
+        "Calls to external services that failed.",
+    ),
+    "invoices_pdf_render_seconds": ("histogram", "Time spent rendering PDFs."),
+    "invoices_db_pool_connections": (
+        "gauge",
+        "Database pool connections per state.",
+    ),
+    "invoices_db_pool_checkouts_total": (
+        "counter",
+        "Connections borrowed from the database pool.",
+    ),
+    "invoices_db_pool_timeouts_total": (
+        "counter",
+        "Requests that did not get a database connection in time.",
+    ),
+    "invoices_db_pool_wait_seconds_total": (
+        "counter",
+        "Time spent waiting for a database connection.",
+    ),
+    "invoices_cache_lookups_total": ("counter", "Cache lookups per result."),
+    "invoices_cache_evictions_total": (
+        "counter",
+        "Values dropped because a cache was full.",
+    ),
+    "invoices_cache_entries": ("gauge", "Values held by a cache."),
+}
+
+
+class MetricsStore:
+    """The metrics of the current process, see the module docstring."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._Reset()
+
+    def _Reset(self):
+        self.pid = os.getpid()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.flushed = 0
+
+    def _CheckFork(self):
+        # A forked worker starts counting from zero in a file of its own.
+        if self.pid != os.getpid():
+            self._Reset()
+
+    def Increment(self, name, labels, amount=1):
+        key = _key(name, labels)
+        with self._lock:
+            self._CheckFork()
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def SetCounter(self, name, labels, value):
+        """Sets a counter that is maintained elsewhere, like the pool counters."""
+        with self._lock:
+            self._CheckFork()
+            self.counters[_key(name, labels)] = value
+
+    def SetGauge(self, name, labels, value):
+        with self._lock:
+            self._CheckFork()
+            self.gauges[_key(name, labels)] = value
+
+    def Observe(self, name, labels, seconds):
+        key = _key(name, labels)
+        with self._lock:
+            self._CheckFork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "buckets": [0] * len(BUCKETS),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][index] += 1
+                    break
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def Flush(self, force=False):
+        """Writes the metrics of this process to its file."""
+        now = time.monotonic()
+        with self._lock:
+            self._CheckFork()
+            if not force and now - self.flushed < FLUSH_INTERVAL:
+                return
+            self.flushed = now
+            data = json.dumps(
+                {
+                    "counters": self.counters,
+                    "histograms": self.histograms,
+                    "gauges": self.gauges,
+                }
+            )
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "metrics-%d.json" % self.pid)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.directory, delete=False, suffix=".tmp"
+        ) as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+    def Collect(self):
+        """Merges the metrics files of all processes."""
+        self.Flush(force=True)
+        counters, histograms, gauges = {}, {}, {}
+        for pid, data in _read_files(self.directory):
+            for key, value in data["counters"].items():
+                counters[key] = counters.get(key, 0) + value
+            for key, value in data["histograms"].items():
+                merged = histograms.setdefault(
+                    key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+                )
+                merged["buckets"] = [
+                    a + b for a, b in zip(merged["buckets"], value["buckets"])
+                ]
+                merged["sum"] += value["sum"]
+                merged["count"] += value["count"]
+            if _alive(pid):
+                for key, value in data["gauges"].items():
+                    gauges[key] = gauges.get(key, 0) + value
+        return counters, histograms, gauges
+
+    def Render(self):
+        """Returns the metrics of all processes in the Prometheus text format."""
+        counters, histograms, gauges = self.Collect()
+        families = {}
+        for key, value in counters.items():
+            name, labels = json.loads(key)
+            families.setdefault(name, []).append(_sample(name, labels, value))
+        for key, value in gauges.items():
+            name, labels = json.loads(key)
+            families.setdefault(name, []).append(_sample(name, labels, value))
+        for key, histogram in histograms.items():
+            name, labels = json.loads(key)
+            samples = families.setdefault(name, [])
+            total = 0
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                total += count
+                bucket = dict(labels, le=repr(float(bound)))
+                samples.append(_sample(name + "_bucket", bucket, total))
+            samples.append(
+                _sample(name + "_bucket", dict(labels, le="+Inf"), histogram["count"])
+            )
+            samples.append(_sample(name + "_sum", labels, histogram["sum"]))
+            samples.append(_sample(name + "_count", labels, histogram["count"]))
+        lines = []
+        for name in sorted(families):
+            kind, description = HELP.get(name, ("untyped", name))
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s %s" % (name, kind))
+            lines.extend(families[name])
+        return "\n".join(lines) + "\n"
+
+
+class Routes:
+    """Finds the route pattern of the route table that handles a path."""
+
+    def __init__(self, urls):
+        self.routes = []
+        for route in urls:
+            method = route[2] if len(route) > 2 else None
+            self.routes.append((re.compile(route[0] + "$"), route[0], method))
+
+    def Pattern(self, path, method):
+        for regex, pattern, route_method in self.routes:
+            if route_method not in (None, method):
+                continue
+            if regex.match(path):
+                return pattern
+        return "unknown"
+
+
+_store = None
+_routes = Routes([])
+_dependencies = {}
+
+
+def configure(directory=None, urls=(), dependencies=None):
+    """Sets up the metrics of this process.
+
+    Arguments:
+      % directory: str ~~ None
+        Where the processes write their metrics, files of processes that no
+        longer run are removed. Defaults to a directory in the temp dir.
+      % urls: iterable ~~ ()
+        The route table of the application.
+      % dependencies: dict ~~ None
+        Maps host names of external services to the name used in the metrics.
+    """
+    global _store, _routes
+    directory = directory or os.path.join(
+        tempfile.gettempdir(), "invoices-metrics-%d" % os.getuid()
+    )
+    for pid, _data in _read_files(directory):
+        if not _alive(pid):
+            os.remove(os.path.join(directory, "metrics-%d.json" % pid))
+    _store = MetricsStore(directory)
+    _routes = Routes(urls)
+    _dependencies.update(dependencies or {})
+    return _store
+
+
+def store():
+    """Returns the store of this process, None when metrics are not configured."""
+    return _store
+
+
+def allowed(token, given, address):
+    """Returns whether the metrics may be shown to a client.
+
+    With a token configured the client has to send it. Without one the metrics
+    are only shown to clients on the same host.
+
+    Arguments:
+      @ token: str
+        The token from the config, may be empty.
+      @ given: str
+        The token the client sent.
+      @ address: str
+        The IP address of the client.
+    """
+    if token:
+        return hmac.compare_digest(token, given)
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+def observe_request(path, method, status, seconds):
+    if _store is None:
+        return
+    route = _routes.Pattern(path, method)
+    _store.Observe(
+        "invoices_request_duration_seconds", {"route": route, "method": method}, seconds
+    )
+    _store.Increment(
+        "invoices_requests_total",
+        {"route": route, "method": method, "status": str(status)},
+    )
+
+
+def observe_dependency(dependency, seconds, error=False):
+    if _store is None:
+        return
+    labels = {"dependency": dependency}
+    _store.Observe("invoices_dependency_duration_seconds", labels, seconds)
+    if error:
+        _store.Increment("invoices_dependency_errors_total", labels)
+
+
+def observe_pdf(seconds):
+    if _store is not None:
+        _store.Observe("invoices_pdf_render_seconds", {}, seconds)
+
+
+def observe_pool(stats):
+    """Stores the current state of the database connection pool."""
+    if _store is None:
+        return
+    for state in ("in_use", "idle", "waiting"):
+        _store.SetGauge("invoices_db_pool_connections", {"state": state}, stats[state])
+    _store.SetCounter("invoices_db_pool_checkouts_total", {}, stats["checkouts"])
+    _store.SetCounter("invoices_db_pool_timeouts_total", {}, stats["timeouts"])
+    _store.SetCounter(
+        "invoices_db_pool_wait_seconds_total", {}, stats["wait_time_total"]
+    )
+
+
+def observe_caches(caches):
+    """Stores the hit and miss counters of the process wide caches."""
+    if _store is None:
+        return
+    for stats in caches:
+        labels = {"cache": stats["name"]}
+        for result in ("hits", "misses"):
+            _store.SetCounter(
+                "invoices_cache_lookups_total",
+                dict(labels, result=result),
+                stats[result],
+            )
+        _store.SetCounter("invoices_cache_evictions_total", labels, stats["evictions"])
+        _store.SetGauge("invoices_cache_entries", labels, stats["size"])
+
+
+def dependency_name(url):
+    """Returns the metrics name of the service that url belongs to."""
+    host = urlsplit(url).hostname or "unknown"
+    return _dependencies.get(host, host)
+
+
+def _key(name, labels):
+    return json.dumps([name, labels], sort_keys=True)
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += "{%s}" % ",".join(
+            '%s="%s"' % (label, _escape(labels[label])) for label in sorted(labels)
+        )
+    return "%s %s" % (name, value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _read_files(directory):
+    try:
+        filenames = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        match = re.match(r"metrics-(\d+)\.json$", filename)
+        if not match:
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                yield int(match.group(1)), json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -1,10 +1,314 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+
 from uweb3 import model
 
+# How List counts the total of a paginated result, see count_rows.
+COUNT_EXACT = "exact"
+COUNT_CACHED = "cached"
+COUNT_ESTIMATE = "estimate"
+COUNT_CACHE_TTL = 30
+COUNT_CACHE_SIZE = 1000
+# Estimated totals above this are not counted exactly.
+ESTIMATE_THRESHOLD = 100000
+
+_max_allowed_packet = None
+_consecutive_ids = None
+_identity_map = contextvars.ContextVar("identity_map", default=None)
+
+
+def max_statement_size(connection):
+    """Returns the largest statement in bytes the MySQL server will accept.
+
+    The server setting is read once per process, a little room is kept for the
+    protocol overhead.
+    """
+    global _max_allowed_packet
+    if _max_allowed_packet is None:
+        with connection as cursor:
+            result = cursor.Execute("SELECT @@max_allowed_packet AS size")
+        _max_allowed_packet = int(result[0]["size"])
+    return _max_allowed_packet - 1024
+
+
+def consecutive_ids(connection):
+    """Returns whether a multi-row INSERT gets consecutive auto-increment IDs.
+
+    That is only promised with an auto_increment_increment of 1 and the
+    traditional or consecutive InnoDB lock mode, MySQL 8 defaults to interleaved
+    mode. The server settings are read once per process.
+    """
+    global _consecutive_ids
+    if _consecutive_ids is None:
+        with connection as cursor:
+            result = cursor.Execute(
+                "SELECT @@auto_increment_increment AS increment, "
+                "@@innodb_autoinc_lock_mode AS lock_mode"
+            )
+        increment = int(result[0]["increment"])
+        lock_mode = int(result[0]["lock_mode"])
+        _consecutive_ids = increment == 1 and lock_mode in (0, 1)
+    return _consecutive_ids
+
+
+def escape_like(value):
+    """Escapes the LIKE wildcards in value, so it only matches itself."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def start_identity_map():
+    """Starts a map in which records are loaded at most once, for a request.
+
+    Returns a token for end_identity_map.
+    """
+    return _identity_map.set({})
+
+
+def end_identity_map(token):
+    _identity_map.reset(token)
+
+
+def identity_mapped(cls, connection, pkey_value, load):
+    """Returns the record from the identity map, loading it when it is missing.
+
+    Outside of an identity map, or for classes without _IDENTITY_MAPPED, the
+    record is always loaded.
+    """
+    records = _identity_map.get()
+    if records is None or not cls._IDENTITY_MAPPED:
+        return load()
+    key = _identity_key(cls, pkey_value)
+    record = records.get(key)
+    if record is None or record.connection is not connection:
+        record = records[key] = load()
+    return record
+
+
+def _identity_key(cls, pkey_value):
+    try:
+        return (cls.TableName(), int(pkey_value))
+    except (TypeError, ValueError):
+        return (cls.TableName(), pkey_value)
+
+
+def load_related(connection, cls, key, values):
+    """Loads the records of cls whose key is one of values, in one query.
+
+    Records that are in the identity map are not loaded again, the loaded ones
+    are added to it.
+
+    Arguments:
+      @ connection: sqltalk.connection
+      @ cls: Record
+        The class of the records to load.
+      @ key: str
+        The column that values are matched against.
+      @ values: iterable
+        The foreign key values of the records.
+
+    Returns:
+      dict: The loaded records by their key value.
+    """
+    records = _identity_map.get()
+    mapped = records is not None and cls._IDENTITY_MAPPED and key == cls._PRIMARY_KEY
+    related = {}
+    missing = []
+    for value in set(values):
+        record = records.get(_identity_key(cls, value)) if mapped else None
+        if record is not None and record.connection is connection:
+            related[value] = record
+        else:
+            missing.append(value)
+    if not missing:
+        return related
+    with connection as cursor:
+        rows = cursor.Execute(
+            "SELECT * FROM `%s` WHERE `%s` IN (%s)"
+            % (
+                cls.TableName(),
+                key,
+                ", ".join(connection.EscapeValues(value) for value in missing),
+            )
+        )
+    for row in rows:
+        record = related[row[key]] = cls(connection, row)
+        if mapped:
+            records[_identity_key(cls, row[key])] = record
+    return related
+
+
+def forget_identity(record):
+    """Removes a record from the identity map, for records that change key."""
+    records = _identity_map.get()
+    if records:
+        for key in [key for key, value in records.items() if value is record]:
+            del records[key]
+
+
+class CountCache:
+    """Totals of recent count queries, per table and filter, for a short time.
+
+    At most max_size totals are kept, the least recently used are dropped
+    first. Expired totals are dropped whenever a total is added.
+    """
+
+    def __init__(self, ttl=COUNT_CACHE_TTL, max_size=COUNT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()
+
+    def Get(self, key):
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                del self._counts[key]
+                return None
+            self._counts.move_to_end(key)
+            return entry[0]
+
+    def Set(self, key, count):
+        now = time.monotonic()
+        with self._lock:
+            for old_key in [
+                old_key
+                for old_key, (_count, added) in self._counts.items()
+                if now - added > self.ttl
+            ]:
+                del self._counts[old_key]
+            self._counts[key] = (count, now)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_size:
+                self._counts.popitem(last=False)
+
+    def Clear(self):
+        with self._lock:
+            self._counts = OrderedDict()
+
+    def __len__(self):
+        return len(self._counts)
+
+
+count_cache = CountCache()
+
+
+def count_rows(cursor, tables, conditions, strategy=COUNT_EXACT, distinct=None):
+    """Returns the number of rows a filter matches.
+
+    Arguments:
+      @ cursor: sqltalk.cursor
+      @ tables: str
+        The FROM part of the query.
+      @ conditions: str
+        The WHERE part of the query.
+      % strategy: str ~~ COUNT_EXACT
+        COUNT_EXACT runs COUNT(*). COUNT_CACHED reuses the total of the same
+        filter for COUNT_CACHE_TTL seconds. COUNT_ESTIMATE uses the estimate of
+        the query planner for the table the query starts from when that is
+        above ESTIMATE_THRESHOLD, and a cached exact count below it.
+      % distinct: str ~~ None
+        Counts the distinct values of this expression instead of the rows.
+    """
+    if strategy not in (COUNT_EXACT, COUNT_CACHED, COUNT_ESTIMATE):
+        raise ValueError("Unknown count strategy %r." % strategy)
+    if strategy == COUNT_ESTIMATE:
+        plan = cursor.Execute(
+            "EXPLAIN SELECT 1 FROM %s WHERE %s" % (tables, conditions)
+        )
+        # The first row is the table the query starts from. The rows of joined
+        # tables are per row of that table, multiplying them overestimates.
+        estimate = 0
+        if plan:
+            driving = plan[0]
+            estimate = (driving["rows"] or 0) * float(driving["filtered"] or 100) / 100
+        if estimate > ESTIMATE_THRESHOLD:
+            return int(estimate)
+    key = (tables, conditions, distinct)
+    if strategy != COUNT_EXACT:
+        count = count_cache.Get(key)
+        if count is not None:
+            return count
+    count = cursor.Execute(
+        "SELECT COUNT(%s) AS `total` FROM %s WHERE %s"
+        % ("DISTINCT %s" % distinct if distinct else "*", tables, conditions)
+    )[0]["total"]
+    if strategy != COUNT_EXACT:
+        count_cache.Set(key, count)
+    return count
+
+
+def page_total(records, limit, offset):
+    """Returns the total of a paginated result when the page itself shows it.
+
+    Without a limit, and on a page that is not full, no count query is needed.
+    """
+    if limit is not None and len(records) >= limit:
+        return None
+    if not records and offset:
+        return None  # The offset is past the end.
+    return (offset or 0) + len(records)
+
 
 class RichVersionedRecord(model.VersionedRecord):
-    """Provides a richer uweb VersionedRecord class."""
+    """Provides a richer uweb VersionedRecord class.
+
+    The newest version of every record is marked with `isCurrent = 1`, older
+    versions have NULL there. A unique key on (isCurrent, record key) makes sure
+    there is only one current version and lets List read the current versions
+    straight from that index.
+    """
 
     SEARCHABLE_COLUMNS = []
+    # How List counts the total of a page, large tables use COUNT_ESTIMATE.
+    COUNT_STRATEGY = COUNT_EXACT
+    _CURRENT_FIELD = "isCurrent"
+    # Whether FromPrimary shares records within a request, see identity_mapped.
+    _IDENTITY_MAPPED = False
+
+    @classmethod
+    def FromPrimary(cls, connection, pkey_value):
+        return identity_mapped(
+            cls,
+            connection,
+            pkey_value,
+            lambda: cls._LoadPrimary(connection, pkey_value),
+        )
+
+    @classmethod
+    def _LoadPrimary(cls, connection, pkey_value):
+        """Loads a version from the database, subclasses may add caching."""
+        return super(RichVersionedRecord, cls).FromPrimary(connection, pkey_value)
+
+    def _RecordInsert(self, cursor):
+        """Inserts the record as the new current version of its record key.
+
+        The previous current version is unmarked first, which locks it, so
+        concurrent saves of the same record are serialized. New records without
+        a record key get one from uweb3, they have no previous version.
+        """
+        key = self.get(self.RecordKey())
+        if key is not None:
+            cursor.Execute(
+                """
+                UPDATE `%(table)s`
+                SET `%(current)s` = NULL
+                WHERE `%(record_key)s` = %(key)s AND `%(current)s` = 1
+                """
+                % {
+                    "table": self.TableName(),
+                    "current": self._CURRENT_FIELD,
+                    "record_key": self.RecordKey(),
+                    "key": self.connection.EscapeValues(key),
+                }
+            )
+        self[self._CURRENT_FIELD] = 1
+        # The record becomes a new version with a new ID.
+        forget_identity(self)
+        super()._RecordInsert(cursor)
 
     @classmethod
     def List(
@@ -19,6 +323,7 @@ class RichVersionedRecord(model.VersionedRecord):
         tables=None,
         escape=True,
         fields=None,
+        count=None,
     ):
         """Yields the latest Record for each versioned entry in the table.
 
@@ -44,6 +349,10 @@ class RichVersionedRecord(model.VersionedRecord):
         % search: str
           Specifies what string should be searched for in the default searchable
           database columns.
+        % count: str ~~ None
+          How the total for yield_unlimited_total_first is counted, see
+          count_rows. COUNT_STRATEGY of the class when not given. No count query
+          runs when the page shows the total.
 
         Yields:
           Record: The Record with the newest version for each versioned entry.
@@ -60,7 +369,7 @@ class RichVersionedRecord(model.VersionedRecord):
                     fields = connection.EscapeField(fields)
         if search:
             search = search.strip()
-            tables, newconditions = cls._GetColumnData(tables, search)
+            tables, newconditions = cls._GetColumnData(connection, tables, search)
             if conditions:
                 if type(conditions) == list:
                     conditions.extend(newconditions)
@@ -70,41 +379,46 @@ class RichVersionedRecord(model.VersionedRecord):
             else:
                 conditions = newconditions
         field_escape = connection.EscapeField if escape else lambda x: x
-        if yield_unlimited_total_first and limit is not None:
-            totalcount = "SQL_CALC_FOUND_ROWS"
+        current = "`%s`.`%s` = 1" % (cls.TableName(), cls._CURRENT_FIELD)
+        if not conditions:
+            conditions = [current]
+        elif type(conditions) == list:
+            conditions = [current] + conditions
         else:
-            totalcount = ""
+            conditions = [current, conditions]
         with connection as cursor:
+            tables_sql = cursor._StringTable(tables, field_escape)
+            conditions_sql = cursor._StringConditions(conditions, field_escape)
             records = cursor.Execute(
                 """
-          SELECT %(totalcount)s %(fields)s
+          SELECT %(fields)s
           FROM %(tables)s
-          JOIN (SELECT MAX(`%(primary)s`) AS `max`
-                FROM `%(table)s`
-                GROUP BY `%(record_key)s`) AS `versions`
-              ON (`%(table)s`.`%(primary)s` = `versions`.`max`)
           WHERE %(conditions)s
           %(order)s
           %(limit)s
           """
                 % {
-                    "totalcount": totalcount,
-                    "primary": cls._PRIMARY_KEY,
-                    "record_key": cls.RecordKey(),
                     "fields": fields,
-                    "table": cls.TableName(),
-                    "tables": cursor._StringTable(tables, field_escape),
-                    "conditions": cursor._StringConditions(conditions, field_escape),
+                    "tables": tables_sql,
+                    "conditions": conditions_sql,
                     "order": cursor._StringOrder(order, field_escape),
                     "limit": cursor._StringLimit(limit, offset),
                 }
             )
+            records = list(records)
+            if yield_unlimited_total_first and limit is not None:
+                total = page_total(records, limit, offset)
+                if total is None:
+                    total = count_rows(
+                        cursor,
+                        tables_sql,
+                        conditions_sql,
+                        count or cls.COUNT_STRATEGY,
+                    )
         if yield_unlimited_total_first and limit is not None:
-            with connection as cursor:
-                records.affected = cursor._Execute("SELECT FOUND_ROWS()")[0][0]
-            yield records.affected
+            yield total
         # turn sqltalk rows into model
-        records = [cls(connection, record) for record in list(records)]
+        records = [cls(connection, record) for record in records]
         for record in records:
             yield record
         if (
@@ -115,12 +429,12 @@ class RichVersionedRecord(model.VersionedRecord):
             list(cls._cacheListPreseed(records))
 
     @classmethod
-    def _GetColumnData(cls, tables, search):
+    def _GetColumnData(cls, connection, tables, search):
         """Extracts table information from the searchable columns."""
         conditions = []
-        # XXX search needs to be escaped properly
-        condition = 'like "%%%s%%" or ' % search
-        searchcondition = ""
+        pattern = "%%%s%%" % escape_like(search)
+        condition = "LIKE %s" % connection.EscapeValues(pattern)
+        searchconditions = []
         for column in cls.SEARCHABLE_COLUMNS:
             columndata = column.split(".")
             if len(columndata) == 2:
@@ -139,22 +453,38 @@ class RichVersionedRecord(model.VersionedRecord):
                     and table.TableName() != cls.TableName()
                 ):
                     tables.append(table.TableName())
-                searchcondition += "`%s`.`%s` %s" % (
-                    table.TableName(),
-                    columndata[1],
-                    condition,
+                searchconditions.append(
+                    "`%s`.`%s` %s" % (table.TableName(), columndata[1], condition)
                 )
             else:
-                searchcondition += "`%s`.`%s` %s" % (cls.TableName(), column, condition)
-        searchcondition = "(%s)" % searchcondition[:-4]
-        conditions.append(searchcondition)
+                searchconditions.append(
+                    "`%s`.`%s` %s" % (cls.TableName(), column, condition)
+                )
+        if searchconditions:
+            conditions.append("(%s)" % " OR ".join(searchconditions))
         return tables, conditions
 
 
 class RichModel(model.Record):
-    """Provides a richer uweb Record class."""
+    """Provides a richer uweb Record class.
+
+    Classes with _IDENTITY_MAPPED load a record at most once per request, both
+    through FromPrimary and as a foreign relation of another record.
+    """
 
     SEARCHABLE_COLUMNS = []
+    # How List counts the total of a page, large tables use COUNT_ESTIMATE.
+    COUNT_STRATEGY = COUNT_EXACT
+    _IDENTITY_MAPPED = False
+
+    @classmethod
+    def FromPrimary(cls, connection, pkey_value):
+        return identity_mapped(
+            cls,
+            connection,
+            pkey_value,
+            lambda: super(RichModel, cls).FromPrimary(connection, pkey_value),
+        )
 
     def PagedChildren(self, classname, *args, **kwargs):
         """Return child objects with extra argument options."""
@@ -179,6 +509,8 @@ class RichModel(model.Record):
         tables=None,
         escape=True,
         fields=None,
+        count=None,
+        eager=None,
     ):
         """Yields a Record object for every table entry.
 
@@ -204,6 +536,14 @@ class RichModel(model.Record):
           % search: str
             Specifies what string should be searched for in the default searchable
             database columns.
+          % count: str ~~ None
+            How the total for yield_unlimited_total_first is counted, see
+            count_rows. COUNT_STRATEGY of the class when not given. No count
+            query runs when the page shows the total.
+          % eager: iterable of str ~~ None
+            Foreign relations that are loaded for all records at once, with one
+            query per relation, instead of one query per record when they are
+            first used.
 
         Yields:
           Record: Database record abstraction class.
@@ -223,7 +563,7 @@ class RichModel(model.Record):
                     else cls._PRIMARY_KEY
                 ),
             )
-            tables, newconditions = cls._GetColumnData(tables, search)
+            tables, newconditions = cls._GetColumnData(connection, tables, search)
             if conditions:
                 if type(conditions) == list:
                     conditions.extend(newconditions)
@@ -244,13 +584,26 @@ class RichModel(model.Record):
                 limit=limit,
                 offset=offset,
                 order=order,
-                totalcount=yield_unlimited_total_first,
                 escape=escape,
                 group=group,
             )
+            records = list(records)
+            if yield_unlimited_total_first:
+                total = page_total(records, limit, offset)
+                if total is None:
+                    field_escape = connection.EscapeField if escape else lambda x: x
+                    total = count_rows(
+                        cursor,
+                        cursor._StringTable(tables, field_escape),
+                        cursor._StringConditions(conditions, field_escape),
+                        count or cls.COUNT_STRATEGY,
+                        distinct=group,
+                    )
         if yield_unlimited_total_first:
-            yield records.affected
-        records = [cls(connection, record) for record in list(records)]
+            yield total
+        records = [cls(connection, record) for record in records]
+        if eager:
+            cls._LoadEager(connection, records, eager)
         for record in records:
             yield record
         if hasattr(cls, "_addToCache"):
@@ -259,12 +612,137 @@ class RichModel(model.Record):
             list(cls._cacheListPreseed(records))
 
     @classmethod
-    def _GetColumnData(cls, tables, search):
+    def _LoadEager(cls, connection, records, fields):
+        """Loads the given foreign relations of records, one query per relation.
+
+        The loaded records replace the foreign keys, just like a relation that
+        is loaded when it is first used.
+        """
+        for field in fields:
+            if field in cls._FOREIGN_RELATIONS:
+                relation = cls._FOREIGN_RELATIONS[field]
+                if not relation:
+                    raise ValueError("%s has no relation %r" % (cls.__name__, field))
+                related_cls = relation["class"]
+                key = relation.get("LookupKey") or related_cls._PRIMARY_KEY
+            elif field in cls._SUBTYPES:
+                related_cls = cls._SUBTYPES[field]
+                key = related_cls._PRIMARY_KEY
+            else:
+                raise ValueError("%s has no relation %r" % (cls.__name__, field))
+            # dict.get skips Record.__getitem__, which would load the relation.
+            # Relations that were loaded already hold a record, which is a dict.
+            values = [dict.get(record, field) for record in records]
+            values = [
+                value
+                for value in values
+                if value is not None and not isinstance(value, dict)
+            ]
+            if not values:
+                continue
+            related = load_related(connection, related_cls, key, values)
+            for record in records:
+                value = dict.get(record, field)
+                if not isinstance(value, dict) and value in related:
+                    record[field] = related[value]
+
+    @classmethod
+    def InsertMany(cls, connection, records, lookup=None):
+        """Inserts records with multi-row INSERT statements.
+
+        The records are inserted as they are, _PreCreate is not called for them.
+        Rows are combined into as few statements as max_allowed_packet allows.
+
+        The IDs of the new rows are read back through the lookup field. When it
+        is not unique, rows with the same value get their IDs in insert order, so
+        nothing else should insert rows with those values at the same time.
+        Without a lookup field IDs are only derived from the first ID of a
+        statement when the server hands out consecutive IDs, see
+        consecutive_ids, otherwise every row is inserted on its own.
+
+        Arguments:
+          @ connection: object
+            Database connection to use.
+          @ records: list of dicts
+            The records to insert, these should all have the same fields.
+          % lookup: str ~~ None
+            A field of the records that identifies the inserted rows.
+
+        Returns:
+          list[int]: The IDs of the inserted records, in the order of records.
+        """
+        if not records:
+            return []
+        fields = list(records[0])
+        statement = "INSERT INTO %s (%s) VALUES " % (
+            connection.EscapeField(cls.TableName()),
+            ", ".join(connection.EscapeField(fields)),
+        )
+        if lookup is None and not consecutive_ids(connection):
+            limit = 0
+        else:
+            limit = max_statement_size(connection) - len(statement)
+        ids = []
+        batch = []
+        size = 0
+        with connection as cursor:
+            for record in records:
+                row = "(%s)" % ", ".join(
+                    connection.EscapeValues([record[field] for field in fields])
+                )
+                row_size = len(row.encode("utf-8")) + 2
+                if batch and size + row_size > limit:
+                    ids.extend(
+                        cls._InsertRows(connection, cursor, statement, batch, lookup)
+                    )
+                    batch, size = [], 0
+                batch.append((row, record))
+                size += row_size
+            ids.extend(cls._InsertRows(connection, cursor, statement, batch, lookup))
+        return ids
+
+    @classmethod
+    def _InsertRows(cls, connection, cursor, statement, batch, lookup):
+        """Executes a single multi-row INSERT and returns the new IDs."""
+        rows = ", ".join(row for row, _record in batch)
+        first = cursor.Execute(statement + rows).insertid
+        if lookup is None:
+            return range(first, first + len(batch))
+        values = [record[lookup] for _row, record in batch]
+        inserted = cursor.Execute(
+            """
+            SELECT `%(key)s` AS `ID`, `%(lookup)s` AS `value`
+            FROM `%(table)s`
+            WHERE `%(lookup)s` IN (%(values)s) AND `%(key)s` >= %(first)d
+            ORDER BY `%(key)s`
+            """
+            % {
+                "key": cls._PRIMARY_KEY,
+                "lookup": lookup,
+                "table": cls.TableName(),
+                "values": ", ".join(
+                    connection.EscapeValues(value) for value in set(values)
+                ),
+                "first": first,
+            }
+        )
+        if len(inserted) != len(batch):
+            raise ValueError(
+                "Other rows with the same %s were inserted into %s at the same time"
+                % (lookup, cls.TableName())
+            )
+        ids = {}
+        for row in inserted:
+            ids.setdefault(str(row["value"]), []).append(row["ID"])
+        return [ids[str(value)].pop(0) for value in values]
+
+    @classmethod
+    def _GetColumnData(cls, connection, tables, search):
         """Extracts table information from the searchable columns."""
         conditions = []
-        # XXX search needs to be escaped properly
-        condition = 'like "%%%s%%" or ' % search
-        searchcondition = ""
+        pattern = "%%%s%%" % escape_like(search)
+        condition = "LIKE %s" % connection.EscapeValues(pattern)
+        searchconditions = []
         for column in cls.SEARCHABLE_COLUMNS:
             columndata = column.split(".")
             if len(columndata) == 2:
@@ -286,16 +764,106 @@ class RichModel(model.Record):
                     and table.TableName() != cls.TableName()
                 ):
                     tables.append(table.TableName())
-                searchcondition += "`%s`.`%s` %s" % (
-                    table.TableName(),
-                    columndata[1],
-                    condition,
+                searchconditions.append(
+                    "`%s`.`%s` %s" % (table.TableName(), columndata[1], condition)
                 )
             else:
-                searchcondition += "`%s`.`%s` %s" % (cls.TableName(), column, condition)
-        if searchcondition:
-            searchcondition = (
-                "(%s)" % searchcondition[:-4]
-            )  # TODO use ' or '.join on search conditions instead
-            conditions.append(searchcondition)
+                searchconditions.append(
+                    "`%s`.`%s` %s" % (cls.TableName(), column, condition)
+                )
+        if searchconditions:
+            conditions.append("(%s)" % " OR ".join(searchconditions))
         return tables, conditions
+
+
+class QueuedRecord(model.Record):
+    """A record that is worked on in the background, such as an import job.
+
+    The table has a `status` column with at least the queued and running
+    states, and a `dateUpdated` column that is set on every update. Workers
+    claim records with ClaimNext, send a Heartbeat while they work on one and
+    queue records again that were left running with RequeueStale.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    STALE_AFTER = 10  # Minutes without a heartbeat after which a record is lost.
+    # Extra assignments for the claiming UPDATE, such as an attempt counter.
+    _CLAIM_UPDATES = ""
+
+    @classmethod
+    def ClaimNext(cls, connection, after=0):
+        """Claims the oldest queued record for the calling worker.
+
+        The status is only changed when the record is still queued, so when
+        multiple workers race for the same record only one of them gets it.
+
+        Arguments:
+          @ connection
+            Database connection to use.
+          % after: int ~~ 0
+            Only records with a higher ID are claimed, so a worker can run every
+            record once and leave failed ones for its next run.
+
+        Returns:
+          QueuedRecord or None: The claimed record, None when nothing is queued.
+        """
+        with connection as cursor:
+            queued = cursor.Select(
+                table=cls.TableName(),
+                fields="ID",
+                conditions='status = "%s" AND ID > %d' % (cls.QUEUED, after),
+                order=[("ID", False)],
+                limit=1,
+                escape=False,
+            )
+        if not queued:
+            return None
+        with connection as cursor:
+            claimed = cursor.Execute(
+                """
+                UPDATE %s
+                SET status = "%s"%s
+                WHERE ID = %d AND status = "%s"
+                """
+                % (
+                    cls.TableName(),
+                    cls.RUNNING,
+                    cls._CLAIM_UPDATES,
+                    queued[0]["ID"],
+                    cls.QUEUED,
+                )
+            )
+        if not claimed.affected:
+            return cls.ClaimNext(connection, after)
+        return cls.FromPrimary(connection, queued[0]["ID"])
+
+    @classmethod
+    def RequeueStale(cls, connection):
+        """Queues records again that were left running by a worker that died.
+
+        Running records send a heartbeat, see Heartbeat, so only records that
+        did not for STALE_AFTER minutes are picked up again.
+
+        Returns:
+          int: The number of records that were queued again.
+        """
+        with connection as cursor:
+            result = cursor.Execute(
+                """
+                UPDATE %s
+                SET status = "%s"
+                WHERE status = "%s"
+                  AND dateUpdated < NOW() - INTERVAL %d MINUTE
+                """
+                % (cls.TableName(), cls.QUEUED, cls.RUNNING, cls.STALE_AFTER)
+            )
+        return result.affected
+
+    def Heartbeat(self):
+        """Marks the record as alive, so it is not queued again by RequeueStale."""
+        with self.connection as cursor:
+            cursor.Execute(
+                "UPDATE %s SET dateUpdated = NOW() WHERE ID = %d"
+                % (self.TableName(), self["ID"])
+            )
@@ -0,0 +1,241 @@
+"""Bounded pool of MySQL connections that are shared by the requests of a process."""
+
+import os
+import threading
+import time
+import weakref
+from collections import deque
+
+import uweb3
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout."""
+
+
+class PooledConnection:
+    """A database connection that is owned by a ConnectionPool."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.checked_out = False
+
+
+class ConnectionPool:
+    """Hands out at most `size` connections and makes other callers wait.
+
+    Connections are checked for liveness when they are borrowed after being idle
+    for more than `check_interval` seconds, and are closed once they are older
+    than `max_lifetime` seconds so server side timeouts are never hit. The pool
+    keeps counters on its use and on the time callers spent waiting, see Stats.
+
+    A process that was forked does not use the connections of its parent, the
+    pool starts over in the child.
+    """
+
+    def __init__(
+        self, connect, size=10, timeout=5, max_lifetime=3600, check_interval=1
+    ):
+        """Sets up a pool, connections are only opened when they are needed.
+
+        Arguments:
+          @ connect: callable
+            Returns a new database connection.
+          % size: int ~~ 10
+            The maximum number of open connections.
+          % timeout: float ~~ 5
+            Seconds Checkout waits for a connection before raising PoolTimeout.
+          % max_lifetime: float ~~ 3600
+            Seconds after which a connection is closed and replaced.
+          % check_interval: float ~~ 1
+            Connections idle for longer than this are pinged before use.
+        """
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self._condition = threading.Condition()
+        self._Reset()
+
+    def _Reset(self):
+        self.pid = os.getpid()
+        self._idle = deque()
+        self._open = 0
+        self._waiting = 0
+        self._counters = dict.fromkeys(
+            (
+                "checkouts",
+                "waits",
+                "timeouts",
+                "created",
+                "recycled",
+                "broken",
+            ),
+            0,
+        )
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def Checkout(self, timeout=None):
+        """Borrows a connection, waiting when all connections are in use.
+
+        Arguments:
+          % timeout: float ~~ None
+            Overrides the timeout of the pool for this call.
+
+        Raises:
+          PoolTimeout: No connection became available in time.
+
+        Returns:
+          PooledConnection: Hand it back with Checkin when done.
+        """
+        start = time.monotonic()
+        deadline = start + (self.timeout if timeout is None else timeout)
+        with self._condition:
+            if self.pid != os.getpid():
+                self._Reset()
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeout(
+                        "No database connection available after %.1fs"
+                        % (time.monotonic() - start)
+                    )
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            waited = time.monotonic() - start
+            self._counters["checkouts"] += 1
+            if waited > 0.001:
+                self._counters["waits"] += 1
+            self._wait_time += waited
+            self._max_wait_time = max(self._max_wait_time, waited)
+
+        try:
+            if pooled is not None and not self._Usable(pooled):
+                self._Close(pooled)
+                pooled = None
+            if pooled is None:
+                pooled = PooledConnection(self.connect())
+                self._Count("created")
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        pooled.checked_out = True
+        return pooled
+
+    def Borrow(self, owner, timeout=None):
+        """Checks out a connection that also returns when owner is collected.
+
+        Arguments:
+          @ owner: object
+            The connection is checked in when this is garbage collected.
+          % timeout: float ~~ None
+            Overrides the timeout of the pool for this call.
+
+        Returns:
+          tuple(PooledConnection, weakref.finalize): Call the second to check
+          the connection in, after that collecting owner does not touch it.
+        """
+        pooled = self.Checkout(timeout=timeout)
+        return pooled, weakref.finalize(owner, self.Checkin, pooled)
+
+    def Checkin(self, pooled):
+        """Returns a borrowed connection to the pool, this may be called twice."""
+        if not pooled.checked_out:
+            return
+        pooled.checked_out = False
+        pooled.last_used = time.monotonic()
+        if self.pid != os.getpid():
+            return
+        if pooled.last_used - pooled.created > self.max_lifetime:
+            self._Count("recycled")
+            self._Close(pooled)
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            return
+        with self._condition:
+            self._idle.append(pooled)
+            self._condition.notify()
+
+    def Stats(self):
+        """Returns the current use of the pool and its counters."""
+        with self._condition:
+            stats = dict(self._counters)
+            stats.update(
+                size=self.size,
+                open=self._open,
+                idle=len(self._idle),
+                in_use=self._open - len(self._idle),
+                waiting=self._waiting,
+                wait_time_total=round(self._wait_time, 6),
+                wait_time_max=round(self._max_wait_time, 6),
+            )
+        return stats
+
+    def Close(self):
+        """Closes all idle connections."""
+        with self._condition:
+            idle, self._idle = self._idle, deque()
+            self._open -= len(idle)
+        for pooled in idle:
+            self._Close(pooled)
+
+    def _Usable(self, pooled):
+        """Returns False when the connection is too old or does not respond."""
+        now = time.monotonic()
+        if now - pooled.created > self.max_lifetime:
+            self._Count("recycled")
+            return False
+        if now - pooled.last_used < self.check_interval:
+            return True
+        try:
+            with pooled.connection as cursor:
+                cursor.Execute("SELECT 1")
+        except Exception as error:
+            uweb3.logging.warning("Dropping broken pooled connection: %s", error)
+            self._Count("broken")
+            return False
+        return True
+
+    def _Count(self, counter):
+        with self._condition:
+            self._counters[counter] += 1
+
+    @staticmethod
+    def _Close(pooled):
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+
+_pool = None
+
+
+def configure(connect, **settings):
+    """Sets up the connection pool of this process, see ConnectionPool."""
+    global _pool
+    _pool = ConnectionPool(connect, **settings)
+    return _pool
+
+
+def get():
+    """Returns the pool of this process, None when pooling is not configured."""
+    return _pool
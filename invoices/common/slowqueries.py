@@ -0,0 +1,202 @@
+"""Recording of slow database queries.
+
+Queries that run through an InstrumentedConnection and take longer than the
+threshold are logged with their duration and the code that ran them. For a
+sample of them the query plan is looked up with EXPLAIN once the request is
+done, plans that scan a whole table or need a filesort are flagged in the log.
+The log is written to a rotating file when one is configured.
+"""
+
+import logging
+import logging.handlers
+import os
+import random
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import uweb3
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_DIR = os.path.dirname(PACKAGE_DIR)
+# Frames in these files are skipped when looking for the code that ran a query.
+_INTERNAL_FILES = frozenset(
+    os.path.join(PACKAGE_DIR, "common", name)
+    for name in ("slowqueries.py", "instrumentation.py", "model.py")
+)
+
+
+class SlowQuery:
+    """A query that took longer than the threshold."""
+
+    def __init__(self, sql, duration, caller):
+        self.sql = sql
+        self.duration = duration
+        self.caller = caller
+        self.plan = None
+        self.flags = []
+
+    def Fingerprint(self):
+        """Returns the query with its literal values replaced by placeholders."""
+        return fingerprint(self.sql)
+
+    def Describe(self):
+        lines = ["%.1fms at %s" % (self.duration * 1000, self.caller)]
+        lines.extend("  ! %s" % flag for flag in self.flags)
+        lines.append("  " + " ".join(self.sql.split()))
+        return "\n".join(lines)
+
+
+class SlowQueryLog:
+    """Decides which queries are slow and writes them to the log."""
+
+    def __init__(
+        self,
+        threshold_ms=100,
+        path=None,
+        explain_sample=0,
+        explain_interval=300,
+        max_bytes=10485760,
+        backups=5,
+        max_explained=1000,
+    ):
+        """Sets up the log.
+
+        Arguments:
+          % threshold_ms: float ~~ 100
+            Queries that take at least this long are logged.
+          % path: str ~~ None
+            File to log to, rotated at max_bytes with `backups` old files. When
+            not given slow queries go to the application log.
+          % explain_sample: float ~~ 0
+            Fraction of the slow queries that is explained, none by default.
+          % explain_interval: float ~~ 300
+            Seconds before the same query, apart from its values, is explained
+            again.
+          % max_explained: int ~~ 1000
+            The amount of queries for which the last EXPLAIN is remembered, the
+            least recently explained are forgotten first.
+        """
+        self.threshold = threshold_ms / 1000
+        self.explain_sample = explain_sample
+        self.explain_interval = explain_interval
+        self.max_explained = max_explained
+        self._explained = OrderedDict()  # fingerprint: time of the last EXPLAIN
+        self._lock = threading.Lock()
+        if path:
+            self.logger = logging.getLogger("invoices.slowqueries")
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.logger.addHandler(handler)
+        else:
+            self.logger = uweb3.logging
+
+    def Record(self, sql, duration):
+        """Logs the query when it was slow.
+
+        Returns the SlowQuery instead when it should be explained first, the
+        caller then passes it to Explain once the connection is free.
+        """
+        if duration < self.threshold:
+            return None
+        query = SlowQuery(sql, duration, caller())
+        if self._ShouldExplain(query):
+            return query
+        self.Write(query)
+        return None
+
+    def Explain(self, connection, query):
+        """Adds the plan of a query and its flags, then writes it to the log."""
+        try:
+            with connection as cursor:
+                plan = cursor.Execute("EXPLAIN " + query.sql)
+            query.plan = [dict(row) for row in plan]
+        except Exception as error:
+            query.flags.append("EXPLAIN failed: %s" % error)
+        else:
+            query.flags.extend(plan_flags(query.plan))
+        self.Write(query)
+
+    def Write(self, query):
+        self.logger.warning("Slow query: %s", query.Describe())
+
+    def _ShouldExplain(self, query):
+        statement = query.sql.lstrip().upper()
+        if not statement.startswith("SELECT") or "FOR UPDATE" in statement:
+            return False
+        if random.random() >= self.explain_sample:
+            return False
+        now = time.monotonic()
+        key = query.Fingerprint()
+        with self._lock:
+            if now - self._explained.get(key, -self.explain_interval) < (
+                self.explain_interval
+            ):
+                return False
+            self._explained[key] = now
+            self._explained.move_to_end(key)
+            while len(self._explained) > self.max_explained:
+                self._explained.popitem(last=False)
+        return True
+
+
+def plan_flags(plan):
+    """Returns the problems found in the rows of an EXPLAIN."""
+    flags = []
+    for row in plan:
+        table = row.get("table") or "?"
+        extra = row.get("Extra") or ""
+        if row.get("type") == "ALL":
+            flags.append("full table scan of %s (%s rows)" % (table, row.get("rows")))
+        if "Using filesort" in extra:
+            flags.append("filesort on %s" % table)
+        if "Using temporary" in extra:
+            flags.append("temporary table for %s" % table)
+    return flags
+
+
+def fingerprint(sql):
+    sql = re.sub(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    return " ".join(sql.split())
+
+
+def caller():
+    """Returns the place in the project's code that ran the current query."""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (
+            filename.startswith(PROJECT_DIR + os.sep)
+            and "site-packages" not in filename
+            and filename not in _INTERNAL_FILES
+        ):
+            return "%s:%d in %s" % (
+                os.path.relpath(filename, PROJECT_DIR),
+                frame.lineno,
+                frame.name,
+            )
+    return "unknown"
+
+
+_log = None
+
+
+def configure(**settings):
+    """Sets up the slow query log of this process, see SlowQueryLog."""
+    global _log
+    _log = SlowQueryLog(**settings)
+    return _log
+
+
+def get():
+    """Returns the slow query log, None when it is not configured."""
+    return _log
@@ -2,16 +2,24 @@
 """Request handlers for the uWeb3 warehouse inventory software"""
 
 # standard modules
+import datetime
+import decimal
 import re
+import time
+import xml.etree.ElementTree as ElementTree
 from io import BytesIO
 from itertools import zip_longest
 
 import mt940
 import requests
+import uweb3
+from marshmallow import ValidationError
 from uweb3.libs.mail import MailSender
 from weasyprint import HTML
 
+from invoices.clients.model import Client
 from invoices.common import helpers as common_helpers
+from invoices.common import instrumentation, metrics
 from invoices.common.schemas import (
     InvoiceSchema,
     ProductSchema,
@@ -38,7 +46,7 @@ def mail_invoice(recipients, subject, body, attachments=None):
 
 
 def _mail_attachment(recipients, subject, body, attachments):
-    with MailSender() as send_mail:
+    with instrumentation.timed("mail", "smtp"), MailSender() as send_mail:
         send_mail.Attachments(
             recipients=recipients,
             subject=subject,
@@ -48,7 +56,7 @@ def _mail_attachment(recipients, subject, body, attachments):
 
 
 def _mail_text(recipients, subject, body):
-    with MailSender() as send_mail:
+    with instrumentation.timed("mail", "smtp"), MailSender() as send_mail:
         send_mail.Text(recipients=recipients, subject=subject, content=body)
 
 
@@ -141,10 +149,119 @@ def create_invoice_add_products(connection, data, products):
     return invoice
 
 
+def reconcile_payments(connection, invoice_references, progress=None):
+    """Adds a payment to every invoice that was referenced in a bank statement.
+
+    Arguments:
+      @ connection: Db connection
+      @ invoice_references: list[dict]
+        The references as returned by MT940_processor.process_files.
+      % progress: callable ~~ None
+        Called with the matched, applied and failed counts after every reference.
+
+    Returns:
+        payments (list[dict]): The references that were added as a payment.
+        failed_payments (list[dict]): The references that could not be traced back to an invoice.
+    """
+    payments = []
+    failed_payments = []
+    matched = 0
+    platform = model.PaymentPlatform.FromName(
+        connection, "ideal"
+    )  # XXX: What payment platform is this?
+
+    for invoice_ref in invoice_references:
+        try:
+            invoice = model.Invoice.FromSequenceNumber(
+                connection, invoice_ref["invoice"]
+            )
+        except (uweb3.model.NotExistError, Exception):
+            # Invoice could not be found. This could mean two things,
+            # 1. The regex matched something that looks like an invoice sequence number, but its not part of our system.
+            # 2. The transaction contains a pro-forma invoice, but this invoice was already set to paid and thus changed to a real invoice.
+            # its also possible that there was a duplicate pro-forma invoice ID in the description, but since it was already processed no reference can be found to it anymore.
+            failed_payments.append(invoice_ref)
+        else:
+            matched += 1
+            try:
+                invoice.AddPayment(platform["ID"], invoice_ref["amount"])
+            except decimal.InvalidOperation as error:
+                # The statement has an amount that is not a number. Other
+                # errors are not about this reference and fail the import.
+                uweb3.logging.error(
+                    "Could not add payment for %r: %s", invoice_ref["invoice"], error
+                )
+                failed_payments.append(invoice_ref)
+            else:
+                payments.append(invoice_ref)
+        if progress:
+            progress(matched, len(payments), len(failed_payments))
+    return payments, failed_payments
+
+
+def create_invoices_bulk(connection, items):
+    """Validates and creates many invoices with their products at once.
+
+    Invalid items are skipped, the valid ones are created with multi-row inserts
+    so this should run inside a transaction. Unlike the invoice form this does
+    not update the warehouse stock, the caller is expected to manage that.
+
+    Args:
+        connection (self.connection): Db connection
+        items (list[dict]): Invoices with the fields of the InvoiceSchema and a
+            `products` list with the fields of the ProductSchema.
+
+    Returns:
+        list[dict]: A result for every item, in the order of the items. Either
+            {index, error: False, ID, sequenceNumber} or {index, error: True, errors}.
+    """
+    invoice_schema = InvoiceSchema()
+    product_schema = ProductSchema(many=True)
+    statuses = {status.value for status in InvoiceStatus}
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError("Every invoice should be an object.")
+            invoice = invoice_schema.load(item)
+            products = product_schema.load(item.get("products") or [])
+            if not products:
+                raise ValidationError("cannot create invoice without products")
+            if invoice["status"] not in statuses:
+                raise ValidationError({"status": ["Invalid status."]})
+        except ValidationError as error:
+            results[index] = {"index": index, "error": True, "errors": error.messages}
+        else:
+            valid.append((index, invoice, products))
+
+    existing = Client.ExistingIDs(connection, {x[1]["client"] for x in valid})
+    for index, invoice, _products in valid:
+        if invoice["client"] not in existing:
+            results[index] = {
+                "index": index,
+                "error": True,
+                "errors": {"client": ["There is no client with this ID."]},
+            }
+    valid = [x for x in valid if results[x[0]] is None]
+
+    created = model.Invoice.CreateMany(connection, [x[1] for x in valid])
+    rows = []
+    for (index, _invoice, products), invoice in zip(valid, created):
+        results[index] = {"index": index, "error": False, **invoice}
+        rows.extend(dict(product, invoice=invoice["ID"]) for product in products)
+    if rows:
+        model.InvoiceProduct.CreateMany(connection, rows)
+    return results
+
+
 def to_pdf(html, filename=None):
     """Returns a PDF based on the given HTML."""
     result = BytesIO()
-    HTML(string=html).write_pdf(result)
+    begin = time.perf_counter()
+    with instrumentation.timed("pdf"):
+        HTML(string=html).write_pdf(result)
+    metrics.observe_pdf(time.perf_counter() - begin)
     if filename:
         result.filename = filename
         return result
@@ -206,6 +323,11 @@ class MT940_processor:
         """Processes the contents of all MT-940 files."""
         results = []
         for f in self.files:
+            if "path" in f:
+                # The mt940 parser needs the whole statement as a str.
+                with open(f["path"], encoding="utf-8", errors="replace") as statement:
+                    results.extend(self._regex_search(statement.read()))
+                continue
             # XXX: The content of an MT-940 file should be str. uweb3 handles this, but should we also check this?
             results.extend(self._regex_search(f["content"]))
         return results
@@ -277,3 +399,200 @@ class MT940_processor:
             }
             for x in matches
         ]
+
+
+class CAMT053_processor:
+    """Parses ISO 20022 CAMT.053 bank to customer statements.
+
+    The XML is read with iterparse, every entry is processed as soon as its end
+    tag is read and is then removed from the tree, so the memory use does not
+    grow with the size of the statement. The references that are found have
+    the same shape as the ones MT940_processor returns, so both feed the same
+    reconciliation.
+    """
+
+    INVOICE_REGEX_PATTERN = MT940_processor.INVOICE_REGEX_PATTERN
+    PATHS = {
+        "amount": "{*}Amt",
+        "credit_debit": "{*}CdtDbtInd",
+        "booking_date": "{*}BookgDt/{*}Dt",
+        "booking_datetime": "{*}BookgDt/{*}DtTm",
+        "entry_reference": "{*}AcctSvcrRef",
+        "transactions": "{*}NtryDtls/{*}TxDtls",
+        "transaction_amount": "{*}AmtDtls/{*}TxAmt/{*}Amt",
+        "transaction_reference": "{*}Refs/{*}AcctSvcrRef",
+        "end_to_end_id": "{*}Refs/{*}EndToEndId",
+        "unstructured": "{*}RmtInf/{*}Ustrd",
+        "structured": "{*}RmtInf/{*}Strd/{*}CdtrRefInf/{*}Ref",
+        "Dbtr": "{*}RltdPties/{*}Dbtr",
+        "Cdtr": "{*}RltdPties/{*}Cdtr",
+        "DbtrAcct": "{*}RltdPties/{*}DbtrAcct/{*}Id/{*}IBAN",
+        "CdtrAcct": "{*}RltdPties/{*}CdtrAcct/{*}Id/{*}IBAN",
+        "name": ".//{*}Nm",
+    }
+
+    def __init__(self, files):
+        self.files = files
+
+    @staticmethod
+    def Detect(content):
+        """Returns True when the content looks like a CAMT.053 statement."""
+        if isinstance(content, bytes):
+            content = content[:1024].decode("utf-8", "ignore")
+        return content.lstrip("\ufeff \r\n\t").startswith("<") and (
+            "camt.053" in content[:1024] or "BkToCstmrStmt" in content[:1024]
+        )
+
+    def process_files(self):
+        """Processes the contents of all CAMT.053 files.
+
+        Files that are stored on disk are parsed while they are read.
+        """
+        results = []
+        for f in self.files:
+            if "path" in f:
+                with open(f["path"], "rb") as statement:
+                    results.extend(self.iter_references(statement))
+            else:
+                results.extend(self.iter_references(f["content"]))
+        return results
+
+    def iter_references(self, source):
+        """Yields the invoice references of every entry in a statement.
+
+        Arguments:
+          @ source: str / bytes / file object
+            The statement, file objects are read incrementally.
+
+        Yields:
+          dict: {
+            invoice: sequenceNumber,
+            amount: value,
+            customer_reference: The end-to-end id of the transaction,
+            entry_date: The booking date of the entry,
+            transaction_id: The reference the bank gave to the entry,
+            counterparty: The name of the other party,
+            counterparty_account: The IBAN of the other party,
+            remittance_information: The description of the transaction,
+          }
+        """
+        if isinstance(source, str):
+            source = source.encode("utf-8")
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+
+        paths = None
+        entry_tag = None
+        parents = []
+        for event, element in ElementTree.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if paths is None:
+                    # Every element shares the namespace of the document, the
+                    # paths are expanded once instead of using {*} wildcards.
+                    namespace = element.tag[: -len(_local_name(element.tag))]
+                    paths = {
+                        name: path.replace("{*}", namespace)
+                        for name, path in self.PATHS.items()
+                    }
+                    entry_tag = f"{namespace}Ntry"
+                parents.append(element)
+                continue
+            parents.pop()
+            if element.tag != entry_tag:
+                continue
+            yield from self._entry_references(element, paths)
+            element.clear()
+            if parents:
+                parents[-1].remove(element)
+
+    def _entry_references(self, entry, paths):
+        """Returns the invoice references found in a single statement entry.
+
+        An entry can contain multiple transactions when the bank booked a batch,
+        each of those is matched on its own.
+        """
+        entry_amount = entry.findtext(paths["amount"])
+        debit = entry.findtext(paths["credit_debit"]) == "DBIT"
+        booking_date = entry.findtext(paths["booking_date"]) or entry.findtext(
+            paths["booking_datetime"]
+        )
+        party = "Cdtr" if debit else "Dbtr"
+
+        results = []
+        for transaction in entry.findall(paths["transactions"]) or [entry]:
+            amount = (
+                transaction.findtext(paths["transaction_amount"])
+                or transaction.findtext(paths["amount"])
+                or entry_amount
+            )
+            end_to_end_id = transaction.findtext(paths["end_to_end_id"])
+            remittance = " ".join(
+                element.text.strip()
+                for path in ("unstructured", "structured")
+                for element in transaction.iterfind(paths[path])
+                if element.text
+            )
+            invoices = []
+            for match in re.finditer(
+                self.INVOICE_REGEX_PATTERN, f"{remittance} {end_to_end_id or ''}"
+            ):
+                if match.group() not in invoices:
+                    invoices.append(match.group())
+            if not invoices:
+                continue
+            counterparty = transaction.find(paths[party])
+            results.extend(
+                {
+                    "invoice": invoice,
+                    "amount": f"-{amount}" if debit else amount,
+                    "customer_reference": end_to_end_id,
+                    "entry_date": _parse_date(booking_date),
+                    "transaction_id": entry.findtext(paths["entry_reference"])
+                    or transaction.findtext(paths["transaction_reference"]),
+                    "counterparty": counterparty.findtext(paths["name"])
+                    if counterparty is not None
+                    else None,
+                    "counterparty_account": transaction.findtext(paths[f"{party}Acct"]),
+                    "remittance_information": remittance,
+                }
+                for invoice in invoices
+            )
+        return results
+
+
+def process_statements(files):
+    """Returns the invoice references from uploaded bank statements.
+
+    Every file is handed to the processor that can read its format, CAMT.053
+    XML or MT-940. A file has either its content or the path it is stored at.
+    """
+    camt053_files = []
+    mt940_files = []
+    for f in files:
+        if CAMT053_processor.Detect(_statement_head(f)):
+            camt053_files.append(f)
+        else:
+            mt940_files.append(f)
+    return (
+        MT940_processor(mt940_files).process_files()
+        + CAMT053_processor(camt053_files).process_files()
+    )
+
+
+def _statement_head(f):
+    """Returns the start of a statement, enough to detect its format."""
+    if "path" not in f:
+        return f["content"]
+    with open(f["path"], "rb") as statement:
+        return statement.read(1024)
+
+
+def _local_name(tag):
+    """Strips the XML namespace from an element tag."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.date.fromisoformat(value[:10])
@@ -12,12 +12,22 @@ import requests
 import uweb3
 
 from invoices import basepages
-from invoices.common.decorators import NotExistsErrorCatcher, RequestWrapper
+from invoices.common.decorators import (
+    NotExistsErrorCatcher,
+    RequestWrapper,
+    apikey_required,
+    json_error_wrapper,
+)
 from invoices.common.helpers import transaction
 from invoices.common.schemas import PaymentSchema, WarehouseStockRefundSchema
-from invoices.invoice import helpers, model
+from invoices.invoice import helpers, jobs, model
 from invoices.mollie import model as mollie_model
 
+_RUNNING_JOB_STATES = (
+    model.ImportJobStatus.QUEUED.value,
+    model.ImportJobStatus.RUNNING.value,
+)
+
 
 class WarehouseAPIException(Exception):
     """Error that was raised during an API call to warehouse."""
@@ -33,10 +43,11 @@ class PageMaker(basepages.PageMaker):
     @uweb3.decorators.checkxsrf
     @uweb3.decorators.TemplateParser("invoices/invoices.html")
     def RequestInvoicesPage(self):
+        page = self.ListPage(model.Invoice, order=["sequenceNumber"])
         return {
-            "invoices": list(
-                model.Invoice.List(self.connection, order=["sequenceNumber"])
-            ),
+            "invoices": page["records"],
+            "previous_page": page["previous_page"],
+            "next_page": page["next_page"],
         }
 
     @uweb3.decorators.loggedin
@@ -132,6 +143,28 @@ class PageMaker(basepages.PageMaker):
 
         return self.req.Redirect("/invoices", httpcode=303)
 
+    @uweb3.decorators.ContentType("application/json")
+    @json_error_wrapper
+    @apikey_required
+    def RequestBulkCreateInvoices(self):
+        """Creates all invoices in the `invoices` list of the request body.
+
+        All valid invoices are created in a single transaction, the response has
+        a result for every invoice telling its new sequenceNumber or the errors.
+        """
+        items = self.post.get("invoices")
+        if not isinstance(items, list):
+            raise marshmallow.exceptions.ValidationError(
+                {"invoices": ["Should be a list of invoices."]}
+            )
+        with transaction(self.connection, model.Invoice):
+            results = helpers.create_invoices_bulk(self.connection, items)
+        return {
+            "created": sum(not result["error"] for result in results),
+            "failed": sum(result["error"] for result in results),
+            "results": results,
+        }
+
     @uweb3.decorators.TemplateParser("invoices/invoice.html")
     @NotExistsErrorCatcher
     def RequestInvoiceDetails(self, sequence_number):
@@ -204,43 +237,44 @@ class PageMaker(basepages.PageMaker):
     @uweb3.decorators.loggedin
     @uweb3.decorators.checkxsrf
     @uweb3.decorators.TemplateParser("invoices/mt940.html")
-    def RequestMt940(self, payments=[], failed_invoices=[]):
+    def RequestMt940(self, payments=[], failed_invoices=[], job=None):
         return {
             "payments": payments,
             "failed_invoices": failed_invoices,
+            "job": job,
+            "polling": bool(job and job["status"] in _RUNNING_JOB_STATES),
+            "job_error": job["error"] if job else None,
             "mt940_preview": True,
         }
 
     @uweb3.decorators.loggedin
     @uweb3.decorators.checkxsrf
     def RequestUploadMt940(self):
+        """Queues the uploaded statements and redirects to the job progress page."""
         # TODO: File validation.
-        payments = []
-        failed_payments = []
-        found_invoice_references = helpers.MT940_processor(
-            self.files.get("fileupload", [])
-        ).process_files()
-
-        for invoice_ref in found_invoice_references:
-            try:
-                invoice = model.Invoice.FromSequenceNumber(
-                    self.connection, invoice_ref["invoice"]
-                )
-            except (uweb3.model.NotExistError, Exception):
-                # Invoice could not be found. This could mean two things,
-                # 1. The regex matched something that looks like an invoice sequence number, but its not part of our system.
-                # 2. The transaction contains a pro-forma invoice, but this invoice was already set to paid and thus changed to a real invoice.
-                # its also possible that there was a duplicate pro-forma invoice ID in the description, but since it was already processed no reference can be found to it anymore.
-                failed_payments.append(invoice_ref)
-                continue
-
-            platform = model.PaymentPlatform.FromName(
-                self.connection, "ideal"
-            )  # XXX: What payment platform is this?
-            invoice.AddPayment(platform["ID"], invoice_ref["amount"])
-            payments.append(invoice_ref)
-
-        return self.RequestMt940(payments=payments, failed_invoices=failed_payments)
+        job = model.ImportJob.Enqueue(self.connection, self.files.get("fileupload", []))
+        jobs.start_worker(self.options["mysql"]).notify()
+        return self.req.Redirect(f'/invoices/mt940/{job["ID"]}', httpcode=303)
+
+    @uweb3.decorators.loggedin
+    @uweb3.decorators.checkxsrf
+    @NotExistsErrorCatcher
+    def RequestMt940Job(self, job):
+        """Shows the progress of an import job, or its results once it is done."""
+        job = model.ImportJob.FromPrimary(self.connection, int(job))
+        results = job.Results()
+        return self.RequestMt940(
+            payments=results["payments"],
+            failed_invoices=results["failed_invoices"],
+            job=job,
+        )
+
+    @uweb3.decorators.loggedin
+    @uweb3.decorators.ContentType("application/json")
+    @json_error_wrapper
+    def RequestMt940JobProgress(self, job):
+        """Returns the status and progress counters of an import job."""
+        return model.ImportJob.FromPrimary(self.connection, int(job)).Progress()
 
     @uweb3.decorators.loggedin
     @uweb3.decorators.checkxsrf
@@ -250,7 +284,7 @@ class PageMaker(basepages.PageMaker):
         invoice = model.Invoice.FromSequenceNumber(self.connection, sequenceNumber)
         return {
             "invoice": invoice,
-            "payments": invoice.GetPayments(),
+            "payments": invoice.GetPayments(eager=("platform",)),
             "totals": invoice.Totals(),
             "mollie_payments": list(
                 mollie_model.MollieTransaction.List(
@@ -0,0 +1,102 @@
+"""Background processing of uploaded bank statements."""
+
+import os
+import threading
+import time
+
+import uweb3
+
+from invoices.common import helpers as common_helpers
+from invoices.invoice import helpers, model
+
+PROGRESS_INTERVAL = 1  # Seconds between two progress updates of a running job.
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_worker(mysql_options):
+    """Returns the import worker of this process, starting it when needed.
+
+    Every process runs its own worker, a worker that was inherited through a
+    fork is not running in the child so a new one is started there.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None or _worker.pid != os.getpid() or not _worker.is_alive():
+            _worker = ImportWorker(mysql_options)
+            _worker.start()
+        return _worker
+
+
+def run_job(connection, job):
+    """Parses the statements of an import job and reconciles their payments.
+
+    The progress counters on the job are written to the database at most once
+    every PROGRESS_INTERVAL seconds, together with a heartbeat, and once more
+    when the job is finished.
+    """
+    references = helpers.process_statements(job.Files())
+    job["parsed"] = len(references)
+    job.Save()
+    job.Heartbeat()
+
+    last_update = [time.monotonic()]
+
+    def progress(matched, applied, failed):
+        job["matched"], job["applied"], job["failed"] = matched, applied, failed
+        if time.monotonic() - last_update[0] >= PROGRESS_INTERVAL:
+            job.Save()
+            job.Heartbeat()
+            last_update[0] = time.monotonic()
+
+    payments, failed_payments = helpers.reconcile_payments(
+        connection, references, progress=progress
+    )
+    job.Finish(payments, failed_payments)
+
+
+class ImportWorker(threading.Thread):
+    """Runs queued import jobs on its own database connection.
+
+    Jobs that were left running by a worker that died are queued again when
+    the worker starts and on every poll.
+    """
+
+    def __init__(self, mysql_options, poll_interval=5):
+        super().__init__(name="invoices-import-worker", daemon=True)
+        self.mysql_options = mysql_options
+        self.poll_interval = poll_interval
+        self.pid = os.getpid()
+        self.wakeup = threading.Event()
+        self.connection = None
+
+    def notify(self):
+        """Wakes the worker up so a newly queued job is started right away."""
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            try:
+                if self.connection is None:
+                    self.connection = common_helpers.connect(self.mysql_options)
+                model.ImportJob.RequeueStale(self.connection)
+                while self.process_next():
+                    pass
+            except Exception as error:
+                uweb3.logging.error("Import worker failed: %s", error)
+                self.connection = None
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def process_next(self):
+        """Claims and runs a single job, returns False when the queue is empty."""
+        job = model.ImportJob.ClaimNext(self.connection)
+        if job is None:
+            return False
+        try:
+            run_job(self.connection, job)
+        except Exception as error:
+            uweb3.logging.error("Import job %d failed: %s", job["ID"], error)
+            job.Fail(error)
+        return True
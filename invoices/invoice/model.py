@@ -1,5 +1,9 @@
 import datetime
 import decimal
+import json
+import os
+import tempfile
+import threading
 import time
 from enum import Enum
 
@@ -11,6 +15,7 @@ from uweb3.model import Record
 
 from invoices.clients.model import Client
 from invoices.common import model as common_model
+from invoices.common.cache import lookup_tables
 from invoices.common.helpers import round_price
 
 PRO_FORMA_PREFIX = "PF"
@@ -25,12 +30,32 @@ class InvoiceStatus(str, Enum):
     CANCELED = "canceled"
 
 
-class Companydetails(Record):
-    """Abstraction class for companyDetails stored in the database."""
+class Companydetails(common_model.RichModel):
+    """Abstraction class for companyDetails stored in the database.
+
+    A new record is created for every change of the company details, so the
+    newest record is looked up through the process wide lookup cache.
+    """
+
+    _IDENTITY_MAPPED = True
+
+    @classmethod
+    def Create(cls, connection, record):
+        companydetails = super().Create(connection, record)
+        lookup_tables.Invalidate(connection)
+        return companydetails
 
     @classmethod
     def HighestNumber(cls, connection):
         """Returns the ID for the newest companydetails."""
+        return lookup_tables.Get(
+            connection,
+            (cls.TableName(), "highest"),
+            lambda: cls._HighestNumber(connection),
+        )
+
+    @classmethod
+    def _HighestNumber(cls, connection):
         with connection as cursor:
             number = cursor.Select(
                 fields="max(ID) AS maxid", table=cls.TableName(), escape=False
@@ -39,10 +64,50 @@ class Companydetails(Record):
             return number[0]["maxid"]
         return 0
 
+    @classmethod
+    def Current(cls, connection):
+        """Returns the newest companydetails, or None when there are none yet."""
+        record = lookup_tables.Get(
+            connection,
+            (cls.TableName(), "current"),
+            lambda: cls._CurrentRecord(connection),
+        )
+        if record is None:
+            return None
+        return cls(connection, dict(record))
+
+    @classmethod
+    def _CurrentRecord(cls, connection):
+        highest = cls.HighestNumber(connection)
+        if not highest:
+            return None
+        return dict(cls.FromPrimary(connection, highest))
+
 
 class InvoiceProduct(common_model.RichModel):
     """Abstraction class for Products that are linked to an invoice"""
 
+    FIELDS = ("invoice", "name", "price", "vat_percentage", "quantity")
+
+    @classmethod
+    def CreateMany(cls, connection, products):
+        """Creates products with as few INSERT statements as possible.
+
+        Arguments:
+          @ connection
+            Database connection to use.
+          @ products: list of mappings
+            The products to create, every product holds the ID of its invoice.
+
+        Returns:
+          list[int]: The IDs of the created products, in the given order.
+        """
+        return cls.InsertMany(
+            connection,
+            [{field: product[field] for field in cls.FIELDS} for product in products],
+            lookup="invoice",
+        )
+
     def Totals(self):
         """Read the price from the database and create the vat amount."""
         self["vat_amount"] = (self["price"] * self["quantity"] / 100) * self[
@@ -57,6 +122,7 @@ class Invoice(common_model.RichModel):
         "contract": None,
         "client": {"class": Client, "loader": "FromPrimary", "LookupKey": "ID"},
     }
+    COUNT_STRATEGY = common_model.COUNT_ESTIMATE
 
     def _PreCreate(self, cursor):
         super(Invoice, self)._PreCreate(cursor)
@@ -96,15 +162,84 @@ class Invoice(common_model.RichModel):
           Invoice: the newly created invoice.
         """
         status = record.get("status", InvoiceStatus.NEW.value)
-        if status and status == InvoiceStatus.RESERVATION:
-            record.setdefault(
-                "sequenceNumber", ProFormaSequenceTable.NextProFormaNumber(connection)
+        reserved = "sequenceNumber" not in record
+        if reserved and status and status == InvoiceStatus.RESERVATION:
+            record["sequenceNumber"] = ProFormaSequenceTable.NextProFormaNumber(
+                connection
             )
-        else:
-            record.setdefault("sequenceNumber", cls.NextNumber(connection))
+        elif reserved:
+            record["sequenceNumber"] = cls.NextNumber(connection)
         record.setdefault("companyDetails", Companydetails.HighestNumber(connection))
         record.setdefault("dateDue", cls.CalculateDateDue())
-        return super(Invoice, cls).Create(connection, record)
+        try:
+            return super(Invoice, cls).Create(connection, record)
+        except Exception:
+            if reserved:
+                # Give the number back so the numbering stays without gaps.
+                SequenceCounter.ReleaseNumber(connection, record["sequenceNumber"])
+            raise
+
+    @classmethod
+    def CreateMany(cls, connection, records):
+        """Creates multiple invoices with a single multi-row INSERT.
+
+        The sequence numbers for all invoices are reserved with one statement
+        per counter, this should run inside a transaction so a failed insert also
+        gives the reserved numbers back.
+
+        Arguments:
+          @ connection
+            Database connection to use.
+          @ records: list of mappings
+            The invoices to create, as loaded by the InvoiceSchema.
+
+        Returns:
+          list[dict]: The ID and sequenceNumber of every created invoice, in the
+            order of the given records.
+        """
+        if not records:
+            return []
+        year = int(time.strftime("%Y"))
+        pro_forma = [x.get("status") == InvoiceStatus.RESERVATION for x in records]
+        next_number = {}
+        for name, count in (
+            (SequenceCounter.INVOICE, pro_forma.count(False)),
+            (SequenceCounter.PRO_FORMA, pro_forma.count(True)),
+        ):
+            if count:
+                next_number[name] = SequenceCounter.Reserve(
+                    connection, name, count=count, year=year
+                )
+
+        companydetails = Companydetails.HighestNumber(connection)
+        date_due = cls.CalculateDateDue()
+        rows = []
+        for record, is_pro_forma in zip(records, pro_forma):
+            if is_pro_forma:
+                number = next_number[SequenceCounter.PRO_FORMA]
+                next_number[SequenceCounter.PRO_FORMA] += 1
+                sequence_number = "%s-%s-%03d" % (PRO_FORMA_PREFIX, year, number)
+            else:
+                number = next_number[SequenceCounter.INVOICE]
+                next_number[SequenceCounter.INVOICE] += 1
+                sequence_number = "%s-%03d" % (year, number)
+            rows.append(
+                {
+                    "sequenceNumber": sequence_number,
+                    "companydetails": companydetails,
+                    "dateDue": date_due,
+                    "title": record["title"].strip(" ")[:80],
+                    "description": record["description"],
+                    "client": record["client"],
+                    "status": record.get("status", InvoiceStatus.NEW.value),
+                }
+            )
+        # The IDs are read back by the unique sequence numbers.
+        ids = cls.InsertMany(connection, rows, lookup="sequenceNumber")
+        return [
+            {"ID": invoice_id, "sequenceNumber": row["sequenceNumber"]}
+            for invoice_id, row in zip(ids, rows)
+        ]
 
     def ProFormaToRealInvoice(self):
         """Changes a pro forma invoice to an actual invoice.
@@ -142,26 +277,18 @@ class Invoice(common_model.RichModel):
     @classmethod
     def NextNumber(cls, connection):
         """Returns the sequenceNumber for the next invoice to create."""
-        with connection as cursor:
-            current_max = cursor.Select(
-                table=cls.TableName(),
-                fields="sequenceNumber",
-                conditions=[
-                    "YEAR(dateCreated) = YEAR(NOW())",
-                    f'sequenceNumber NOT LIKE "{PRO_FORMA_PREFIX}-%"',
-                ],
-                limit=1,
-                order=[("sequenceNumber", True)],
-                escape=False,
-            )
-        if current_max:
-            year, sequence = current_max[0][0].split("-")
-            return "%s-%03d" % (year, int(sequence) + 1)
-        return "%s-%03d" % (time.strftime("%Y"), 1)
+        year = int(time.strftime("%Y"))
+        number = SequenceCounter.Reserve(connection, SequenceCounter.INVOICE, year=year)
+        return "%s-%03d" % (year, number)
 
     @classmethod
     def List(cls, connection, *args, **kwds):
+        # Invoice lists show the client and company of every invoice.
+        kwds.setdefault("eager", ("client", "companydetails"))
         invoices = list(super().List(connection, *args, **kwds))
+        total = []
+        if kwds.get("yield_unlimited_total_first"):
+            total = [invoices.pop(0)]
         today = pytz.utc.localize(datetime.datetime.utcnow())
         for invoice in invoices:
             invoice["totals"] = invoice.Totals()
@@ -176,7 +303,7 @@ class Invoice(common_model.RichModel):
                 invoice["overdue"] = "overdue"
             else:
                 invoice["overdue"] = ""
-        return invoices
+        return total + invoices
 
     def Totals(self):
         """Read the price from the database and create the vat amount."""
@@ -254,16 +381,27 @@ class Invoice(common_model.RichModel):
                           quantity: The amount of products
                         }
                       ]
+
+        Returns:
+          list[int]: The IDs of the created products.
         """
         for product in products:
             product["invoice"] = self[
                 "ID"
             ]  # Set the product to the current invoice ID.
-            InvoiceProduct.Create(self.connection, product)
+        return InvoiceProduct.CreateMany(self.connection, products)
+
+    def GetPayments(self, eager=None):
+        """Returns the payments of this invoice.
 
-    def GetPayments(self):
+        Arguments:
+          % eager: iterable of str ~~ None
+            Relations of the payments to load at once, see RichModel.List.
+        """
         return list(
-            InvoicePayment.List(self.connection, conditions=[f'invoice = {self["ID"]}'])
+            InvoicePayment.List(
+                self.connection, conditions=[f'invoice = {self["ID"]}'], eager=eager
+            )
         )
 
     def AddPayment(self, platformID, amount):
@@ -279,10 +417,24 @@ class Invoice(common_model.RichModel):
         )
 
 
-class PaymentPlatform(Record):
+class PaymentPlatform(common_model.RichModel):
+    _IDENTITY_MAPPED = True
+
     @classmethod
     def FromName(cls, connection, name):
-        name = connection.EscapeValues(name)
+        """Returns the payment platform with the given name.
+
+        The platforms are read through the process wide lookup cache.
+        """
+        record = lookup_tables.Get(
+            connection,
+            (cls.TableName(), name),
+            lambda: cls._RecordFromName(connection, name),
+        )
+        return cls(connection, dict(record))
+
+    @classmethod
+    def _RecordFromName(cls, connection, name):
         with connection as cursor:
             platform = cursor.Execute(
                 """
@@ -290,11 +442,11 @@ class PaymentPlatform(Record):
         FROM paymentPlatform
         WHERE name = %s
       """
-                % (name)
+                % connection.EscapeValues(name)
             )
-        if not name:
+        if not platform:
             raise cls.NotExistError("Invalid name")
-        return cls(connection, platform[0])
+        return dict(platform[0])
 
 
 class InvoicePayment(common_model.RichModel):
@@ -308,12 +460,195 @@ class InvoicePayment(common_model.RichModel):
     }
 
 
+class SequenceCounter(Record):
+    """Per year counters that hand out invoice sequence numbers.
+
+    Numbers are reserved with a single atomic statement, so concurrent requests
+    can never receive the same number. Callers must run Reserve inside a
+    transaction: the counter row then stays locked until it is committed, and
+    a rolled back invoice does not leave a gap in the numbering. Outside a
+    transaction the number is committed right away, and is lost if creating
+    the invoice fails afterwards.
+    """
+
+    INVOICE = "invoice"
+    PRO_FORMA = "proforma"
+
+    @classmethod
+    def Reserve(cls, connection, name, count=1, year=None):
+        """Increments a counter and returns the first of the reserved numbers.
+
+        Arguments:
+          @ connection
+            Database connection to use.
+          @ name: str
+            The counter to increment, INVOICE or PRO_FORMA.
+          % count: int ~~ 1
+            The amount of consecutive numbers to reserve.
+          % year: int ~~ None
+            The year of the counter, defaults to the current year.
+
+        Returns:
+          int: The first reserved number, the others follow consecutively.
+        """
+        year = year or int(time.strftime("%Y"))
+        with connection as cursor:
+            cursor.Execute(
+                """
+                INSERT INTO %(table)s (name, year, n)
+                VALUES (%(name)s, %(year)d, LAST_INSERT_ID(%(count)d))
+                ON DUPLICATE KEY UPDATE n = LAST_INSERT_ID(n + %(count)d)
+                """
+                % {
+                    "table": cls.TableName(),
+                    "name": connection.EscapeValues(name),
+                    "year": year,
+                    "count": count,
+                }
+            )
+            last = cursor.Execute("SELECT LAST_INSERT_ID() AS n")[0]["n"]
+        return last - count + 1
+
+    @classmethod
+    def Release(cls, connection, name, first, count=1, year=None):
+        """Hands reserved numbers back when nothing was reserved after them.
+
+        Returns:
+          bool: True when the numbers were given back, False when a later number
+            was already reserved and the released numbers are lost.
+        """
+        year = year or int(time.strftime("%Y"))
+        with connection as cursor:
+            released = cursor.Execute(
+                """
+                UPDATE %(table)s
+                SET n = %(previous)d
+                WHERE name = %(name)s AND year = %(year)d AND n = %(last)d
+                """
+                % {
+                    "table": cls.TableName(),
+                    "name": connection.EscapeValues(name),
+                    "year": year,
+                    "previous": first - 1,
+                    "last": first + count - 1,
+                }
+            )
+        return bool(released.affected)
+
+    @classmethod
+    def ReleaseNumber(cls, connection, sequence_number):
+        """Releases the number of an invoice that could not be created."""
+        parts = sequence_number.split("-")
+        name = cls.PRO_FORMA if parts[0] == PRO_FORMA_PREFIX else cls.INVOICE
+        year, number = int(parts[-2]), int(parts[-1])
+        if not cls.Release(connection, name, number, year=year):
+            uweb3.logging.warning(
+                "Sequence number %s was not used and can not be reused.",
+                sequence_number,
+            )
+
+
+class BlockAllocator:
+    """Hands out numbers from blocks that this process reserved ahead of time.
+
+    Reserving a block of numbers at once means the counter row is only locked
+    once per block instead of for every invoice, which matters when several
+    application nodes create invoices at the same time. The blocks are reserved
+    on a connection of their own so they are committed right away, regardless
+    of the transaction of the request.
+
+    Numbers that are reserved but not used are lost when the process stops,
+    so this must only be used for numbers that may have gaps, such as pro forma
+    numbers. Legal invoice numbers always come from SequenceCounter.Reserve in
+    the transaction that creates the invoice.
+    """
+
+    def __init__(self, name, block_size, connect):
+        """
+        Arguments:
+          @ name: str
+            The SequenceCounter to reserve the blocks from.
+          @ block_size: int
+            The amount of numbers to reserve at once.
+          @ connect: callable
+            Returns a new database connection.
+        """
+        self.name = name
+        self.block_size = block_size
+        self.connect = connect
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = os.getpid()
+        self._year = None
+        self._next = self._last = 0
+
+    def Next(self):
+        """Returns the year and number of the next number from the current block."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # The block belongs to the process that we were forked from.
+                self._pid = os.getpid()
+                self._connection = None
+                self._year = None
+            year = int(time.strftime("%Y"))
+            if year != self._year or self._next > self._last:
+                self._ReserveBlock(year)
+            number = self._next
+            self._next += 1
+            return year, number
+
+    def Close(self):
+        """Gives the unused numbers back, or logs them when that is not possible."""
+        with self._lock:
+            if self._pid == os.getpid():
+                self._ReleaseBlock()
+            self._connection = None
+
+    def _ReserveBlock(self, year):
+        self._ReleaseBlock()
+        if self._connection is None:
+            self._connection = self.connect()
+        first = SequenceCounter.Reserve(
+            self._connection, self.name, count=self.block_size, year=year
+        )
+        self._year, self._next, self._last = year, first, first + self.block_size - 1
+
+    def _ReleaseBlock(self):
+        if self._year is None or self._next > self._last:
+            return
+        unused = self._last - self._next + 1
+        if SequenceCounter.Release(
+            self._connection, self.name, self._next, count=unused, year=self._year
+        ):
+            uweb3.logging.info(
+                "Returned unused %s numbers %d-%d of %d.",
+                self.name,
+                self._next,
+                self._last,
+                self._year,
+            )
+        else:
+            uweb3.logging.warning(
+                "Unused %s numbers %d-%d of %d are skipped.",
+                self.name,
+                self._next,
+                self._last,
+                self._year,
+            )
+        self._year = None
+
+
 class ProFormaSequenceTable(Record):
-    """This table is used to keep track of the current pro forma sequencenumber.
-    This is needed to prevent MT-940 payments from former pro forma invoices
-    being added to new pro forma invoices.
+    """Hands out the sequence numbers for pro forma invoices.
+
+    Pro forma numbers are never reused, this is needed to prevent MT-940
+    payments from former pro forma invoices being added to new pro forma
+    invoices. They are not legal invoice numbers and may have gaps, so they can
+    be handed out from a BlockAllocator when one is configured.
     """
 
+    allocator = None
+
     @classmethod
     def NextProFormaNumber(cls, connection):
         """Generate a new sequence number for a pro forma invoice and return its value.
@@ -321,33 +656,168 @@ class ProFormaSequenceTable(Record):
         Returns:
             str: The next sequenceNumber for a pro forma invoice.
         """
-        with connection as cursor:
-            record = cursor.Select(table=cls.TableName(), limit=1)
+        if cls.allocator:
+            year, number = cls.allocator.Next()
+        else:
+            year = int(time.strftime("%Y"))
+            number = SequenceCounter.Reserve(
+                connection, SequenceCounter.PRO_FORMA, year=year
+            )
+        return "%s-%s-%03d" % (PRO_FORMA_PREFIX, year, number)
+
+
+class ImportJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
 
-        if record:
-            current_max = cls(connection, record[0])
-            current_max.SetToNextNum()
-            return current_max["sequenceNumber"]
-        return cls.Create(connection)["sequenceNumber"]
+class ImportJob(common_model.QueuedRecord):
+    """Abstraction class for bank statement imports that run in the background.
+
+    The uploaded files are written to `directory` and the job only keeps their
+    paths, so any worker process on the host can pick it up and parse the files
+    without loading them into memory. The progress counters are updated while
+    the job runs and the matched and failed payments are stored once the job is
+    done.
+    """
+
+    PROGRESS_FIELDS = ("parsed", "matched", "applied", "failed")
+    # Where uploaded statements wait for a worker, see configure_imports.
+    directory = os.path.join(tempfile.gettempdir(), "invoices-imports")
 
     @classmethod
-    def Create(cls, connection):
-        """Create a record to keep track of the current pro forma invoice sequence number"""
-        if list(cls.List(connection)):
-            raise ValueError(
-                "Only one record is needed to keep track of the pro forma sequence number."
+    def Enqueue(cls, connection, files):
+        """Writes the uploaded files to disk and queues a new import job for them.
+
+        Arguments:
+          @ connection
+            Database connection to use.
+          @ files: list[dict]
+            The uploaded files, as found in the PageMaker.files attribute.
+
+        Returns:
+          ImportJob: the newly created job.
+        """
+        os.makedirs(cls.directory, exist_ok=True)
+        stored = []
+        try:
+            for f in files:
+                handle, path = tempfile.mkstemp(suffix=".statement", dir=cls.directory)
+                stored.append({"filename": f.get("filename"), "path": path})
+                content = f["content"]
+                if isinstance(content, str):
+                    content = content.encode("utf-8")
+                with os.fdopen(handle, "wb") as spool:
+                    spool.write(content)
+            return cls.Create(
+                connection,
+                {"status": ImportJobStatus.QUEUED.value, "files": json.dumps(stored)},
             )
-        return super().Create(
+        except Exception:
+            _remove_files(stored)
+            raise
+
+    def Files(self):
+        """Returns the filename and the path of every uploaded file."""
+        return json.loads(self["files"])
+
+    def Progress(self):
+        """Returns the job status and its progress counters."""
+        progress = {field: self[field] for field in self.PROGRESS_FIELDS}
+        progress["ID"] = self["ID"]
+        progress["status"] = self["status"]
+        progress["error"] = self["error"]
+        return progress
+
+    def Results(self):
+        """Returns the stored payments and failed payments of a finished job."""
+        if not self["results"]:
+            return {"payments": [], "failed_invoices": []}
+        return json.loads(self["results"])
+
+    def Finish(self, payments, failed_payments):
+        """Stores the results and marks the job as done.
+
+        The uploaded files are removed, they are no longer needed once the
+        results are stored.
+        """
+        self["results"] = json.dumps(
+            {"payments": payments, "failed_invoices": failed_payments}, default=str
+        )
+        self["status"] = ImportJobStatus.DONE.value
+        self._DropFiles()
+
+    def Fail(self, error):
+        self["error"] = str(error)[:255]
+        self["status"] = ImportJobStatus.FAILED.value
+        self._DropFiles()
+
+    def _DropFiles(self):
+        files = self.Files()
+        self["files"] = "[]"
+        self.Save()
+        _remove_files(files)
+
+
+def _remove_files(files):
+    """Removes the uploaded files of an import job that are still on disk."""
+    for f in files:
+        try:
+            os.remove(f["path"])
+        except FileNotFoundError:
+            pass
+
+
+class InvoiceTaskType(str, Enum):
+    MAIL = "mail"
+    WAREHOUSE = "warehouse"
+
+
+class InvoiceTaskStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class InvoiceTask(common_model.QueuedRecord):
+    """Work that has to be done for an invoice after it was created.
+
+    Tasks are stored in the same transaction that creates the invoice, so the
+    mail and the warehouse update are never lost nor done for an invoice that
+    was rolled back. A failing task is retried until MAX_ATTEMPTS is reached.
+    """
+
+    MAX_ATTEMPTS = 5
+    STALE_AFTER = 15
+    _CLAIM_UPDATES = ", attempts = attempts + 1"
+
+    @classmethod
+    def Enqueue(cls, connection, invoice, task):
+        """Queues a task of the given InvoiceTaskType for an invoice."""
+        return cls.Create(
             connection,
             {
-                "sequenceNumber": "%s-%s-%03d"
-                % (PRO_FORMA_PREFIX, time.strftime("%Y"), 1)
+                "invoice": int(invoice),
+                "task": InvoiceTaskType(task).value,
+                "status": InvoiceTaskStatus.QUEUED.value,
             },
         )
 
-    def SetToNextNum(self):
-        prefix, year, sequence = self["sequenceNumber"].split("-")
-        self["sequenceNumber"] = "%s-%s-%03d" % (prefix, year, int(sequence) + 1)
+    def Finish(self):
+        self["error"] = None
+        self["status"] = InvoiceTaskStatus.DONE.value
+        self.Save()
+
+    def Fail(self, error):
+        """Stores the error and queues the task again when it has attempts left."""
+        self["error"] = str(error)[:255]
+        if self["attempts"] < self.MAX_ATTEMPTS:
+            self["status"] = InvoiceTaskStatus.QUEUED.value
+        else:
+            self["status"] = InvoiceTaskStatus.FAILED.value
         self.Save()
 
 
@@ -0,0 +1,86 @@
+"""Runs the work that is queued for new invoices, see model.InvoiceTask."""
+
+import uweb3
+
+from invoices import basepages
+from invoices.invoice import helpers, model
+
+
+class WarehouseUpdateError(Exception):
+    """The warehouse did not accept a stock update."""
+
+
+def mail_invoice(invoice, parser):
+    """Mails the invoice as a PDF to its client."""
+    html = parser.Parse(
+        "invoices/invoice.html",
+        invoice=invoice,
+        products=invoice.Products(),
+        totals=invoice.Totals(),
+    )
+    helpers.mail_invoice(
+        recipients=invoice["client"]["email"],
+        subject="Your invoice",
+        body=parser.Parse("email/invoice.txt"),
+        attachments=(helpers.to_pdf(html, filename="invoice.pdf"),),
+    )
+
+
+def update_warehouse_stock(invoice, options):
+    """Lowers the warehouse stock by the products on the invoice."""
+    products = [
+        {"name": product["name"], "quantity": product["quantity"]}
+        for product in invoice.Products()
+    ]
+    response = helpers.warehouse_stock_update_request(
+        options["general"]["warehouse_api"],
+        options["general"]["apikey"],
+        invoice,
+        products,
+    )
+    if response.status_code != 200:
+        raise WarehouseUpdateError(response.text)
+
+
+def run_task(connection, task, options, parser):
+    invoice = model.Invoice.FromPrimary(connection, task["invoice"])
+    if task["task"] == model.InvoiceTaskType.MAIL:
+        mail_invoice(invoice, parser)
+    elif task["task"] == model.InvoiceTaskType.WAREHOUSE:
+        update_warehouse_stock(invoice, options)
+
+
+def process_tasks(connection, options):
+    """Runs every queued task once, failed tasks are retried on the next call.
+
+    Arguments:
+      @ connection
+        Database connection to use.
+      @ options: dict
+        The application config, for the warehouse API settings.
+
+    Returns:
+      tuple(int, int): The number of finished and failed tasks.
+    """
+    model.InvoiceTask.RequeueStale(connection)
+    parser = basepages.shared_parser()
+    done = failed = last = 0
+    while True:
+        task = model.InvoiceTask.ClaimNext(connection, after=last)
+        if task is None:
+            return done, failed
+        last = task["ID"]
+        try:
+            run_task(connection, task, options, parser)
+        except Exception as error:
+            uweb3.logging.error(
+                "Task %s for invoice %d failed: %s",
+                task["task"],
+                task["invoice"],
+                error,
+            )
+            task.Fail(error)
+            failed += 1
+        else:
+            task.Finish()
+            done += 1
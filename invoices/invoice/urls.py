@@ -1,3 +1,4 @@
+from invoices.basepages import API_VERSION
 from invoices.invoice import invoices
 
 urls = [
@@ -18,12 +19,23 @@ urls = [
         (invoices.PageMaker, "RequestInvoiceReservationToNew"),
         "POST",
     ),
+    (
+        f"{API_VERSION}/invoices/bulk",
+        (invoices.PageMaker, "RequestBulkCreateInvoices"),
+        "POST",
+    ),
     ("/invoice/payments/mollie/(.*)", (invoices.PageMaker, "AddMolliePaymentRequest")),
     ("/invoice/payments/(.*)", (invoices.PageMaker, "ManagePayments"), "GET"),
     ("/invoice/payments/(.*)", (invoices.PageMaker, "AddPayment"), "POST"),
     ("/invoice/(.*)", (invoices.PageMaker, "RequestInvoiceDetails"), "GET"),
     ("/invoices/cancel", (invoices.PageMaker, "RequestInvoiceCancel"), "POST"),
     ("/invoices/mt940", (invoices.PageMaker, "RequestMt940"), "GET"),
+    ("/invoices/mt940/([0-9]+)", (invoices.PageMaker, "RequestMt940Job"), "GET"),
     ("/invoices/upload", (invoices.PageMaker, "RequestUploadMt940"), "POST"),
+    (
+        f"{API_VERSION}/invoices/import/([0-9]+)",
+        (invoices.PageMaker, "RequestMt940JobProgress"),
+        "GET",
+    ),
     ("/pdfinvoice/(.*)", (invoices.PageMaker, "RequestPDFInvoice")),
 ]
@@ -4,7 +4,7 @@ import uweb3
 from invoices import basepages
 from invoices.common.schemas import CompanyDetailsSchema
 from invoices.invoice import model as invoice_model
-from invoices.login import model
+from invoices.login import model, passwords
 
 
 class PageMaker(basepages.PageMaker):
@@ -33,7 +33,7 @@ class PageMaker(basepages.PageMaker):
         if self.user:
             message = ""
             if "action" in self.post:
-                session = model.Session(self.connection)
+                session = model.Session(self.connection_manager)
                 session.Delete()
                 return self.req.Redirect("/login")
         return {"message": message}
@@ -48,19 +48,25 @@ class PageMaker(basepages.PageMaker):
             if self.post.getfirst("url", "").startswith("/")
             else "/"
         )
+        email = self.post.getfirst("email", "")
         try:
+            # Floods are turned away before any password is hashed.
+            passwords.throttle().Check(self.req.env.get("REMOTE_ADDR", ""), email)
             self._user = model.User.FromLogin(
                 self.connection,
-                self.post.getfirst("email"),
-                self.post.getfirst("password"),
+                email,
+                self.post.getfirst("password", ""),
             )
-            model.Session.Create(self.connection, int(self.user), path="/")
+            self.StartSession(self.user)
             print("login successful.", self.post.getfirst("email"))
             # redirect 303 to make sure we GET the next page, not post again to avoid leaking login details.
             return self.req.Redirect(url, httpcode=303)
         except model.User.NotExistError as error:
             self.parser.RegisterTag("loginerror", "%s" % error)
             print("login failed.", self.post.getfirst("email"))
+        except (passwords.LoginThrottled, passwords.HasherBusy) as error:
+            self.parser.RegisterTag("loginerror", "%s" % error)
+            uweb3.logging.warning("Login refused for %s: %s", email, error)
         return self.RequestLogin(url)
 
     @uweb3.decorators.checkxsrf
@@ -116,5 +122,5 @@ class PageMaker(basepages.PageMaker):
                 "general", "warehouse_api", self.post.getfirst("warehouse_api")
             )
             self.config.Update("general", "apikey", self.post.getfirst("apikey"))
-            model.Session.Create(self.connection, int(user), path="/")
+            self.StartSession(user)
             return self.req.Redirect("/", httpcode=301)
@@ -1,7 +1,21 @@
+import datetime
+import secrets
+import time
+
 from passlib.hash import pbkdf2_sha256
 from uweb3 import model
 
-__all__ = ["User", "Session"]
+from invoices.common.cache import VersionedCache
+from invoices.login import passwords
+
+__all__ = ["User", "Session", "SessionState", "SessionUser", "SessionRevocation"]
+
+# Seconds a login lasts.
+SESSION_LIFETIME = 7 * 24 * 3600
+# Seconds after which the user of a session is checked in the database again.
+VERIFY_INTERVAL = 300
+
+revoked_sessions = VersionedCache("revoked_sessions")
 
 
 class User(model.Record):
@@ -22,7 +36,7 @@ class User(model.Record):
         if generate_password_hash:
             if len(record["password"]) < 8:
                 raise ValueError("password too short, 8 characters minimal.")
-            record["password"] = pbkdf2_sha256.hash(record["password"])
+            record["password"] = passwords.hasher().Hash(record["password"])
         return super().Create(connection, record)
 
     @classmethod
@@ -61,7 +75,17 @@ class User(model.Record):
 
     @classmethod
     def FromLogin(cls, connection, email, password):
-        """Returns the user with the given login details."""
+        """Returns the user with the given login details.
+
+        The password is verified on the threads of the password hasher. When the
+        stored hash was made with another work factor it is replaced.
+
+        Raises:
+          NotExistError:
+            The login details are not valid.
+          passwords.HasherBusy:
+            Too many passwords are being verified right now.
+        """
         user = list(
             cls.List(
                 connection,
@@ -71,6 +95,7 @@ class User(model.Record):
                 ),
             )
         )
+        hasher = passwords.hasher()
         if not user:
             # fake a login attempt, and slow down, even though we know its never going
             # to end in a valid login, we dont want to let anyone know the account
@@ -78,18 +103,23 @@ class User(model.Record):
             if connection.debug:
                 print(
                     "password for non existant user would have been: ",
-                    pbkdf2_sha256.hash(password),
+                    hasher.Hash(password),
                 )
+            hasher.DummyVerify(password)
             raise cls.NotExistError("Invalid login, or inactive account.")
-        if pbkdf2_sha256.verify(password, user[0]["password"]):
-            return user[0]
-        raise cls.NotExistError("Invalid password")
+        valid, new_hash = hasher.Verify(password, user[0]["password"])
+        if not valid:
+            raise cls.NotExistError("Invalid password")
+        if new_hash:
+            user[0]["password"] = new_hash
+            user[0].Save()
+        return user[0]
 
     def UpdatePassword(self, password):
         """Hashes the password and stores it in the database"""
         if len(password) < 8:
             raise ValueError("password too short, 8 characters minimal.")
-        self["password"] = pbkdf2_sha256.hash(password)
+        self["password"] = passwords.hasher().Hash(password)
         self.Save()
 
     def _PreCreate(self, cursor):
@@ -110,5 +140,147 @@ class User(model.Record):
         )
 
 
+class SessionState:
+    """What the session cookie says about its user.
+
+    The cookie holds the user ID, whether the user was active, when the session
+    expires and when the user was last checked in the database, so most
+    requests do not need the user table. The random token identifies the
+    session in the revocation list.
+    """
+
+    def __init__(self, user, active, expires, verified, token):
+        self.user = user
+        self.active = active
+        self.expires = expires
+        self.verified = verified
+        self.token = token
+
+    @classmethod
+    def New(cls, user, active, lifetime=SESSION_LIFETIME):
+        now = int(time.time())
+        return cls(user, active, now + lifetime, now, secrets.token_hex(16))
+
+    @classmethod
+    def FromCookie(cls, value):
+        """Returns the state stored in a cookie, None for an old style cookie.
+
+        Old style cookies only hold the user ID, they are replaced once the user
+        was checked.
+        """
+        parts = str(value).split(":")
+        if len(parts) != 5:
+            return None
+        user, active, expires, verified, token = parts
+        return cls(int(user), active == "1", int(expires), int(verified), token)
+
+    def Expired(self, now=None):
+        return (now or time.time()) >= self.expires
+
+    def NeedsVerification(self, interval=VERIFY_INTERVAL, now=None):
+        return (now or time.time()) - self.verified >= interval
+
+    def Verified(self, active, now=None):
+        """Returns this state after the user was checked in the database."""
+        return SessionState(
+            self.user, active, self.expires, int(now or time.time()), self.token
+        )
+
+    def __str__(self):
+        return "%d:%d:%d:%d:%s" % (
+            self.user,
+            self.active,
+            self.expires,
+            self.verified,
+            self.token,
+        )
+
+
+class SessionUser(dict):
+    """The user of a session, as far as the session cookie knows.
+
+    Only ID and active are known without the database, the full user record is
+    loaded when any other field is used.
+    """
+
+    def __init__(self, connection, state):
+        super().__init__(ID=state.user, active="true" if state.active else "false")
+        self.connection = connection
+        self._user = None
+
+    def __int__(self):
+        return self["ID"]
+
+    def __missing__(self, field):
+        if self._user is None:
+            self._user = User.FromPrimary(self.connection, self["ID"])
+        return self._user[field]
+
+
+class SessionRevocation(model.Record):
+    """Sessions that were logged out before they expired.
+
+    Every process keeps the tokens of all revoked sessions in memory. Revoking a
+    session invalidates that cache, so other processes reject it within the
+    check interval of the cache.
+    """
+
+    @classmethod
+    def Revoke(cls, connection, state):
+        """Adds a session to the list and drops the sessions that expired."""
+        with connection as cursor:
+            cursor.Execute("DELETE FROM sessionRevocation WHERE expires < NOW()")
+            cursor.Execute(
+                "INSERT IGNORE INTO sessionRevocation (token, expires) VALUES (%s, %s)"
+                % (
+                    connection.EscapeValues(state.token),
+                    connection.EscapeValues(
+                        datetime.datetime.fromtimestamp(state.expires)
+                    ),
+                )
+            )
+        revoked_sessions.Invalidate(connection)
+
+    @classmethod
+    def IsRevoked(cls, connection, token):
+        return token in revoked_sessions.Get(
+            connection, "tokens", lambda: cls._Tokens(connection)
+        )
+
+    @classmethod
+    def _Tokens(cls, connection):
+        with connection as cursor:
+            rows = cursor.Execute(
+                "SELECT token FROM sessionRevocation WHERE expires >= NOW()"
+            )
+        return frozenset(row["token"] for row in rows)
+
+
 class Session(model.SecureCookie):
-    """Provides a model to request the secure cookie named 'session'"""
+    """Provides a model to request the secure cookie named 'session'
+
+    The cookie holds a SessionState, it is signed so users cannot change it.
+    """
+
+    def __init__(self, connection, *args, **kwds):
+        super().__init__(connection, *args, **kwds)
+        self.database = connection
+
+    @classmethod
+    def Start(cls, connection, user, lifetime=SESSION_LIFETIME):
+        """Logs in an active user, returns the state of the new session."""
+        state = SessionState.New(int(user), user["active"] == "true", lifetime)
+        cls.Create(connection, str(state), path="/")
+        return state
+
+    @classmethod
+    def Store(cls, connection, state):
+        """Replaces the cookie with an updated state of the same session."""
+        cls.Create(connection, str(state), path="/")
+
+    def Delete(self):
+        """Logs out, the session is revoked so a copy of the cookie is useless."""
+        state = SessionState.FromCookie(str(self))
+        if state is not None:
+            SessionRevocation.Revoke(self.database, state)
+        super().Delete()
@@ -0,0 +1,180 @@
+"""Password hashing on a bounded thread pool, and throttling of login attempts.
+
+Hashing a password takes a lot of CPU on purpose. Logins are verified on a few
+worker threads, so a burst of attempts can not occupy every request thread,
+and attempts are throttled per IP address and per account before anything is
+hashed. Both are kept per process.
+"""
+
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+
+from passlib.context import CryptContext
+from passlib.hash import pbkdf2_sha256
+
+
+class HasherBusy(Exception):
+    """Too many passwords are waiting to be hashed."""
+
+
+class LoginThrottled(Exception):
+    """Too many login attempts from an address or for an account."""
+
+
+class TokenBucket:
+    """Allows `capacity` attempts per key, refilled at `rate` per second.
+
+    Only the `max_keys` most recently used keys are remembered, a key that was
+    dropped starts with a full bucket again.
+    """
+
+    def __init__(self, capacity, rate, max_keys=10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key: (tokens, time of the last update)
+
+    def Take(self, key, now=None):
+        """Takes a token for key, returns False when the bucket is empty."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+
+class LoginThrottle:
+    """Token buckets for login attempts per IP address and per account.
+
+    The buckets are kept per process, every worker of the pre-forking server
+    allows the configured attempts on its own.
+    """
+
+    def __init__(
+        self,
+        ip_attempts=20,
+        ip_per_minute=10,
+        account_attempts=5,
+        account_per_minute=1,
+    ):
+        self.addresses = TokenBucket(ip_attempts, ip_per_minute / 60)
+        self.accounts = TokenBucket(account_attempts, account_per_minute / 60)
+
+    def Check(self, address, account):
+        """Counts an attempt, raises LoginThrottled when there were too many."""
+        if not self.addresses.Take(address):
+            raise LoginThrottled("Too many login attempts, try again later.")
+        if not self.accounts.Take(account.strip().lower()):
+            raise LoginThrottled("Too many login attempts, try again later.")
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords on a bounded pool of threads.
+
+    Hashes with another work factor than the configured rounds still verify,
+    Verify then also returns a new hash so the caller can store it.
+    """
+
+    def __init__(self, workers=2, queue_size=16, timeout=10, rounds=None):
+        """Sets up the hasher, the threads are started when they are needed.
+
+        Arguments:
+          % workers: int ~~ 2
+            Passwords that are hashed at the same time.
+          % queue_size: int ~~ 16
+            Passwords that may wait for a worker, more raise HasherBusy.
+          % timeout: float ~~ 10
+            Seconds a caller waits for its result before HasherBusy is raised.
+          % rounds: int ~~ None
+            The work factor of pbkdf2_sha256, its passlib default when not set.
+        """
+        rounds = rounds or pbkdf2_sha256.default_rounds
+        self.context = CryptContext(
+            schemes=["pbkdf2_sha256"],
+            pbkdf2_sha256__default_rounds=rounds,
+            pbkdf2_sha256__min_desired_rounds=rounds,
+            pbkdf2_sha256__max_desired_rounds=rounds,
+        )
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="passwords"
+        )
+
+    def Hash(self, password):
+        return self._Run(self.context.hash, password)
+
+    def Verify(self, password, stored):
+        """Checks a password against its stored hash.
+
+        Returns:
+          tuple(bool, str): Whether the password matches, and a new hash when
+          the stored one should be replaced, otherwise None.
+        """
+        return self._Run(self.context.verify_and_update, password, stored)
+
+    def DummyVerify(self, password):
+        """Takes as long as Verify, for accounts that do not exist."""
+        self._Run(self.context.dummy_verify, password)
+        return False
+
+    def Close(self):
+        self._executor.shutdown(wait=False)
+
+    def _Run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many logins at once, try again later.")
+        try:
+            future = self._executor.submit(function, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _future: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            raise HasherBusy("Too many logins at once, try again later.")
+
+
+_hasher = None
+_throttle = None
+_lock = threading.Lock()
+
+
+def configure(hasher=None, throttle=None):
+    """Replaces the hasher and throttle of this process."""
+    global _hasher, _throttle
+    with _lock:
+        if hasher is not None:
+            if _hasher is not None:
+                _hasher.Close()
+            _hasher = hasher
+        if throttle is not None:
+            _throttle = throttle
+
+
+def hasher():
+    """Returns the password hasher of this process, with defaults when not set."""
+    global _hasher
+    with _lock:
+        if _hasher is None:
+            _hasher = PasswordHasher()
+        return _hasher
+
+
+def throttle():
+    """Returns the login throttle of this process, with defaults when not set."""
+    global _throttle
+    with _lock:
+        if _throttle is None:
+            _throttle = LoginThrottle()
+        return _throttle
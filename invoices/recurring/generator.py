@@ -0,0 +1,137 @@
+"""Creates the invoices of all recurring invoice templates that are due.
+
+Every template is handled in a transaction of its own that creates the
+invoice, queues its mail and warehouse tasks and moves the template to its
+next run. A run that is interrupted can simply be started again, templates
+that were handled are no longer due and the others are picked up. Periods
+that were missed are caught up with one invoice per period.
+
+Run it from cron, for example once an hour:
+
+    python -m invoices.recurring.generator
+"""
+
+import argparse
+import datetime
+import sys
+import time
+
+import uweb3
+
+from invoices import load_config
+from invoices.common import helpers as common_helpers
+from invoices.invoice import model as invoice_model
+from invoices.invoice import tasks
+from invoices.recurring.model import RecurringInvoice
+
+BATCH_SIZE = 500
+
+
+def generate_invoice(connection, template_id, date):
+    """Creates the invoice for a single due template.
+
+    Returns:
+      Invoice or None: The new invoice, None when the template is not due
+        anymore, for example because another generator handled it already.
+    """
+    with common_helpers.transaction(connection, RecurringInvoice):
+        template = RecurringInvoice.Lock(connection, template_id)
+        if template is None or not template.IsDue(date):
+            return None
+        # The template refers to the client version it was made for, the
+        # invoice goes to the current version of that client.
+        client = invoice_model.Client.FromClientNumber(
+            connection, template["client"]["clientNumber"]
+        )
+        invoice = invoice_model.Invoice.Create(
+            connection,
+            {
+                "client": client.key,
+                "title": template["title"],
+                "description": template["description"],
+                "status": template["status"],
+            },
+        )
+        invoice.AddProducts(
+            [product.InvoiceProduct() for product in template.Products()]
+        )
+        if template["mail"]:
+            invoice_model.InvoiceTask.Enqueue(
+                connection, invoice["ID"], invoice_model.InvoiceTaskType.MAIL
+            )
+        if template["updateStock"]:
+            invoice_model.InvoiceTask.Enqueue(
+                connection, invoice["ID"], invoice_model.InvoiceTaskType.WAREHOUSE
+            )
+        template.Advance(invoice)
+    return invoice
+
+
+def generate_due(connection, date=None, batch_size=BATCH_SIZE):
+    """Creates the invoices for all templates that are due on date.
+
+    Arguments:
+      @ connection
+        Database connection to use.
+      % date: datetime.date ~~ None
+        The date to generate the invoices for, defaults to today.
+      % batch_size: int ~~ BATCH_SIZE
+        The number of due templates that is read at once.
+
+    Returns:
+      tuple(int, list[int]): The number of created invoices and the IDs of the
+        templates that failed.
+    """
+    date = date or datetime.date.today()
+    created = 0
+    failed = []
+    while True:
+        due = RecurringInvoice.Due(connection, date, limit=batch_size, exclude=failed)
+        if not due:
+            return created, failed
+        for template_id in due:
+            try:
+                if generate_invoice(connection, template_id, date) is not None:
+                    created += 1
+            except Exception as error:
+                uweb3.logging.error(
+                    "Recurring invoice %d could not be created: %s", template_id, error
+                )
+                failed.append(template_id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Creates the invoices of recurring invoice templates."
+    )
+    parser.add_argument(
+        "--date",
+        type=datetime.date.fromisoformat,
+        help="create the invoices that are due on this date, defaults to today",
+    )
+    parser.add_argument(
+        "--skip-tasks",
+        action="store_true",
+        help="only queue the mails and warehouse updates of the new invoices",
+    )
+    args = parser.parse_args(argv)
+
+    options = load_config().options
+    connection = common_helpers.connect(options["mysql"])
+    try:
+        start = time.perf_counter()
+        created, failed = generate_due(connection, args.date)
+        print(
+            f"Created {created} invoices in {time.perf_counter() - start:.1f}s, "
+            f"{len(failed)} templates failed."
+        )
+        if not args.skip_tasks:
+            done, failed_tasks = tasks.process_tasks(connection, options)
+            print(f"Ran {done} tasks, {failed_tasks} failed.")
+    finally:
+        connection.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+"""Templates for invoices that are sent to a client on a fixed interval."""
+
+import calendar
+import datetime
+from enum import Enum
+
+import uweb3
+
+from invoices.clients.model import Client
+from invoices.common import model as common_model
+from invoices.invoice.model import InvoiceStatus
+
+
+class RecurringPeriod(str, Enum):
+    WEEK = "week"
+    MONTH = "month"
+    QUARTER = "quarter"
+    YEAR = "year"
+
+
+PERIOD_MONTHS = {
+    RecurringPeriod.MONTH: 1,
+    RecurringPeriod.QUARTER: 3,
+    RecurringPeriod.YEAR: 12,
+}
+
+
+def add_months(date, months):
+    """Adds months to a date, the day is capped to the length of the month."""
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    return date.replace(
+        year=year, month=month, day=min(date.day, calendar.monthrange(year, month)[1])
+    )
+
+
+class RecurringInvoice(common_model.RichModel):
+    """Abstraction class for recurring invoice templates.
+
+    The run dates are calculated from the start date and the number of runs so
+    far, a template that starts on the 31st keeps running at the end of every
+    month. `nextRun` holds the next run date so due templates can be found
+    through an index.
+    """
+
+    _FOREIGN_RELATIONS = {
+        "client": {"class": Client, "loader": "FromPrimary", "LookupKey": "ID"},
+    }
+
+    @classmethod
+    def Create(cls, connection, record):
+        """Creates a new template, the first run is on the start date."""
+        record.setdefault("status", InvoiceStatus.NEW.value)
+        record.setdefault("runs", 0)
+        record["nextRun"] = cls.RunDate(record["startDate"], record["period"], 0)
+        return super(RecurringInvoice, cls).Create(connection, record)
+
+    @staticmethod
+    def RunDate(start, period, run):
+        """Returns the date of the given run, counting from 0."""
+        if period == RecurringPeriod.WEEK:
+            return start + datetime.timedelta(weeks=run)
+        return add_months(start, PERIOD_MONTHS[RecurringPeriod(period)] * run)
+
+    @classmethod
+    def Due(cls, connection, date, limit=500, exclude=()):
+        """Returns the IDs of active templates that should run on or before date.
+
+        Arguments:
+          @ connection
+            Database connection to use.
+          @ date: datetime.date
+            The date to generate the invoices for.
+          % limit: int ~~ 500
+            The maximum number of IDs to return.
+          % exclude: iterable of int ~~ ()
+            IDs of templates to skip, for example because they failed.
+        """
+        conditions = ["active = 1", "nextRun <= %s" % connection.EscapeValues(date)]
+        if exclude:
+            conditions.append(
+                "ID NOT IN (%s)" % ", ".join(str(int(x)) for x in exclude)
+            )
+        with connection as cursor:
+            due = cursor.Select(
+                table=cls.TableName(),
+                fields="ID",
+                conditions=conditions,
+                order=[("nextRun", False), ("ID", False)],
+                limit=limit,
+                escape=False,
+            )
+        return [row["ID"] for row in due]
+
+    @classmethod
+    def Lock(cls, connection, template_id):
+        """Returns the template locked for update, for use inside a transaction.
+
+        Returns None when the template no longer exists.
+        """
+        with connection as cursor:
+            template = cursor.Execute(
+                "SELECT * FROM %s WHERE ID = %d FOR UPDATE"
+                % (cls.TableName(), int(template_id))
+            )
+        if not template:
+            return None
+        return cls(connection, template[0])
+
+    def IsDue(self, date):
+        return bool(self["active"]) and self["nextRun"] <= date
+
+    def Products(self):
+        """Returns the products that are put on every generated invoice."""
+        return list(
+            RecurringInvoiceProduct.List(
+                self.connection, conditions=["recurringInvoice=%d" % self]
+            )
+        )
+
+    def AddProducts(self, products):
+        """Adds products to the template, see Invoice.AddProducts."""
+        for product in products:
+            product["recurringInvoice"] = self["ID"]
+        return RecurringInvoiceProduct.CreateMany(self.connection, products)
+
+    def Advance(self, invoice):
+        """Moves the template to its next run after invoice was created for it."""
+        self["runs"] += 1
+        self["nextRun"] = self.RunDate(self["startDate"], self["period"], self["runs"])
+        self["lastInvoice"] = invoice["ID"]
+        self.Save()
+
+
+class RecurringInvoiceProduct(common_model.RichModel):
+    """Abstraction class for the products of a recurring invoice template."""
+
+    FIELDS = ("recurringInvoice", "name", "price", "vat_percentage", "quantity")
+
+    @classmethod
+    def CreateMany(cls, connection, products):
+        return cls.InsertMany(
+            connection,
+            [{field: product[field] for field in cls.FIELDS} for product in products],
+            lookup="recurringInvoice",
+        )
+
+    def InvoiceProduct(self):
+        """Returns this product as it is added to a generated invoice."""
+        return {
+            "name": self["name"],
+            "price": self["price"],
+            "vat_percentage": self["vat_percentage"],
+            "quantity": self["quantity"],
+        }
+
+
+NotExistError = uweb3.model.NotExistError
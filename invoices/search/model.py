@@ -0,0 +1,238 @@
+"""Full text search over clients and invoices.
+
+Client names, email addresses and cities and invoice titles and descriptions
+are searched through the FULLTEXT indexes added by
+schema/migrations/005_search.sql, results are ordered by relevance. Client
+numbers are matched exactly and invoice numbers on their prefix, through their
+regular indexes. Every match runs as a query of its own so it can use its
+index, the results are combined with UNION. The type-ahead lookup only uses prefix matches on indexed
+columns.
+"""
+
+import re
+
+from invoices.common.model import escape_like
+
+PAGE_SIZE = 20
+LOOKUP_LIMIT = 10
+# InnoDB does not index shorter words, see innodb_ft_min_token_size.
+MIN_WORD_LENGTH = 3
+# Matches on a number rank above matches in the text.
+NUMBER_MATCH_RELEVANCE = 100
+
+
+def boolean_query(term):
+    """Returns term as a FULLTEXT query in boolean mode.
+
+    Every word has to be present, the last one may be the start of a word.
+    Operators in the term are not passed on, so a term can never change the
+    meaning of the query.
+    """
+    words = [word for word in re.findall(r"\w+", term) if len(word) >= MIN_WORD_LENGTH]
+    if not words:
+        return None
+    return " ".join("+%s" % word for word in words) + "*"
+
+
+def search_clients(connection, term, page=1, page_size=PAGE_SIZE):
+    """Returns the clients that match term, the best matches first.
+
+    Only the current version of every client is searched.
+
+    Returns:
+      tuple(int, list): The total amount of matches and the rows of the page.
+    """
+    query = boolean_query(term)
+    branches = []
+    if query:
+        match = (
+            "MATCH (`client`.`name`, `client`.`email`, `client`.`city`) "
+            "AGAINST (%s IN BOOLEAN MODE)" % connection.EscapeValues(query)
+        )
+        branches.append(("%s AND `client`.`isCurrent` = 1" % match, match))
+    if term.strip().isdecimal():
+        branches.append(
+            (
+                "`client`.`clientNumber` = %d AND `client`.`isCurrent` = 1" % int(term),
+                str(NUMBER_MATCH_RELEVANCE),
+            )
+        )
+    if not branches:
+        return 0, []
+    return _page(
+        connection,
+        "client",
+        "`client`.`ID`, `client`.`clientNumber`, `client`.`name`, "
+        "`client`.`email`, `client`.`city`",
+        branches,
+        page,
+        page_size,
+    )
+
+
+def search_invoices(connection, term, page=1, page_size=PAGE_SIZE):
+    """Returns the invoices that match term, the best matches first.
+
+    Returns:
+      tuple(int, list): The total amount of matches and the rows of the page.
+    """
+    prefix = connection.EscapeValues("%s%%" % escape_like(term.strip()))
+    branches = [
+        (
+            "`invoice`.`sequenceNumber` LIKE %s" % prefix,
+            str(NUMBER_MATCH_RELEVANCE),
+        )
+    ]
+    query = boolean_query(term)
+    if query:
+        match = (
+            "MATCH (`invoice`.`title`, `invoice`.`description`) "
+            "AGAINST (%s IN BOOLEAN MODE)" % connection.EscapeValues(query)
+        )
+        branches.append((match, match))
+    return _page(
+        connection,
+        "invoice",
+        "`invoice`.`ID`, `invoice`.`sequenceNumber`, `invoice`.`title`, "
+        "`invoice`.`status`, `invoice`.`dateCreated`, "
+        "`client`.`name` AS `client`",
+        branches,
+        page,
+        page_size,
+        joins="JOIN `client` ON (`client`.`ID` = `invoice`.`client`)",
+    )
+
+
+def search(connection, term, page=1, page_size=PAGE_SIZE):
+    """Searches clients and invoices, returns a page of both."""
+    results = {"term": term, "page": page, "page_size": page_size}
+    for name, finder in (("clients", search_clients), ("invoices", search_invoices)):
+        total, rows = finder(connection, term, page, page_size)
+        results[name] = {
+            "total": total,
+            "pages": (total + page_size - 1) // page_size,
+            "results": rows,
+        }
+    return results
+
+
+def lookup(connection, prefix, kinds=("clients", "invoices"), limit=LOOKUP_LIMIT):
+    """Returns clients and invoices that start with prefix, for type-ahead.
+
+    Clients are matched on the start of their name or on their client number,
+    invoices on the start of their number. Every condition can use an index, so
+    this stays fast on large tables.
+
+    Arguments:
+      @ connection: sqltalk.connection
+      @ prefix: str
+        What the user typed so far.
+      % kinds: tuple ~~ ("clients", "invoices")
+        What to look up.
+      % limit: int ~~ LOOKUP_LIMIT
+        The maximum amount of results per kind.
+
+    Returns:
+      list(dict): With type, ID, number, label and url.
+    """
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    like = connection.EscapeValues("%s%%" % escape_like(prefix))
+    results = []
+    with connection as cursor:
+        if "clients" in kinds:
+            number = (
+                "OR `clientNumber` = %d" % int(prefix) if prefix.isdecimal() else ""
+            )
+            clients = cursor.Execute(
+                """
+                SELECT `ID`, `clientNumber`, `name`
+                FROM `client`
+                WHERE (`name` LIKE %(like)s %(number)s) AND `isCurrent` = 1
+                ORDER BY `name`
+                LIMIT %(limit)d
+                """
+                % {"like": like, "number": number, "limit": limit}
+            )
+            results.extend(
+                {
+                    "type": "client",
+                    "ID": client["ID"],
+                    "number": client["clientNumber"],
+                    "label": "%s %s" % (client["clientNumber"], client["name"]),
+                    "url": "/client/%d" % client["clientNumber"],
+                }
+                for client in clients
+            )
+        if "invoices" in kinds:
+            invoices = cursor.Execute(
+                """
+                SELECT `ID`, `sequenceNumber`, `title`
+                FROM `invoice`
+                WHERE `sequenceNumber` LIKE %(like)s
+                ORDER BY `sequenceNumber` DESC
+                LIMIT %(limit)d
+                """
+                % {"like": like, "limit": limit}
+            )
+            results.extend(
+                {
+                    "type": "invoice",
+                    "ID": invoice["ID"],
+                    "number": invoice["sequenceNumber"],
+                    "label": "%s %s" % (invoice["sequenceNumber"], invoice["title"]),
+                    "url": "/invoice/%s" % invoice["sequenceNumber"],
+                }
+                for invoice in invoices
+            )
+    return results
+
+
+def _page(connection, table, fields, branches, page, page_size, joins=""):
+    """Returns a page of the rows of table that match any of the branches.
+
+    Every branch is a (condition, relevance) pair that runs as a query of its
+    own, MySQL does not use a FULLTEXT index for a MATCH that is OR-ed with
+    other conditions. The branches are combined with UNION, a row that matches
+    several of them counts once with its highest relevance.
+    """
+    page = max(1, int(page))
+    matched = " UNION ALL ".join(
+        "SELECT `%s`.`ID`, %s AS `relevance` FROM `%s` WHERE %s"
+        % (table, relevance, table, condition)
+        for condition, relevance in branches
+    )
+    with connection as cursor:
+        total = cursor.Execute(
+            "SELECT COUNT(*) AS `total` FROM (%s) AS `matched`"
+            % " UNION ".join(
+                "SELECT `%s`.`ID` FROM `%s` WHERE %s" % (table, table, condition)
+                for condition, _relevance in branches
+            )
+        )[0]["total"]
+        if not total:
+            return 0, []
+        rows = cursor.Execute(
+            """
+            SELECT %(fields)s, `matches`.`relevance`
+            FROM (
+              SELECT `ID`, MAX(`relevance`) AS `relevance`
+              FROM (%(matched)s) AS `matched`
+              GROUP BY `ID`
+            ) AS `matches`
+            JOIN `%(table)s` ON (`%(table)s`.`ID` = `matches`.`ID`)
+            %(joins)s
+            ORDER BY `relevance` DESC, `%(table)s`.`ID` DESC
+            LIMIT %(limit)d OFFSET %(offset)d
+            """
+            % {
+                "fields": fields,
+                "matched": matched,
+                "table": table,
+                "joins": joins,
+                "limit": page_size,
+                "offset": (page - 1) * page_size,
+            }
+        )
+    return total, [dict(row) for row in rows]
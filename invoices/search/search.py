@@ -0,0 +1,72 @@
+#!/usr/bin/python
+"""Request handlers for searching clients and invoices"""
+
+# uweb modules
+import uweb3
+
+from invoices import basepages
+from invoices.common.decorators import json_error_wrapper
+from invoices.search import model
+
+MAX_LOOKUP_LIMIT = 25
+
+
+class PageMaker(basepages.PageMaker):
+    def _SearchArguments(self):
+        term = self.get.getfirst("q", "").strip()[:100]
+        try:
+            page = max(1, int(self.get.getfirst("page", 1)))
+        except ValueError:
+            page = 1
+        return term, page
+
+    @uweb3.decorators.loggedin
+    @uweb3.decorators.TemplateParser("search/search.html")
+    def RequestSearchPage(self):
+        term, page = self._SearchArguments()
+        results = model.search(self.connection, term, page) if term else None
+        pages = (
+            max(results["clients"]["pages"], results["invoices"]["pages"])
+            if results
+            else 0
+        )
+        return {
+            "title": "Search",
+            "page_id": "search",
+            "term": term,
+            "results": results,
+            "previous_page": page - 1,
+            "next_page": page + 1 if page < pages else 0,
+        }
+
+    @uweb3.decorators.loggedin
+    @uweb3.decorators.ContentType("application/json")
+    @json_error_wrapper
+    def RequestSearch(self):
+        term, page = self._SearchArguments()
+        if not term:
+            raise ValueError("Nothing to search for, pass a term as q.")
+        return model.search(self.connection, term, page)
+
+    @uweb3.decorators.loggedin
+    @uweb3.decorators.ContentType("application/json")
+    @json_error_wrapper
+    def RequestLookup(self):
+        """Returns clients and invoices that start with q, for type-ahead fields.
+
+        Takes:
+          q: str
+          type: clients, invoices or all
+          limit: int, at most MAX_LOOKUP_LIMIT
+        """
+        prefix = self.get.getfirst("q", "").strip()[:100]
+        kind = self.get.getfirst("type", "all")
+        if kind not in ("clients", "invoices", "all"):
+            raise ValueError("Unknown lookup type %r." % kind)
+        kinds = ("clients", "invoices") if kind == "all" else (kind,)
+        try:
+            limit = int(self.get.getfirst("limit", model.LOOKUP_LIMIT))
+        except ValueError:
+            limit = model.LOOKUP_LIMIT
+        limit = min(max(1, limit), MAX_LOOKUP_LIMIT)
+        return {"results": model.lookup(self.connection, prefix, kinds, limit)}
@@ -0,0 +1,8 @@
+from invoices.basepages import API_VERSION
+from invoices.search import search
+
+urls = [
+    ("/search", (search.PageMaker, "RequestSearchPage"), "GET"),
+    (f"{API_VERSION}/search", (search.PageMaker, "RequestSearch"), "GET"),
+    (f"{API_VERSION}/lookup", (search.PageMaker, "RequestLookup"), "GET"),
+]
@@ -0,0 +1,398 @@
+"""Production server that runs the application in pre-forked worker processes.
+
+The master process loads the config and the templates, opens the listening
+socket and then forks the workers, which all accept connections on that
+socket. Workers that die are replaced. The master handles these signals:
+
+  TERM, INT  Stop, workers finish the request they are handling first.
+  HUP        Reload the config and templates and replace all workers.
+
+With more than one thread every worker hands its requests to a pool of
+threads, so requests that wait on MySQL or an external API do not hold up
+the others. Slow routes can be limited to a number of concurrent requests
+with the [route_limits] section of the config.
+
+Usage: python -m invoices.server [--host HOST] [--port PORT] [--workers N]
+                                 [--threads N] [--queue-size N]
+"""
+
+import argparse
+import functools
+import os
+import queue
+import re
+import signal
+import socket
+import threading
+import time
+from http import HTTPStatus
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import uweb3
+
+import invoices
+from invoices.common import helpers as common_helpers
+from invoices.common import pool
+
+# Rendering PDFs is slow and memory hungry, by default a process renders at
+# most two at the same time.
+DEFAULT_ROUTE_LIMITS = {r"^/pdfinvoice/": 2}
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Logs requests through the application log instead of stderr."""
+
+    def log_message(self, format, *args):
+        uweb3.logging.info("%s %s", self.address_string(), format % args)
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """WSGI server that handles requests on a fixed number of threads.
+
+    Accepted connections wait in a queue of at most `queue_size` entries, when
+    it is full new connections are answered with a 503 right away instead of
+    piling up.
+    """
+
+    REJECT_RESPONSE = (
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        b"Retry-After: 1\r\n"
+        b"Content-Length: 0\r\n"
+        b"Connection: close\r\n\r\n"
+    )
+
+    def __init__(self, *args, threads=16, queue_size=64, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.threads = [
+            threading.Thread(
+                target=self._Work, name="invoices-request-%d" % number, daemon=True
+            )
+            for number in range(threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def process_request(self, request, client_address):
+        try:
+            self.requests.put_nowait((request, client_address))
+        except queue.Full:
+            uweb3.logging.warning("Request queue full, rejecting %s", client_address)
+            try:
+                request.sendall(self.REJECT_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _Work(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        """Finishes the queued requests and stops the threads."""
+        for _ in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+        super().server_close()
+
+
+class RouteLimiter:
+    """WSGI middleware that limits the concurrent requests of matching routes.
+
+    A request for a route that is at its limit waits up to `wait` seconds for
+    a slot and is answered with a 503 when none becomes available.
+    """
+
+    def __init__(self, app, limits, wait=10):
+        """Wraps an application.
+
+        Arguments:
+          @ app: callable
+            The WSGI application.
+          @ limits: dict
+            Maps regular expressions on the request path to the maximum number
+            of requests that may run at the same time.
+          % wait: float ~~ 10
+            Seconds a request waits for a free slot.
+        """
+        self.app = app
+        self.wait = wait
+        self.limits = [
+            (re.compile(pattern), threading.BoundedSemaphore(int(limit)))
+            for pattern, limit in limits.items()
+        ]
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        for pattern, semaphore in self.limits:
+            if pattern.search(path):
+                break
+        else:
+            return self.app(environ, start_response)
+        if not semaphore.acquire(timeout=self.wait):
+            uweb3.logging.warning("Too many concurrent requests for %s", path)
+            status = HTTPStatus.SERVICE_UNAVAILABLE
+            start_response(
+                "%d %s" % (status, status.phrase),
+                [("Content-Type", "text/plain"), ("Retry-After", "1")],
+            )
+            return [b"Too many requests for this page, try again later."]
+        try:
+            return list(self.app(environ, start_response))
+        finally:
+            semaphore.release()
+
+
+def load_application(threads=1):
+    """Creates the application with its config and templates loaded.
+
+    Every request thread needs a database connection of its own, when threads
+    are used and no [pool] is configured a pool with one connection per thread
+    is set up.
+    """
+    app = invoices.main()
+    options = invoices.load_config().options
+    if threads > 1 and pool.get() is None:
+        pool.configure(lambda: common_helpers.connect(options["mysql"]), size=threads)
+    limits = dict(DEFAULT_ROUTE_LIMITS, **options.get("route_limits", {}))
+    wait = float(options.get("server", {}).get("route_limit_wait", 10))
+    return RouteLimiter(app, limits, wait=wait)
+
+
+def serve(app, listener, should_stop, handler=RequestHandler, server_class=WSGIServer):
+    """Serves requests on an already listening socket until should_stop() is true.
+
+    Arguments:
+      @ app: callable
+        The WSGI application.
+      @ listener: socket.socket
+        The socket to accept connections on.
+      @ should_stop: callable
+        Checked after every request and at least once a second.
+      % handler: WSGIRequestHandler ~~ RequestHandler
+      % server_class: WSGIServer ~~ WSGIServer
+    """
+    server = server_class(listener.getsockname()[:2], handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    server.server_name = socket.getfqdn(server.server_address[0])
+    server.server_port = server.server_address[1]
+    server.setup_environ()
+    server.set_app(app)
+    server.timeout = 1
+    try:
+        while not should_stop():
+            server.handle_request()
+    finally:
+        server.server_close()
+
+
+class PreforkServer:
+    """Runs and supervises a fixed number of worker processes."""
+
+    RESTART_DELAY = 1  # Seconds to wait before replacing a worker that crashed.
+
+    def __init__(
+        self,
+        host,
+        port,
+        workers=None,
+        threads=1,
+        queue_size=64,
+        graceful_timeout=30,
+        backlog=128,
+    ):
+        self.address = (host, port)
+        self.worker_count = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.queue_size = queue_size
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.workers = {}  # pid: generation
+        self.generation = 0
+        self.app = None
+        self.listener = None
+        self.stopping = False
+        self.reloading = False
+
+    def run(self):
+        self.app = load_application(self.threads)
+        self.listener = socket.create_server(self.address, backlog=self.backlog)
+        self.listener.set_inheritable(True)
+        signal.signal(signal.SIGTERM, self._Stop)
+        signal.signal(signal.SIGINT, self._Stop)
+        signal.signal(signal.SIGHUP, self._Reload)
+        uweb3.logging.info(
+            "Serving on %s:%d with %d workers", *self.address, self.worker_count
+        )
+        try:
+            while not self.stopping:
+                if self.reloading:
+                    self.reloading = False
+                    self.Reload()
+                self.Reap()
+                while len(self.CurrentWorkers()) < self.worker_count:
+                    self.Spawn()
+                time.sleep(0.5)
+        finally:
+            self.StopWorkers(list(self.workers))
+            self.listener.close()
+
+    def CurrentWorkers(self):
+        return [pid for pid, gen in self.workers.items() if gen == self.generation]
+
+    def Spawn(self):
+        """Forks a worker that serves the current application."""
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = self.generation
+            return pid
+        code = 0
+        try:
+            self._RunWorker()
+        except BaseException as error:
+            uweb3.logging.error("Worker %d failed: %s", os.getpid(), error)
+            code = 1
+        finally:
+            # Clean up the application of the worker itself, for example to
+            # hand back unused pro forma numbers, and never return into the
+            # master.
+            invoices.run_cleanups()
+            os._exit(code)
+
+    def _RunWorker(self):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        if self.threads > 1:
+            server_class = functools.partial(
+                ThreadPoolWSGIServer, threads=self.threads, queue_size=self.queue_size
+            )
+        else:
+            server_class = WSGIServer
+        serve(
+            self.app, self.listener, lambda: bool(stopping), server_class=server_class
+        )
+
+    def Reap(self):
+        """Removes workers that exited, a crash is followed by a short delay."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation and not self.stopping:
+                uweb3.logging.error(
+                    "Worker %d exited with status %d, starting a new one",
+                    pid,
+                    os.waitstatus_to_exitcode(status),
+                )
+                time.sleep(self.RESTART_DELAY)
+
+    def Reload(self):
+        """Starts workers with freshly loaded config and templates.
+
+        The old workers are stopped once the new ones run, they finish the
+        request they are handling first. When loading fails the old workers
+        keep running.
+        """
+        try:
+            app = load_application(self.threads)
+        except Exception as error:
+            uweb3.logging.error("Reload failed, keeping the old workers: %s", error)
+            return
+        old = self.CurrentWorkers()
+        self.app = app
+        self.generation += 1
+        for _ in range(self.worker_count):
+            self.Spawn()
+        self.StopWorkers(old, wait=False)
+        uweb3.logging.info("Reloaded, replaced workers %s", old)
+
+    def StopWorkers(self, pids, wait=True):
+        """Asks workers to stop and kills the ones that do not in time."""
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if not wait:
+            return
+        deadline = time.monotonic() + self.graceful_timeout
+        while any(pid in self.workers for pid in pids):
+            if time.monotonic() > deadline:
+                for pid in pids:
+                    if pid in self.workers:
+                        os.kill(pid, signal.SIGKILL)
+                        os.waitpid(pid, 0)
+                        self.workers.pop(pid)
+                return
+            self.Reap()
+            time.sleep(0.1)
+
+    def _Stop(self, signum, frame):
+        self.stopping = True
+
+    def _Reload(self, signum, frame):
+        self.reloading = True
+
+
+def main(argv=None):
+    options = invoices.load_config().options
+    server = options.get("server", {})
+    parser = argparse.ArgumentParser(description="Runs the invoices application.")
+    parser.add_argument(
+        "--host", default=options.get("general", {}).get("host", "127.0.0.1")
+    )
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(server.get("threads", 1)),
+        help="number of request threads per worker",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=int(server.get("queue_size", 64)),
+        help="accepted requests that may wait for a thread, more are rejected",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=30,
+        help="seconds a stopping worker gets to finish its request",
+    )
+    args = parser.parse_args(argv)
+    PreforkServer(
+        args.host,
+        args.port,
+        workers=args.workers,
+        threads=args.threads,
+        queue_size=args.queue_size,
+        graceful_timeout=args.graceful_timeout,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
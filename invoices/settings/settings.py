@@ -3,6 +3,7 @@ import uweb3
 
 import invoices.invoice.model as invoice_model
 from invoices import basepages
+from invoices.common.decorators import verified_session
 from invoices.common.schemas import CompanyDetailsSchema
 
 
@@ -13,12 +14,7 @@ class PageMaker(basepages.PageMaker):
         """Returns the settings page."""
         if not errors:
             errors = {}
-        settings = None
-        highestcompanyid = invoice_model.Companydetails.HighestNumber(self.connection)
-        if highestcompanyid:
-            settings = invoice_model.Companydetails.FromPrimary(
-                self.connection, highestcompanyid
-            )
+        settings = invoice_model.Companydetails.Current(self.connection)
         return {
             "title": "Settings",
             "page_id": "settings",
@@ -30,6 +26,7 @@ class PageMaker(basepages.PageMaker):
 
     @uweb3.decorators.loggedin
     @uweb3.decorators.checkxsrf
+    @verified_session
     def RequestSettingsSave(self):
         """Saves the changes and returns the settings page."""
         try:
@@ -37,25 +34,13 @@ class PageMaker(basepages.PageMaker):
         except marshmallow.exceptions.ValidationError as error:
             return self.RequestSettings(errors=error.messages)
 
-        settings = None
-        increment = invoice_model.Companydetails.HighestNumber(self.connection)
-
-        try:
-            settings = invoice_model.Companydetails.FromPrimary(
-                self.connection, increment
-            )
-        except uweb3.model.NotExistError:
-            pass
-
-        if settings:
-            settings.Create(self.connection, newsettings)
-        else:
-            invoice_model.Companydetails.Create(self.connection, newsettings)
-
+        # Creating new details invalidates the lookup cache in every process.
+        invoice_model.Companydetails.Create(self.connection, newsettings)
         return self.RequestSettings()
 
     @uweb3.decorators.loggedin
     @uweb3.decorators.checkxsrf
+    @verified_session
     def RequestWarehouseSettingsSave(self):
         self.config.Update(
             "general", "warehouse_api", self.post.getfirst("warehouse_api")
@@ -65,6 +50,7 @@ class PageMaker(basepages.PageMaker):
 
     @uweb3.decorators.loggedin
     @uweb3.decorators.checkxsrf
+    @verified_session
     def RequestMollieSettingsSave(self):
         self.config.Update("mollie", "apikey", self.post.getfirst("apikey"))
         self.config.Update("mollie", "webhook_url", self.post.getfirst("webhook_url"))
@@ -1,6 +1,8 @@
 
 window.addEventListener('load', (event) => {
   attachpasswordreset();
+  attachclientlookup();
+  attachlookups();
 });
 
 var password;
@@ -40,3 +42,82 @@ function handlepasswordchange(event){
     passwordconfirm.classList.add('succes');
   }
 }
+
+// Type-ahead for inputs with a data-lookup attribute of "clients", "invoices"
+// or "all". Suggestions come from /api/v1/lookup. Picking one either opens it
+// (data-lookup-navigate) or copies its ID into the element named by
+// data-lookup-target.
+const LOOKUP_URL = '/api/v1/lookup';
+const LOOKUP_DELAY = 150;
+
+function attachclientlookup(){
+  // Lets the client of a new invoice be found by typing instead of scrolling.
+  let select = document.querySelector('form select[name="client"]');
+  if(!select || select.dataset.lookupAttached){
+    return;
+  }
+  select.dataset.lookupAttached = true;
+  if(!select.id){
+    select.id = 'client';
+  }
+  let input = document.createElement('input');
+  input.type = 'search';
+  input.placeholder = 'Find client by name or number';
+  input.dataset.lookup = 'clients';
+  input.dataset.lookupTarget = select.id;
+  select.parentNode.insertBefore(input, select);
+}
+
+function attachlookups(){
+  document.querySelectorAll('input[data-lookup]').forEach(input => {
+    let list = document.createElement('datalist');
+    list.id = (input.id || input.name || 'lookup') + '-suggestions';
+    input.setAttribute('list', list.id);
+    input.setAttribute('autocomplete', 'off');
+    input.after(list);
+    let timer = null;
+    let controller = null;
+    let results = [];
+    input.addEventListener('input', () => {
+      clearTimeout(timer);
+      let picked = results.find(result => result.label == input.value);
+      if(picked){
+        return handlelookuppick(input, picked);
+      }
+      timer = setTimeout(() => {
+        if(controller){
+          controller.abort();
+        }
+        controller = new AbortController();
+        let params = new URLSearchParams({q: input.value, type: input.dataset.lookup});
+        fetch(`${LOOKUP_URL}?${params}`, {signal: controller.signal})
+          .then(response => response.ok ? response.json() : {results: []})
+          .then(data => {
+            results = data.results || [];
+            list.replaceChildren(...results.map(result => {
+              let option = document.createElement('option');
+              option.value = result.label;
+              return option;
+            }));
+          })
+          .catch(error => {
+            if(error.name != 'AbortError'){
+              console.error(error);
+            }
+          });
+      }, LOOKUP_DELAY);
+    });
+  });
+}
+
+function handlelookuppick(input, result){
+  if('lookupNavigate' in input.dataset){
+    location.href = result.url;
+    return;
+  }
+  let target = document.getElementById(input.dataset.lookupTarget);
+  if(target){
+    target.value = result.ID;
+    target.dispatchEvent(new Event('change', {bubbles: true}));
+  }
+}
@@ -0,0 +1,36 @@
+(function () {
+  'use strict';
+  var progressEl = document.getElementById('import-progress');
+  if (!progressEl) {
+    return;
+  }
+  var POLL_INTERVAL = 1000;
+  var url = '/api/v1/invoices/import/' + progressEl.dataset.job;
+
+  function update(progress) {
+    ['status', 'parsed', 'matched', 'applied', 'failed'].forEach(function (field) {
+      progressEl.querySelector('output[name="' + field + '"]').value = progress[field];
+    });
+  }
+
+  function poll() {
+    fetch(url, { credentials: 'same-origin' })
+      .then(function (response) {
+        return response.json();
+      })
+      .then(function (progress) {
+        update(progress);
+        if (progress.status === 'queued' || progress.status === 'running') {
+          window.setTimeout(poll, POLL_INTERVAL);
+        } else {
+          // The results are stored with the job, reload to render them.
+          window.location.reload();
+        }
+      })
+      .catch(function () {
+        window.setTimeout(poll, POLL_INTERVAL * 5);
+      });
+  }
+
+  window.setTimeout(poll, POLL_INTERVAL);
+})();
@@ -0,0 +1,16 @@
+-- Bank statement uploads are processed in the background, see invoices/invoice/jobs.py
+CREATE TABLE IF NOT EXISTS `importJob` (
+  `ID` int unsigned NOT NULL AUTO_INCREMENT,
+  `status` enum('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  `files` longtext NOT NULL,
+  `parsed` int unsigned NOT NULL DEFAULT '0',
+  `matched` int unsigned NOT NULL DEFAULT '0',
+  `applied` int unsigned NOT NULL DEFAULT '0',
+  `failed` int unsigned NOT NULL DEFAULT '0',
+  `results` mediumtext,
+  `error` varchar(255) DEFAULT NULL,
+  `dateCreated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `dateUpdated` timestamp NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`ID`),
+  KEY `status` (`status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
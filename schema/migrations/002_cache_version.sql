@@ -0,0 +1,6 @@
+-- Version counters used to invalidate the process wide caches, see invoices/common/cache.py
+CREATE TABLE IF NOT EXISTS `cacheVersion` (
+  `name` varchar(45) NOT NULL,
+  `version` int unsigned NOT NULL DEFAULT '0',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
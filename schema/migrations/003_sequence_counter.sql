@@ -0,0 +1,27 @@
+-- Invoice and pro forma numbers are handed out by per year counters, see
+-- SequenceCounter in invoices/invoice/model.py
+CREATE TABLE IF NOT EXISTS `sequenceCounter` (
+  `name` varchar(20) CHARACTER SET ascii COLLATE ascii_general_ci NOT NULL,
+  `year` smallint unsigned NOT NULL,
+  `n` int unsigned NOT NULL DEFAULT '0',
+  PRIMARY KEY (`name`,`year`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- Continue the numbering of the existing invoices.
+INSERT INTO `sequenceCounter` (`name`, `year`, `n`)
+  SELECT 'invoice',
+         CAST(SUBSTRING(`sequenceNumber`, 1, 4) AS UNSIGNED) AS `year`,
+         MAX(CAST(SUBSTRING(`sequenceNumber`, 6) AS UNSIGNED)) AS `n`
+  FROM `invoice`
+  WHERE `sequenceNumber` NOT LIKE 'PF-%'
+  GROUP BY `year`
+ON DUPLICATE KEY UPDATE `n` = GREATEST(`sequenceCounter`.`n`, VALUES(`n`));
+
+-- Pro forma numbers are never reused, continue from the old sequence table.
+INSERT INTO `sequenceCounter` (`name`, `year`, `n`)
+  SELECT 'proforma',
+         CAST(SUBSTRING(`sequenceNumber`, 4, 4) AS UNSIGNED) AS `year`,
+         MAX(CAST(SUBSTRING(`sequenceNumber`, 9) AS UNSIGNED)) AS `n`
+  FROM `proFormaSequenceTable`
+  GROUP BY `year`
+ON DUPLICATE KEY UPDATE `n` = GREATEST(`sequenceCounter`.`n`, VALUES(`n`));
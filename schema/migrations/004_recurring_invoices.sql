@@ -0,0 +1,46 @@
+-- Recurring invoice templates and the tasks that are queued for new invoices,
+-- see invoices/recurring/generator.py and invoices/invoice/tasks.py
+CREATE TABLE IF NOT EXISTS `invoiceTask` (
+  `ID` int unsigned NOT NULL AUTO_INCREMENT,
+  `invoice` int unsigned NOT NULL,
+  `task` enum('mail','warehouse') NOT NULL,
+  `status` enum('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  `attempts` tinyint unsigned NOT NULL DEFAULT '0',
+  `error` varchar(255) DEFAULT NULL,
+  `dateCreated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `dateUpdated` timestamp NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`ID`),
+  KEY `status` (`status`),
+  KEY `invoice` (`invoice`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE IF NOT EXISTS `recurringInvoice` (
+  `ID` int unsigned NOT NULL AUTO_INCREMENT,
+  `client` mediumint unsigned NOT NULL,
+  `title` varchar(80) CHARACTER SET utf8mb3 COLLATE utf8_unicode_ci NOT NULL,
+  `description` text CHARACTER SET utf8mb3 COLLATE utf8_unicode_ci NOT NULL,
+  `status` enum('new','reservation') NOT NULL DEFAULT 'new',
+  `period` enum('week','month','quarter','year') NOT NULL,
+  `startDate` date NOT NULL,
+  `nextRun` date NOT NULL,
+  `runs` int unsigned NOT NULL DEFAULT '0',
+  `active` tinyint(1) NOT NULL DEFAULT '1',
+  `mail` tinyint(1) NOT NULL DEFAULT '1',
+  `updateStock` tinyint(1) NOT NULL DEFAULT '0',
+  `lastInvoice` int unsigned DEFAULT NULL,
+  PRIMARY KEY (`ID`),
+  KEY `due` (`active`,`nextRun`),
+  KEY `client` (`client`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE IF NOT EXISTS `recurringInvoiceProduct` (
+  `ID` int unsigned NOT NULL AUTO_INCREMENT,
+  `recurringInvoice` int unsigned NOT NULL,
+  `price` decimal(8,2) NOT NULL,
+  `vat_percentage` smallint NOT NULL,
+  `name` varchar(45) CHARACTER SET utf8mb3 COLLATE utf8_unicode_ci NOT NULL,
+  `quantity` mediumint NOT NULL,
+  PRIMARY KEY (`ID`),
+  KEY `recurringInvoice` (`recurringInvoice`),
+  CONSTRAINT `recurringInvoiceProduct_ibfk_1` FOREIGN KEY (`recurringInvoice`) REFERENCES `recurringInvoice` (`ID`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
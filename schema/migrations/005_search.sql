@@ -0,0 +1,5 @@
+-- Full text indexes for searching clients and invoices, see invoices/search/model.py
+-- Invoice numbers use a different character set than the invoice texts, they
+-- are searched on their prefix through the existing sequenceNumber index.
+ALTER TABLE `client` ADD FULLTEXT KEY `search` (`name`, `email`, `city`);
+ALTER TABLE `invoice` ADD FULLTEXT KEY `search` (`title`, `description`);
@@ -0,0 +1,2 @@
+-- Index for the prefix lookups on client names, see invoices/search/model.py
+ALTER TABLE `client` ADD KEY `name` (`name`);
@@ -0,0 +1,13 @@
+-- Marks the newest version of every client, see RichVersionedRecord in
+-- invoices/common/model.py. Older versions have NULL, so the unique key allows
+-- only one current version per client number.
+ALTER TABLE `client`
+  ADD COLUMN `isCurrent` tinyint unsigned DEFAULT NULL,
+  ADD UNIQUE KEY `current` (`isCurrent`, `clientNumber`);
+
+UPDATE `client`
+JOIN (SELECT MAX(`ID`) AS `max`
+      FROM `client`
+      GROUP BY `clientNumber`) AS `versions`
+  ON (`client`.`ID` = `versions`.`max`)
+SET `client`.`isCurrent` = 1;
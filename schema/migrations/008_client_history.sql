@@ -0,0 +1,20 @@
+-- Superseded client versions are moved to clientHistory by
+-- invoices/clients/archive.py. Versions that existed before this migration get
+-- the time of the migration as their creation date.
+ALTER TABLE `client`
+  ADD COLUMN `dateCreated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+CREATE TABLE IF NOT EXISTS `clientHistory` (
+  `ID` mediumint unsigned NOT NULL,
+  `clientNumber` mediumint unsigned NOT NULL,
+  `name` varchar(100) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `city` varchar(45) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `postalCode` varchar(10) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `email` varchar(100) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `telephone` varchar(30) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `address` varchar(45) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `dateCreated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `dateArchived` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`ID`),
+  KEY `clientnumber` (`clientNumber`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -0,0 +1,9 @@
+-- Sessions that were logged out before they expired. Session cookies are
+-- checked against this list instead of the user table, expired entries are
+-- removed whenever a session is revoked.
+CREATE TABLE IF NOT EXISTS `sessionRevocation` (
+  `token` char(32) CHARACTER SET ascii COLLATE ascii_general_ci NOT NULL,
+  `expires` datetime NOT NULL,
+  PRIMARY KEY (`token`),
+  KEY `expires` (`expires`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
@@ -15,6 +15,20 @@
 /*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
 /*!40111 SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0 */;
 
+--
+-- Table structure for table `cacheVersion`
+--
+
+DROP TABLE IF EXISTS `cacheVersion`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `cacheVersion` (
+  `name` varchar(45) NOT NULL,
+  `version` int unsigned NOT NULL DEFAULT '0',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `client`
 --
@@ -31,12 +45,40 @@ CREATE TABLE `client` (
   `email` varchar(100) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
   `telephone` varchar(30) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
   `address` varchar(45) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `isCurrent` tinyint unsigned DEFAULT NULL,
+  `dateCreated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`ID`),
   UNIQUE KEY `ID_UNIQUE` (`ID`),
-  KEY `clientnumber` (`clientNumber`)
+  UNIQUE KEY `current` (`isCurrent`,`clientNumber`),
+  KEY `clientnumber` (`clientNumber`),
+  KEY `name` (`name`),
+  FULLTEXT KEY `search` (`name`,`email`,`city`)
 ) ENGINE=InnoDB AUTO_INCREMENT=41 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `clientHistory`
+--
+
+DROP TABLE IF EXISTS `clientHistory`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `clientHistory` (
+  `ID` mediumint unsigned NOT NULL,
+  `clientNumber` mediumint unsigned NOT NULL,
+  `name` varchar(100) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `city` varchar(45) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `postalCode` varchar(10) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `email` varchar(100) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `telephone` varchar(30) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `address` varchar(45) CHARACTER SET utf8mb3 COLLATE utf8_general_ci NOT NULL,
+  `dateCreated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `dateArchived` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`ID`),
+  KEY `clientnumber` (`clientNumber`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `companydetails`
 --
@@ -62,6 +104,30 @@ CREATE TABLE `companydetails` (
 ) ENGINE=InnoDB AUTO_INCREMENT=37 DEFAULT CHARSET=utf8mb3 COLLATE=utf8_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `importJob`
+--
+
+DROP TABLE IF EXISTS `importJob`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `importJob` (
+  `ID` int unsigned NOT NULL AUTO_INCREMENT,
+  `status` enum('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  `files` longtext NOT NULL,
+  `parsed` int unsigned NOT NULL DEFAULT '0',
+  `matched` int unsigned NOT NULL DEFAULT '0',
+  `applied` int unsigned NOT NULL DEFAULT '0',
+  `failed` int unsigned NOT NULL DEFAULT '0',
+  `results` mediumtext,
+  `error` varchar(255) DEFAULT NULL,
+  `dateCreated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `dateUpdated` timestamp NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`ID`),
+  KEY `status` (`status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `invoice`
 --
@@ -84,6 +150,7 @@ CREATE TABLE `invoice` (
   KEY `status` (`status`),
   KEY `fk_invoice_1_idx` (`client`),
   KEY `fk_invoice_2_idx` (`companydetails`),
+  FULLTEXT KEY `search` (`title`,`description`),
   CONSTRAINT `fk_invoice_1` FOREIGN KEY (`client`) REFERENCES `client` (`ID`),
   CONSTRAINT `fk_invoice_2` FOREIGN KEY (`companydetails`) REFERENCES `companydetails` (`ID`) ON UPDATE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=431 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -167,6 +234,28 @@ CREATE TABLE `invoiceProduct` (
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb3 COLLATE=utf8_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `invoiceTask`
+--
+
+DROP TABLE IF EXISTS `invoiceTask`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `invoiceTask` (
+  `ID` int unsigned NOT NULL AUTO_INCREMENT,
+  `invoice` int unsigned NOT NULL,
+  `task` enum('mail','warehouse') NOT NULL,
+  `status` enum('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  `attempts` tinyint unsigned NOT NULL DEFAULT '0',
+  `error` varchar(255) DEFAULT NULL,
+  `dateCreated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `dateUpdated` timestamp NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`ID`),
+  KEY `status` (`status`),
+  KEY `invoice` (`invoice`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `mollieTransaction`
 --
@@ -217,6 +306,83 @@ CREATE TABLE `proFormaSequenceTable` (
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb3;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `recurringInvoice`
+--
+
+DROP TABLE IF EXISTS `recurringInvoice`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `recurringInvoice` (
+  `ID` int unsigned NOT NULL AUTO_INCREMENT,
+  `client` mediumint unsigned NOT NULL,
+  `title` varchar(80) CHARACTER SET utf8mb3 COLLATE utf8_unicode_ci NOT NULL,
+  `description` text CHARACTER SET utf8mb3 COLLATE utf8_unicode_ci NOT NULL,
+  `status` enum('new','reservation') NOT NULL DEFAULT 'new',
+  `period` enum('week','month','quarter','year') NOT NULL,
+  `startDate` date NOT NULL,
+  `nextRun` date NOT NULL,
+  `runs` int unsigned NOT NULL DEFAULT '0',
+  `active` tinyint(1) NOT NULL DEFAULT '1',
+  `mail` tinyint(1) NOT NULL DEFAULT '1',
+  `updateStock` tinyint(1) NOT NULL DEFAULT '0',
+  `lastInvoice` int unsigned DEFAULT NULL,
+  PRIMARY KEY (`ID`),
+  KEY `due` (`active`,`nextRun`),
+  KEY `client` (`client`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `recurringInvoiceProduct`
+--
+
+DROP TABLE IF EXISTS `recurringInvoiceProduct`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `recurringInvoiceProduct` (
+  `ID` int unsigned NOT NULL AUTO_INCREMENT,
+  `recurringInvoice` int unsigned NOT NULL,
+  `price` decimal(8,2) NOT NULL,
+  `vat_percentage` smallint NOT NULL,
+  `name` varchar(45) CHARACTER SET utf8mb3 COLLATE utf8_unicode_ci NOT NULL,
+  `quantity` mediumint NOT NULL,
+  PRIMARY KEY (`ID`),
+  KEY `recurringInvoice` (`recurringInvoice`),
+  CONSTRAINT `recurringInvoiceProduct_ibfk_1` FOREIGN KEY (`recurringInvoice`) REFERENCES `recurringInvoice` (`ID`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `sequenceCounter`
+--
+
+DROP TABLE IF EXISTS `sequenceCounter`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `sequenceCounter` (
+  `name` varchar(20) CHARACTER SET ascii COLLATE ascii_general_ci NOT NULL,
+  `year` smallint unsigned NOT NULL,
+  `n` int unsigned NOT NULL DEFAULT '0',
+  PRIMARY KEY (`name`,`year`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `sessionRevocation`
+--
+
+DROP TABLE IF EXISTS `sessionRevocation`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `sessionRevocation` (
+  `token` char(32) CHARACTER SET ascii COLLATE ascii_general_ci NOT NULL,
+  `expires` datetime NOT NULL,
+  PRIMARY KEY (`token`),
+  KEY `expires` (`expires`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `user`
 --
@@ -4,11 +4,15 @@ import pytest
 from uweb3 import SettingsManager
 from uweb3.libs.sqltalk import mysql
 
+from invoices.common.cache import clients as client_cache
+from invoices.common.cache import lookup_tables
 from invoices.invoice import model as invoice_model
+from invoices.login.model import revoked_sessions
 from invoices.mollie import helpers as mollie_helpers
 from invoices.mollie import model as mollie_model
 
 __all__ = [
+    "new_connection",
     "config",
     "mollie_config",
     "connection",
@@ -42,9 +46,8 @@ def mollie_config(config):
     }
 
 
-@pytest.fixture(scope="module")
-def connection():
-    connection = mysql.Connect(
+def new_connection():
+    return mysql.Connect(
         host="localhost",
         user="test_invoices",
         passwd="test_invoices",
@@ -52,6 +55,11 @@ def connection():
         charset="utf8",
     )
 
+
+@pytest.fixture(scope="module")
+def connection():
+    connection = new_connection()
+
     with connection as cursor:
         cursor.Execute("TRUNCATE TABLE test_invoices.paymentPlatform;")
         cursor.Execute(
@@ -83,13 +91,23 @@ def run_before_and_after_tests(connection):
     with connection as cursor:
         cursor.Execute("SET FOREIGN_KEY_CHECKS=0;")
         cursor.Execute("TRUNCATE TABLE test_invoices.client;")
+        cursor.Execute("TRUNCATE TABLE test_invoices.clientHistory;")
         cursor.Execute("TRUNCATE TABLE test_invoices.companydetails;")
+        cursor.Execute("TRUNCATE TABLE test_invoices.importJob;")
         cursor.Execute("TRUNCATE TABLE test_invoices.invoice;")
         cursor.Execute("TRUNCATE TABLE test_invoices.invoicePayment;")
         cursor.Execute("TRUNCATE TABLE test_invoices.invoiceProduct;")
+        cursor.Execute("TRUNCATE TABLE test_invoices.invoiceTask;")
         cursor.Execute("TRUNCATE TABLE test_invoices.mollieTransaction;")
         cursor.Execute("TRUNCATE TABLE test_invoices.proFormaSequenceTable;")
+        cursor.Execute("TRUNCATE TABLE test_invoices.recurringInvoice;")
+        cursor.Execute("TRUNCATE TABLE test_invoices.recurringInvoiceProduct;")
+        cursor.Execute("TRUNCATE TABLE test_invoices.sequenceCounter;")
+        cursor.Execute("TRUNCATE TABLE test_invoices.sessionRevocation;")
         cursor.Execute("SET FOREIGN_KEY_CHECKS=0;")
+    lookup_tables.Clear()
+    client_cache.Clear()
+    revoked_sessions.Clear()
 
 
 @pytest.fixture
@@ -0,0 +1,40 @@
+import time
+
+from invoices.common import instrumentation
+from tests.fixtures import *  # noqa: F401; pylint: disable=unused-variable
+
+
+class TestClass:
+    def test_queries_are_recorded_on_the_request(self, connection):
+        token = instrumentation.start("GET", "/invoices")
+        instrumented = instrumentation.InstrumentedConnection(connection)
+        with instrumented as cursor:
+            cursor.Execute("SELECT 1")
+            cursor.Select(table="paymentPlatform", fields="name")
+        profile = instrumentation.finish(token)
+
+        assert [sql for sql, _duration in profile.queries][0] == "SELECT 1"
+        assert profile.timings["db"][0] == 2
+        assert instrumentation.current() is None
+        # Outside of a request nothing is recorded.
+        with instrumented as cursor:
+            cursor.Execute("SELECT 1")
+        assert len(profile.queries) == 2
+
+    def test_server_timing(self):
+        token = instrumentation.start("GET", "/")
+        with instrumentation.timed("http"):
+            time.sleep(0.01)
+        profile = instrumentation.finish(token)
+        header = profile.ServerTiming()
+        assert header.startswith("http;dur=")
+        assert 'desc="1 calls"' in header
+        assert "total;dur=" in header
+
+    def test_report_thresholds(self):
+        profile = instrumentation.RequestProfile("GET", "/")
+        profile.AddQuery("SELECT 1", 0.001)
+        profile.Finish()
+        assert instrumentation.report(profile, {}) is False
+        assert instrumentation.report(profile, {"max_queries": "0"}) is True
+        assert instrumentation.report(profile, {"slow_request_ms": "-1"}) is True
@@ -1,10 +1,15 @@
 import datetime
+import time
 from datetime import date
 from decimal import Decimal
 
 import pytest
 
-from invoices.common import helpers
+from invoices.common import cache, helpers
+from invoices.common import model as common_model
+from invoices.common.cache import clients as client_cache
+from invoices.invoice import helpers as invoice_helpers
+from invoices.invoice import jobs
 from invoices.invoice import model as invoice_model
 from tests.fixtures import *
 
@@ -14,6 +19,19 @@ from tests.fixtures import *
 # as the record that is needed in the test database is no longer there.
 
 
+def bulk_item(client, status="new", products=1):
+    return {
+        "client": client,
+        "title": "bulk invoice",
+        "description": "created in bulk",
+        "status": status,
+        "products": [
+            {"name": "product", "price": "10.50", "vat_percentage": 21, "quantity": 2}
+        ]
+        * products,
+    }
+
+
 def calc_due_date():
     return datetime.date.today() + invoice_model.PAYMENT_PERIOD
 
@@ -349,3 +367,427 @@ class TestClass:
         # Make sure that the companyDetails that the first invoice references has not changed
         assert first_invoice["companyDetails"] == 1
         assert second_invoice["companyDetails"] == 2
+
+    def test_import_job(self, connection, monkeypatch, tmp_path):
+        monkeypatch.setattr(invoice_model.ImportJob, "directory", str(tmp_path))
+        with open("tests/test_mt940.sta", "r") as f:
+            data = f.read()
+        job = invoice_model.ImportJob.Enqueue(
+            connection, [{"filename": "test", "content": data}]
+        )
+        assert job["status"] == invoice_model.ImportJobStatus.QUEUED
+        # Only the path of the upload is stored on the job.
+        (stored,) = job.Files()
+        assert data not in job["files"]
+        with open(stored["path"]) as f:
+            assert f.read() == data
+
+        claimed = invoice_model.ImportJob.ClaimNext(connection)
+        assert claimed["ID"] == job["ID"]
+        assert claimed["status"] == invoice_model.ImportJobStatus.RUNNING
+        # A claimed job can not be claimed by another worker.
+        assert invoice_model.ImportJob.ClaimNext(connection) is None
+
+        jobs.run_job(connection, claimed)
+
+        job = invoice_model.ImportJob.FromPrimary(connection, job["ID"])
+        assert job["status"] == invoice_model.ImportJobStatus.DONE
+        assert job.Progress()["parsed"] == 3
+        # None of the invoices in the statement exist in the test database.
+        assert job.Progress()["matched"] == 0
+        assert job.Progress()["failed"] == 3
+        assert len(job.Results()["failed_invoices"]) == 3
+        assert job.Files() == []
+        assert list(tmp_path.iterdir()) == []
+
+    def test_reconcile_payments(self, connection, create_invoice_object, monkeypatch):
+        invoice = create_invoice_object(status=invoice_model.InvoiceStatus.NEW.value)
+        references = [
+            {"invoice": invoice["sequenceNumber"], "amount": "10.00"},
+            {"invoice": invoice["sequenceNumber"], "amount": "n/a"},
+            {"invoice": "1999-999", "amount": "10.00"},
+        ]
+        payments, failed = invoice_helpers.reconcile_payments(connection, references)
+        assert payments == references[:1]
+        assert failed == references[1:]
+
+        def broken(*args):
+            raise RuntimeError("database went away")
+
+        # Errors that are not about the reference fail the whole import.
+        monkeypatch.setattr(invoice_model.Invoice, "AddPayment", broken)
+        with pytest.raises(RuntimeError):
+            invoice_helpers.reconcile_payments(connection, references[:1])
+
+    def test_import_job_requeue_stale(self, connection, monkeypatch, tmp_path):
+        monkeypatch.setattr(invoice_model.ImportJob, "directory", str(tmp_path))
+        job = invoice_model.ImportJob.Enqueue(connection, [])
+        claimed = invoice_model.ImportJob.ClaimNext(connection)
+        claimed.Heartbeat()
+        # A job with a recent heartbeat is still being worked on.
+        assert invoice_model.ImportJob.RequeueStale(connection) == 0
+
+        with connection as cursor:
+            cursor.Execute(
+                "UPDATE importJob SET dateUpdated = NOW() - INTERVAL 1 HOUR "
+                "WHERE ID = %d" % job["ID"]
+            )
+        assert invoice_model.ImportJob.RequeueStale(connection) == 1
+        claimed = invoice_model.ImportJob.ClaimNext(connection)
+        assert claimed["ID"] == job["ID"]
+
+    def test_payment_platform_from_name(self, connection):
+        platform = invoice_model.PaymentPlatform.FromName(connection, "mollie")
+        assert platform["name"] == "mollie"
+        # The second lookup is served from the lookup cache.
+        assert invoice_model.PaymentPlatform.FromName(connection, "mollie") == platform
+        with pytest.raises(invoice_model.PaymentPlatform.NotExistError):
+            invoice_model.PaymentPlatform.FromName(connection, "does not exist")
+
+    def test_create_invoices_bulk(
+        self, connection, client_object, companydetails_object
+    ):
+        items = [
+            bulk_item(client_object["ID"]),
+            bulk_item(client_object["ID"], status="reservation", products=3),
+            bulk_item(client_object["ID"], products=0),
+            bulk_item(12345),
+            bulk_item(client_object["ID"]),
+        ]
+        results = invoice_helpers.create_invoices_bulk(connection, items)
+
+        errors = [result["error"] for result in results]
+        assert errors == [False, False, True, True, False]
+        assert results[0]["sequenceNumber"] == f"{date.today().year}-001"
+        assert results[1]["sequenceNumber"] == f"PF-{date.today().year}-001"
+        assert results[4]["sequenceNumber"] == f"{date.today().year}-002"
+
+        invoice = invoice_model.Invoice.FromPrimary(connection, results[1]["ID"])
+        assert invoice["sequenceNumber"] == results[1]["sequenceNumber"]
+        assert len(list(invoice.Products())) == 3
+        # Numbers handed out by the bulk API are followed by single creations.
+        next_number = invoice_model.Invoice.NextNumber(connection)
+        assert next_number == f"{date.today().year}-003"
+
+    def test_create_thousand_invoices_bulk(
+        self, connection, client_object, companydetails_object
+    ):
+        items = [bulk_item(client_object["ID"], products=3) for _ in range(1000)]
+        results = invoice_helpers.create_invoices_bulk(connection, items)
+
+        assert not any(result["error"] for result in results)
+        assert len({result["ID"] for result in results}) == 1000
+        assert results[-1]["sequenceNumber"] == f"{date.today().year}-1000"
+
+    def test_invoice_product_create_many(self, connection, create_invoice_object):
+        invoice = create_invoice_object()
+        products = [
+            {
+                "invoice": invoice["ID"],
+                "name": "product %d" % number,
+                "price": Decimal("10.00"),
+                "vat_percentage": 21,
+                "quantity": 1,
+            }
+            for number in range(50)
+        ]
+        ids = invoice_model.InvoiceProduct.CreateMany(connection, products)
+        assert len(set(ids)) == 50
+        product = invoice_model.InvoiceProduct.FromPrimary(connection, ids[-1])
+        assert product["name"] == "product 49"
+
+    def test_invoice_product_create_many_chunks(
+        self, connection, create_invoice_object, monkeypatch
+    ):
+        invoice = create_invoice_object()
+        # Leave room for a handful of rows per statement.
+        monkeypatch.setattr(common_model, "_max_allowed_packet", 1024 + 400)
+        products = [
+            {
+                "invoice": invoice["ID"],
+                "name": "product %d" % number,
+                "price": Decimal("10.00"),
+                "vat_percentage": 21,
+                "quantity": 1,
+            }
+            for number in range(25)
+        ]
+        ids = invoice_model.InvoiceProduct.CreateMany(connection, products)
+        for product_id, number in zip(ids, range(25)):
+            product = invoice_model.InvoiceProduct.FromPrimary(connection, product_id)
+            assert product["name"] == "product %d" % number
+
+    def test_insert_many_without_consecutive_ids(
+        self, connection, create_invoice_object, monkeypatch
+    ):
+        invoice = create_invoice_object()
+        # Servers in interleaved lock mode get a statement per row.
+        monkeypatch.setattr(common_model, "_consecutive_ids", False)
+        products = [
+            {
+                "invoice": invoice["ID"],
+                "name": "product %d" % number,
+                "price": Decimal("10.00"),
+                "vat_percentage": 21,
+                "quantity": 1,
+            }
+            for number in range(5)
+        ]
+        ids = invoice_model.InvoiceProduct.InsertMany(connection, products)
+        for product_id, number in zip(ids, range(5)):
+            product = invoice_model.InvoiceProduct.FromPrimary(connection, product_id)
+            assert product["name"] == "product %d" % number
+
+    def test_create_client_without_number(self, connection, client_object):
+        client = invoice_model.Client.Create(
+            connection,
+            {
+                "name": "numberless",
+                "city": "city",
+                "postalCode": "1234AB",
+                "email": "numberless@example.com",
+                "telephone": "12345678",
+                "address": "address",
+            },
+        )
+        assert client["clientNumber"] not in (None, client_object["clientNumber"])
+        current = invoice_model.Client.FromClientNumber(
+            connection, client["clientNumber"]
+        )
+        assert current["name"] == "numberless"
+        assert current["isCurrent"] == 1
+
+    def test_client_versions_are_marked_current(self, connection, client_object):
+        first_version = client_object.key
+        client_object["name"] = "new client name"
+        client_object.Save()
+        client_object["city"] = "new city"
+        client_object.Save()
+
+        with connection as cursor:
+            versions = cursor.Select(
+                table="client",
+                fields=("ID", "isCurrent"),
+                conditions="clientNumber = 1",
+                order=[("ID", False)],
+            )
+        assert [row["isCurrent"] for row in versions] == [None, None, 1]
+        assert versions[0]["ID"] == first_version
+        clients = list(invoice_model.Client.List(connection))
+        assert len(clients) == 1
+        assert clients[0]["city"] == "new city"
+        client = invoice_model.Client.FromClientNumber(connection, 1)
+        assert client["name"] == "new client name"
+
+    def test_archive_client_versions(self, connection, create_invoice_object):
+        invoice = create_invoice_object()
+        client = invoice_model.Client.FromClientNumber(connection, 1)
+        client["name"] = "second version"
+        client.Save()
+        client["name"] = "third version"
+        client.Save()
+
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+        with helpers.transaction(connection, invoice_model.Client):
+            assert invoice_model.Client.ArchiveVersions(connection, yesterday) == 0
+            assert invoice_model.Client.ArchiveVersions(connection, tomorrow) == 1
+
+        # The version of the invoice and the current version stay.
+        with connection as cursor:
+            remaining = cursor.Select(table="client", fields="ID", order=["ID"])
+        assert [row["ID"] for row in remaining] == [invoice["client"]["ID"], 3]
+        history = invoice_model.Client.History(connection, 1)
+        assert [version["name"] for version in history] == [
+            "client_name",
+            "second version",
+            "third version",
+        ]
+        assert history[1]["dateArchived"] is not None
+        assert history[2]["isCurrent"] == 1
+
+    def test_list_counts(self, connection, create_invoice_object):
+        invoice = create_invoice_object()
+
+        def add_product():
+            invoice_model.InvoiceProduct.Create(
+                connection,
+                {
+                    "invoice": invoice["ID"],
+                    "name": "product",
+                    "price": Decimal("10.00"),
+                    "vat_percentage": 21,
+                    "quantity": 1,
+                },
+            )
+
+        for _ in range(3):
+            add_product()
+        common_model.count_cache.Clear()
+
+        total, *products = invoice_model.InvoiceProduct.List(
+            connection, limit=2, yield_unlimited_total_first=True
+        )
+        assert (total, len(products)) == (3, 2)
+        # A page that is not full shows the total without counting.
+        total, *products = invoice_model.InvoiceProduct.List(
+            connection, limit=2, offset=2, yield_unlimited_total_first=True
+        )
+        assert (total, len(products)) == (3, 1)
+
+        total, *_ = invoice_model.InvoiceProduct.List(
+            connection,
+            limit=1,
+            yield_unlimited_total_first=True,
+            count=common_model.COUNT_CACHED,
+        )
+        assert total == 3
+        add_product()
+        total, *_ = invoice_model.InvoiceProduct.List(
+            connection,
+            limit=1,
+            yield_unlimited_total_first=True,
+            count=common_model.COUNT_CACHED,
+        )
+        assert total == 3  # Still cached.
+        total, *_ = invoice_model.InvoiceProduct.List(
+            connection,
+            limit=1,
+            yield_unlimited_total_first=True,
+            count=common_model.COUNT_ESTIMATE,
+        )
+        assert total == 3  # Small tables are counted exactly, through the cache.
+
+    def test_count_estimate_uses_driving_table(self):
+        class Cursor:
+            def Execute(self, sql):
+                assert sql.startswith("EXPLAIN")
+                # An invoice list joined with its clients.
+                return [
+                    {"rows": 500000, "filtered": 50.0},
+                    {"rows": 1, "filtered": 100.0},
+                ]
+
+        total = common_model.count_rows(
+            Cursor(), "invoice JOIN client", "1", common_model.COUNT_ESTIMATE
+        )
+        assert total == 250000
+
+    def test_invoice_list_pages(self, connection, create_invoice_object):
+        for _ in range(3):
+            create_invoice_object(status=invoice_model.InvoiceStatus.NEW.value)
+        assert invoice_model.Invoice.COUNT_STRATEGY == common_model.COUNT_ESTIMATE
+        total, *invoices = invoice_model.Invoice.List(
+            connection, limit=2, yield_unlimited_total_first=True
+        )
+        assert total == 3
+        assert len(invoices) == 2
+        assert all(invoice["totals"] for invoice in invoices)
+
+    def test_count_cache_is_bounded(self, connection, monkeypatch):
+        common_model.count_cache.Clear()
+        with connection as cursor:
+            common_model.count_rows(cursor, "invoiceProduct", "1")
+        # Exact counts are not kept.
+        assert len(common_model.count_cache) == 0
+
+        counts = common_model.CountCache(ttl=30, max_size=2)
+        for key in "abc":
+            counts.Set(key, 1)
+        assert len(counts) == 2
+        assert counts.Get("a") is None
+        now = time.monotonic()
+        monkeypatch.setattr(common_model.time, "monotonic", lambda: now + 60)
+        counts.Set("d", 1)
+        # Expired totals are dropped when a total is added.
+        assert len(counts) == 1
+
+    def test_client_cache(self, connection, client_object):
+        stats = client_cache.Stats()
+        client = invoice_model.Client.FromClientNumber(connection, 1)
+        assert invoice_model.Client.FromClientNumber(connection, 1) == client
+        assert invoice_model.Client.FromPrimary(connection, client.key) == client
+        assert invoice_model.Client.FromPrimary(connection, client.key) == client
+        assert client_cache.Stats()["hits"] == stats["hits"] + 2
+
+        client["name"] = "renamed client"
+        client.Save()
+        assert (
+            invoice_model.Client.FromClientNumber(connection, 1)["name"]
+            == "renamed client"
+        )
+
+    def test_lru_cache_is_bounded(self, connection):
+        lru = cache.VersionedCache("test_lru", max_size=2)
+        for key in ("a", "b", "a", "c"):
+            lru.Get(connection, key, lambda: key.upper())
+        stats = lru.Stats()
+        assert (stats["size"], stats["evictions"]) == (2, 1)
+        assert (stats["hits"], stats["misses"]) == (1, 3)
+        # "b" was the least recently used value.
+        assert lru.Get(connection, "b", lambda: "reloaded") == "reloaded"
+        cache.caches.remove(lru)
+
+    def test_cache_skips_values_loaded_during_invalidation(self, connection):
+        versioned = cache.VersionedCache("test_invalidation")
+
+        def load():
+            # Another request changes the row while it is being loaded.
+            versioned.Invalidate(connection)
+            return "stale"
+
+        assert versioned.Get(connection, "a", load) == "stale"
+        assert versioned.Get(connection, "a", lambda: "fresh") == "fresh"
+        cache.caches.remove(versioned)
+
+    def test_identity_map(self, connection, create_invoice_object):
+        invoice = create_invoice_object()
+        # Outside of a request every lookup loads a new record.
+        assert invoice_model.Client.FromPrimary(
+            connection, invoice["client"].key
+        ) is not invoice_model.Client.FromPrimary(connection, invoice["client"].key)
+
+        token = common_model.start_identity_map()
+        try:
+            client = invoice_model.Client.FromPrimary(connection, invoice["client"].key)
+            invoices = [
+                invoice_model.Invoice.FromPrimary(connection, invoice["ID"])
+                for _ in range(2)
+            ]
+            assert invoices[0] is not invoices[1]
+            assert all(item["client"] is client for item in invoices)
+            assert invoices[0]["companydetails"] is invoices[1]["companydetails"]
+            platform = invoice_model.PaymentPlatform.FromName(connection, "mollie")
+            assert invoice_model.PaymentPlatform.FromPrimary(
+                connection, platform.key
+            ) is invoice_model.PaymentPlatform.FromPrimary(connection, platform.key)
+
+            client["name"] = "new version"
+            client.Save()
+            old = invoice_model.Client.FromPrimary(connection, invoice["client"].key)
+            assert old["name"] == "client_name"
+        finally:
+            common_model.end_identity_map(token)
+
+    def test_list_eager(self, connection, create_invoice_object):
+        create_invoice_object()
+        create_invoice_object()
+        invoices = invoice_model.Invoice.List(connection)
+        assert len(invoices) == 2
+        # The relations were loaded by List, not when they are first used.
+        for invoice in invoices:
+            assert isinstance(dict.get(invoice, "client"), invoice_model.Client)
+            assert isinstance(
+                dict.get(invoice, "companydetails"), invoice_model.Companydetails
+            )
+        assert invoices[0]["client"]["name"] == "client_name"
+
+        token = common_model.start_identity_map()
+        try:
+            invoices = invoice_model.Invoice.List(connection)
+            assert invoices[0]["client"] is invoices[1]["client"]
+        finally:
+            common_model.end_identity_map(token)
+
+        with pytest.raises(ValueError):
+            list(invoice_model.Invoice.List(connection, eager=("contract",)))
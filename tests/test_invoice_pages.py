@@ -57,6 +57,45 @@ class TestClass:
             *mt940_result,
         ]  # Parsing the same file 3 times should return into the same results 3 times.
 
+    def test_camt053_processing(self, mt940_result):
+        with open("tests/test_camt053.xml", "r") as f:
+            data = f.read()
+        io_files = [{"filename": "test", "content": data}]
+        results = invoice_helpers.CAMT053_processor(io_files).process_files()
+        # CAMT.053 statements carry the same data as the MT-940 test statement.
+        assert [
+            {key: result[key] for key in mt940_result[0]} for result in results
+        ] == mt940_result
+        assert results[0]["counterparty"] == "client_name"
+        assert results[0]["counterparty_account"] == "NL00RABO0123456789"
+
+    def test_process_statements_detects_format(self, mt940_result):
+        with open("tests/test_mt940.sta", "r") as f:
+            mt940_data = f.read()
+        with open("tests/test_camt053.xml", "r") as f:
+            camt053_data = f.read()
+        results = invoice_helpers.process_statements(
+            [
+                {"filename": "test.sta", "content": mt940_data},
+                {"filename": "test.xml", "content": camt053_data},
+            ]
+        )
+        assert [result["invoice"] for result in results] == [
+            result["invoice"] for result in mt940_result + mt940_result
+        ]
+
+    def test_process_statements_from_disk(self, mt940_result, tmp_path):
+        files = []
+        for name in ("test_mt940.sta", "test_camt053.xml"):
+            path = tmp_path / name
+            with open("tests/%s" % name, "rb") as f:
+                path.write_bytes(f.read())
+            files.append({"filename": name, "path": str(path)})
+        results = invoice_helpers.process_statements(files)
+        assert [result["invoice"] for result in results] == [
+            result["invoice"] for result in mt940_result + mt940_result
+        ]
+
     def test_stock_change_schema(self):
         product = WarehouseStockChangeSchema().load(
             {"name": "product_1", "quantity": 5}
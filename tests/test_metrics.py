@@ -0,0 +1,56 @@
+from invoices.common import metrics
+
+
+class TestClass:
+    def test_metrics_of_processes_are_merged(self, tmp_path, monkeypatch):
+        first = metrics.MetricsStore(str(tmp_path))
+        first.Observe("invoices_pdf_render_seconds", {}, 0.2)
+        first.Increment("invoices_requests_total", {"route": "/", "status": "200"})
+        first.Flush(force=True)
+        second = metrics.MetricsStore(str(tmp_path))
+        second.pid = first.pid + 1  # Pretend to be a second worker that has exited.
+        second._CheckFork = lambda: None
+        second.Observe("invoices_pdf_render_seconds", {}, 3)
+        second.Increment("invoices_requests_total", {"route": "/", "status": "200"})
+        second.SetGauge("invoices_db_pool_connections", {"state": "idle"}, 4)
+        second.Flush(force=True)
+
+        monkeypatch.setattr(metrics, "_alive", lambda pid: pid == first.pid)
+        counters, histograms, gauges = first.Collect()
+        assert list(counters.values()) == [2]
+        histogram = list(histograms.values())[0]
+        assert histogram["count"] == 2
+        assert histogram["sum"] == 3.2
+        # Gauges of processes that no longer run are dropped.
+        assert gauges == {}
+
+        text = first.Render()
+        assert "# TYPE invoices_pdf_render_seconds histogram" in text
+        assert 'invoices_pdf_render_seconds_bucket{le="0.25"} 1' in text
+        assert 'invoices_pdf_render_seconds_bucket{le="+Inf"} 2' in text
+        assert 'invoices_requests_total{route="/",status="200"} 2' in text
+
+    def test_route_patterns(self):
+        routes = metrics.Routes(
+            [
+                ("/invoice/(.*)", "RequestInvoiceDetails", "GET"),
+                ("/invoice/(.*)", "RequestUpdateInvoice", "POST"),
+                ("(/.*)", "RequestInvalidcommand"),
+            ]
+        )
+        assert routes.Pattern("/invoice/2024-001", "GET") == "/invoice/(.*)"
+        assert routes.Pattern("/nothing", "GET") == "(/.*)"
+        assert metrics.Routes([]).Pattern("/", "GET") == "unknown"
+
+    def test_label_values_are_escaped(self):
+        sample = metrics._sample("name", {"route": 'a"b\\'}, 1)
+        assert sample == 'name{route="a\\"b\\\\"} 1'
+
+    def test_access(self):
+        assert metrics.allowed("secret", "secret", "192.0.2.1")
+        assert not metrics.allowed("secret", "", "127.0.0.1")
+        # Without a token only the same host may see the metrics.
+        assert metrics.allowed("", "", "127.0.0.1")
+        assert metrics.allowed(None, "", "::1")
+        assert not metrics.allowed("", "", "192.0.2.1")
+        assert not metrics.allowed("", "", "")
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from invoices.login import passwords
+
+
+class TestClass:
+    def test_token_bucket(self):
+        bucket = passwords.TokenBucket(2, rate=1)
+        assert bucket.Take("a", now=0)
+        assert bucket.Take("a", now=0)
+        assert not bucket.Take("a", now=0)
+        # Other keys have their own bucket.
+        assert bucket.Take("b", now=0)
+        # One token per second comes back, up to the capacity.
+        assert bucket.Take("a", now=1)
+        assert not bucket.Take("a", now=1)
+        assert bucket.Take("a", now=100)
+        assert bucket.Take("a", now=100)
+        assert not bucket.Take("a", now=100)
+
+    def test_token_bucket_is_bounded(self):
+        bucket = passwords.TokenBucket(1, rate=0, max_keys=2)
+        for key in "abc":
+            assert bucket.Take(key, now=0)
+        # "a" was forgotten, so it has a full bucket again.
+        assert bucket.Take("a", now=0)
+        assert not bucket.Take("c", now=0)
+
+    def test_login_throttle(self):
+        throttle = passwords.LoginThrottle(
+            ip_attempts=2, ip_per_minute=0, account_attempts=2, account_per_minute=0
+        )
+        throttle.Check("10.0.0.1", "user@example.com")
+        throttle.Check("10.0.0.2", "User@Example.com ")
+        with pytest.raises(passwords.LoginThrottled):
+            throttle.Check("10.0.0.3", "user@example.com")
+        throttle.Check("10.0.0.1", "other@example.com")
+        with pytest.raises(passwords.LoginThrottled):
+            throttle.Check("10.0.0.1", "third@example.com")
+
+    def test_password_rehash(self):
+        old = passwords.PasswordHasher(rounds=1000)
+        new = passwords.PasswordHasher(rounds=2000)
+        try:
+            stored = old.Hash("password")
+            assert old.Verify("password", stored) == (True, None)
+            assert old.Verify("wrong", stored) == (False, None)
+            valid, rehashed = new.Verify("password", stored)
+            assert valid and rehashed
+            assert new.Verify("password", rehashed) == (True, None)
+            assert not new.DummyVerify("password")
+        finally:
+            old.Close()
+            new.Close()
+
+    def test_password_hasher_is_bounded(self):
+        hasher = passwords.PasswordHasher(workers=1, queue_size=0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(_password):
+            started.set()
+            release.wait()
+            return "hash"
+
+        hasher.context.hash = block
+        thread = threading.Thread(target=hasher.Hash, args=("password",))
+        thread.start()
+        try:
+            started.wait()
+            with pytest.raises(passwords.HasherBusy):
+                hasher.Hash("password")
+        finally:
+            release.set()
+            thread.join()
+            hasher.Close()
@@ -0,0 +1,109 @@
+import gc
+import threading
+import time
+
+import pytest
+
+from invoices.common.pool import ConnectionPool, PoolTimeout
+from tests.fixtures import new_connection
+
+
+class Owner:
+    """Stands in for the request that borrowed a connection."""
+
+
+class TestClass:
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(new_connection, size=2)
+        first = pool.Checkout()
+        pool.Checkin(first)
+        assert pool.Checkout() is first
+        assert pool.Stats()["created"] == 1
+
+    def test_checkout_waits_and_times_out(self):
+        pool = ConnectionPool(new_connection, size=1, timeout=0.1)
+        pooled = pool.Checkout()
+        with pytest.raises(PoolTimeout):
+            pool.Checkout()
+        assert pool.Stats()["timeouts"] == 1
+
+        threading.Timer(0.05, pool.Checkin, (pooled,)).start()
+        assert pool.Checkout(timeout=1) is pooled
+        stats = pool.Stats()
+        assert stats["waits"] >= 1
+        assert stats["wait_time_max"] >= 0.05
+
+    def test_checkin_twice(self):
+        pool = ConnectionPool(new_connection, size=1)
+        pooled = pool.Checkout()
+        pool.Checkin(pooled)
+        pool.Checkin(pooled)
+        assert pool.Stats()["idle"] == 1
+
+    def test_borrowed_connections_return_when_collected(self):
+        pool = ConnectionPool(new_connection, size=1)
+        owner = Owner()
+        pooled, _release = pool.Borrow(owner)
+        del owner
+        gc.collect()
+        assert pool.Stats()["idle"] == 1
+        assert pool.Checkout() is pooled
+
+    def test_released_connections_are_not_returned_twice(self):
+        pool = ConnectionPool(new_connection, size=1)
+        first_owner = Owner()
+        pooled, release = pool.Borrow(first_owner)
+        release()
+        second_owner = Owner()
+        assert pool.Borrow(second_owner)[0] is pooled
+        # Collecting the first owner must not hand back the re-borrowed connection.
+        del first_owner
+        gc.collect()
+        assert pooled.checked_out
+        assert pool.Stats()["idle"] == 0
+
+    def test_old_connections_are_recycled(self):
+        pool = ConnectionPool(new_connection, size=1, max_lifetime=0)
+        pooled = pool.Checkout()
+        pool.Checkin(pooled)
+        assert pool.Checkout() is not pooled
+        assert pool.Stats()["recycled"] == 1
+
+    def test_broken_connections_are_replaced(self):
+        pool = ConnectionPool(new_connection, size=1, check_interval=0)
+        pooled = pool.Checkout()
+        pooled.connection.close()
+        pool.Checkin(pooled)
+        replacement = pool.Checkout()
+        assert replacement is not pooled
+        with replacement.connection as cursor:
+            assert cursor.Execute("SELECT 1 AS one")[0]["one"] == 1
+        assert pool.Stats()["broken"] == 1
+
+    def test_concurrent_use_is_bounded(self):
+        pool = ConnectionPool(new_connection, size=3, timeout=10)
+        in_use = []
+        peak = []
+        lock = threading.Lock()
+
+        def work():
+            for _ in range(20):
+                pooled = pool.Checkout()
+                with lock:
+                    in_use.append(pooled)
+                    peak.append(len(in_use))
+                with pooled.connection as cursor:
+                    cursor.Execute("SELECT 1")
+                time.sleep(0.001)
+                with lock:
+                    in_use.remove(pooled)
+                pool.Checkin(pooled)
+
+        threads = [threading.Thread(target=work) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert max(peak) <= 3
+        assert pool.Stats()["created"] <= 3
+        assert pool.Stats()["checkouts"] == 200
@@ -0,0 +1,114 @@
+import datetime
+from decimal import Decimal
+
+from invoices.invoice import model as invoice_model
+from invoices.recurring import generator
+from invoices.recurring import model as recurring_model
+from tests.fixtures import *  # noqa: F401; pylint: disable=unused-variable
+
+
+def create_template(connection, client, start, period="month", **kwargs):
+    template = recurring_model.RecurringInvoice.Create(
+        connection,
+        dict(
+            {
+                "client": client["ID"],
+                "title": "subscription",
+                "description": "monthly subscription",
+                "period": period,
+                "startDate": start,
+                "mail": 0,
+            },
+            **kwargs
+        ),
+    )
+    template.AddProducts(
+        [
+            {
+                "name": "hosting",
+                "price": Decimal("25.00"),
+                "vat_percentage": 21,
+                "quantity": 1,
+            },
+            {
+                "name": "domain",
+                "price": Decimal("10.00"),
+                "vat_percentage": 21,
+                "quantity": 2,
+            },
+        ]
+    )
+    return template
+
+
+class TestClass:
+    def test_add_months(self):
+        add_months = recurring_model.add_months
+        assert add_months(datetime.date(2022, 1, 31), 1) == datetime.date(2022, 2, 28)
+        assert add_months(datetime.date(2022, 11, 15), 3) == datetime.date(2023, 2, 15)
+
+    def test_run_dates_do_not_drift(self):
+        run_date = recurring_model.RecurringInvoice.RunDate
+        start = datetime.date(2022, 1, 31)
+        assert run_date(start, "month", 1) == datetime.date(2022, 2, 28)
+        assert run_date(start, "month", 2) == datetime.date(2022, 3, 31)
+        assert run_date(start, "week", 2) == datetime.date(2022, 2, 14)
+        assert run_date(start, "year", 1) == datetime.date(2023, 1, 31)
+
+    def test_generate_due(self, connection, client_object, companydetails_object):
+        today = datetime.date.today()
+        due = create_template(connection, client_object, today, mail=1)
+        create_template(connection, client_object, today + datetime.timedelta(1))
+
+        created, failed = generator.generate_due(connection, today)
+        assert (created, failed) == (1, [])
+
+        due = recurring_model.RecurringInvoice.FromPrimary(connection, due["ID"])
+        assert due["runs"] == 1
+        assert due["nextRun"] > today
+        invoice = invoice_model.Invoice.FromPrimary(connection, due["lastInvoice"])
+        assert invoice["title"] == "subscription"
+        assert len(list(invoice.Products())) == 2
+        task = invoice_model.InvoiceTask.ClaimNext(connection)
+        assert task["invoice"] == invoice["ID"]
+        assert task["task"] == invoice_model.InvoiceTaskType.MAIL
+
+        # Running again creates nothing, the template is no longer due.
+        assert generator.generate_due(connection, today) == (0, [])
+
+    def test_generate_catches_up_missed_periods(
+        self, connection, client_object, companydetails_object
+    ):
+        today = datetime.date.today()
+        template = create_template(
+            connection, client_object, today - datetime.timedelta(weeks=2), "week"
+        )
+        created, _failed = generator.generate_due(connection, today, batch_size=1)
+        assert created == 3
+        template = recurring_model.RecurringInvoice.FromPrimary(
+            connection, template["ID"]
+        )
+        assert template["nextRun"] == today + datetime.timedelta(weeks=1)
+
+    def test_inactive_templates_are_skipped(
+        self, connection, client_object, companydetails_object
+    ):
+        today = datetime.date.today()
+        create_template(connection, client_object, today, active=0)
+        assert generator.generate_due(connection, today) == (0, [])
+
+    def test_generate_bills_current_client_version(
+        self, connection, client_object, companydetails_object
+    ):
+        today = datetime.date.today()
+        template = create_template(connection, client_object, today)
+        client_object["name"] = "renamed client"
+        client_object.Save()
+
+        generator.generate_due(connection, today)
+        template = recurring_model.RecurringInvoice.FromPrimary(
+            connection, template["ID"]
+        )
+        invoice = invoice_model.Invoice.FromPrimary(connection, template["lastInvoice"])
+        assert invoice["client"].key == client_object.key
+        assert invoice["client"]["name"] == "renamed client"
@@ -0,0 +1,100 @@
+from invoices.clients.model import Client
+from invoices.common import model as common_model
+from invoices.search import model as search_model
+from tests.fixtures import *  # noqa: F401; pylint: disable=unused-variable
+
+
+def create_client(connection, number, name, city="Amsterdam"):
+    return Client.Create(
+        connection,
+        {
+            "clientNumber": number,
+            "name": name,
+            "city": city,
+            "postalCode": "1234AB",
+            "email": "%s@example.com" % name.split()[0].lower(),
+            "telephone": "12345678",
+            "address": "address",
+        },
+    )
+
+
+class TestClass:
+    def test_boolean_query(self):
+        assert search_model.boolean_query("jan jansen") == "+jan +jansen*"
+        assert search_model.boolean_query('+"a" -(b) ~ab') is None
+        assert search_model.boolean_query("foo* -bar") == "+foo +bar*"
+
+    def test_escape_like(self):
+        assert common_model.escape_like("50%_a\\") == "50\\%\\_a\\\\"
+
+    def test_search_clients(self, connection):
+        create_client(connection, 1, "Jansen Bouw")
+        create_client(connection, 2, "Pietersen Transport", city="Rotterdam")
+        create_client(connection, 3, "Jansen Transport", city="Rotterdam")
+
+        total, rows = search_model.search_clients(connection, "transport rotterdam")
+        assert total == 2
+        assert {row["clientNumber"] for row in rows} == {2, 3}
+
+        total, rows = search_model.search_clients(connection, "jans")
+        assert total == 2
+
+        total, rows = search_model.search_clients(connection, "2")
+        assert [row["clientNumber"] for row in rows] == [2]
+        # Digits that are not decimal numbers are searched as text.
+        assert search_model.search_clients(connection, "²") == (0, [])
+
+    def test_search_clients_number_and_text(self, connection):
+        create_client(connection, 123, "Handel 123")
+        create_client(connection, 5, "Bouw 123")
+
+        total, rows = search_model.search_clients(connection, "123")
+        # The client matching both the number and the text is counted once.
+        assert total == 2
+        assert [row["clientNumber"] for row in rows] == [123, 5]
+
+    def test_search_current_client_version(self, connection):
+        client = create_client(connection, 1, "Oldname Holding")
+        client["name"] = "Newname Holding"
+        client.Save()
+
+        assert search_model.search_clients(connection, "oldname") == (0, [])
+        total, rows = search_model.search_clients(connection, "newname")
+        assert [row["name"] for row in rows] == ["Newname Holding"]
+
+    def test_search_invoices(self, connection, create_invoice_object):
+        invoice = create_invoice_object(status="new")
+        results = search_model.search(connection, invoice["sequenceNumber"][:6])
+        assert results["invoices"]["total"] == 1
+        assert results["invoices"]["results"][0]["ID"] == invoice["ID"]
+
+        results = search_model.search(connection, "%")
+        assert results["invoices"]["total"] == 0
+
+    def test_search_pages(self, connection):
+        for number in range(1, 6):
+            create_client(connection, number, "Bakkerij %d" % number)
+        total, rows = search_model.search_clients(
+            connection, "bakkerij", page=3, page_size=2
+        )
+        assert total == 5
+        assert len(rows) == 1
+
+    def test_lookup(self, connection, create_invoice_object):
+        create_client(connection, 7, "Bakkerij Jansen")
+        create_client(connection, 8, "Bakker Transport")
+        create_client(connection, 9, "Visser")
+        invoice = create_invoice_object(status="new")
+
+        labels = [row["label"] for row in search_model.lookup(connection, "bakker")]
+        assert labels == ["8 Bakker Transport", "7 Bakkerij Jansen"]
+        results = search_model.lookup(connection, "9", kinds=("clients",))
+        assert [row["number"] for row in results] == [9]
+        results = search_model.lookup(
+            connection, invoice["sequenceNumber"], kinds=("invoices",)
+        )
+        assert results[0]["url"] == "/invoice/%s" % invoice["sequenceNumber"]
+        assert search_model.lookup(connection, "bakker", limit=1)[0]["number"] == 8
+        assert search_model.lookup(connection, "_") == []
+        assert search_model.lookup(connection, "²") == []
@@ -0,0 +1,116 @@
+import threading
+from datetime import date
+
+from invoices.invoice import model as invoice_model
+from tests.fixtures import *  # noqa: F401; pylint: disable=unused-variable
+from tests.fixtures import new_connection
+
+THREADS = 8
+INVOICES_PER_THREAD = 250
+# Pro forma numbers above 999 do not fit the sequenceNumber column.
+PRO_FORMAS_PER_THREAD = 100
+
+
+def create_invoices(client, status, count, numbers, errors, barrier):
+    """Creates invoices on a connection of its own and stores their numbers."""
+    connection = new_connection()
+    barrier.wait()
+    try:
+        for _ in range(count):
+            invoice = invoice_model.Invoice.Create(
+                connection,
+                {
+                    "title": "concurrent invoice",
+                    "description": "test",
+                    "client": client,
+                    "status": status,
+                },
+            )
+            numbers.append(invoice["sequenceNumber"])
+    except Exception as error:
+        errors.append(error)
+    finally:
+        connection.close()
+
+
+def create_concurrently(client, status, per_thread):
+    numbers = []
+    errors = []
+    barrier = threading.Barrier(THREADS + 1)
+    threads = [
+        threading.Thread(
+            target=create_invoices,
+            args=(client, status, per_thread, numbers, errors, barrier),
+        )
+        for _ in range(THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    # Every thread either created all its invoices or stored its error.
+    assert len(numbers) + per_thread * len(errors) >= THREADS * per_thread
+    return numbers, errors
+
+
+class TestClass:
+    def test_sequence_counter_reserve(self, connection):
+        counter = invoice_model.SequenceCounter
+        assert counter.Reserve(connection, counter.INVOICE) == 1
+        assert counter.Reserve(connection, counter.INVOICE, count=10) == 2
+        assert counter.Reserve(connection, counter.INVOICE) == 12
+        # Every year has a counter of its own.
+        assert counter.Reserve(connection, counter.INVOICE, year=1999) == 1
+
+    def test_sequence_counter_release(self, connection):
+        counter = invoice_model.SequenceCounter
+        first = counter.Reserve(connection, counter.PRO_FORMA, count=5)
+        assert counter.Release(connection, counter.PRO_FORMA, first, count=5) is True
+        assert counter.Reserve(connection, counter.PRO_FORMA) == first
+
+        first = counter.Reserve(connection, counter.PRO_FORMA)
+        counter.Reserve(connection, counter.PRO_FORMA)
+        # A later number was handed out, so the first one can not be returned.
+        assert counter.Release(connection, counter.PRO_FORMA, first) is False
+
+    def test_block_allocator(self, connection):
+        counter = invoice_model.SequenceCounter
+        allocator = invoice_model.BlockAllocator(counter.PRO_FORMA, 5, new_connection)
+        numbers = [allocator.Next()[1] for _ in range(7)]
+        assert numbers == [1, 2, 3, 4, 5, 6, 7]
+        # The second block runs up to 10, the unused numbers are given back.
+        allocator.Close()
+        assert counter.Reserve(connection, counter.PRO_FORMA) == 8
+
+    def test_block_allocator_skips_numbers(self, connection):
+        counter = invoice_model.SequenceCounter
+        allocator = invoice_model.BlockAllocator(counter.PRO_FORMA, 5, new_connection)
+        assert allocator.Next()[1] == 1
+        assert counter.Reserve(connection, counter.PRO_FORMA) == 6
+        # Numbers 2-5 can not be given back as 6 was already handed out.
+        allocator.Close()
+        assert counter.Reserve(connection, counter.PRO_FORMA) == 7
+
+    def test_concurrent_invoice_numbers(self, client_object, companydetails_object):
+        numbers, errors = create_concurrently(
+            client_object["ID"],
+            invoice_model.InvoiceStatus.NEW.value,
+            INVOICES_PER_THREAD,
+        )
+        total = THREADS * INVOICES_PER_THREAD
+        assert errors == []
+        assert len(set(numbers)) == total
+        # Legal invoice numbers have no gaps.
+        assert sorted(numbers, key=lambda x: int(x.split("-")[1])) == [
+            "%d-%03d" % (date.today().year, number) for number in range(1, total + 1)
+        ]
+
+    def test_concurrent_pro_forma_numbers(self, client_object, companydetails_object):
+        numbers, errors = create_concurrently(
+            client_object["ID"],
+            invoice_model.InvoiceStatus.RESERVATION.value,
+            PRO_FORMAS_PER_THREAD,
+        )
+        assert errors == []
+        assert len(set(numbers)) == THREADS * PRO_FORMAS_PER_THREAD
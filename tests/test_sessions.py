@@ -0,0 +1,49 @@
+import time
+
+from invoices.login import model as login_model
+from tests.fixtures import *  # noqa: F401; pylint: disable=unused-variable
+
+
+class TestClass:
+    def test_session_state_round_trip(self):
+        state = login_model.SessionState.New(12, True, lifetime=60)
+        parsed = login_model.SessionState.FromCookie(str(state))
+        assert (parsed.user, parsed.active, parsed.expires, parsed.token) == (
+            12,
+            True,
+            state.expires,
+            state.token,
+        )
+        assert not parsed.Expired()
+        assert parsed.Expired(now=state.expires)
+        # Cookies from before this format only hold the user ID.
+        assert login_model.SessionState.FromCookie("12") is None
+
+    def test_session_verification_interval(self):
+        state = login_model.SessionState.New(12, True)
+        now = time.time()
+        assert not state.NeedsVerification(300, now=now)
+        assert state.NeedsVerification(300, now=now + 300)
+        verified = state.Verified(False, now=now + 300)
+        assert not verified.active
+        assert verified.token == state.token
+        assert not verified.NeedsVerification(300, now=now + 300)
+
+    def test_session_user_without_database(self, connection):
+        state = login_model.SessionState.New(12, True)
+        user = login_model.SessionUser(connection, state)
+        assert int(user) == 12
+        assert user["active"] == "true"
+
+    def test_revoked_sessions(self, connection):
+        state = login_model.SessionState.New(12, True)
+        other = login_model.SessionState.New(12, True)
+        assert not login_model.SessionRevocation.IsRevoked(connection, state.token)
+        login_model.SessionRevocation.Revoke(connection, state)
+        assert login_model.SessionRevocation.IsRevoked(connection, state.token)
+        assert not login_model.SessionRevocation.IsRevoked(connection, other.token)
+
+        # Expired sessions are dropped from the list.
+        expired = login_model.SessionState(12, True, int(time.time()) - 1, 0, "a" * 32)
+        login_model.SessionRevocation.Revoke(connection, expired)
+        assert not login_model.SessionRevocation.IsRevoked(connection, expired.token)
@@ -0,0 +1,56 @@
+from invoices.common import instrumentation, slowqueries
+from tests.fixtures import *  # noqa: F401; pylint: disable=unused-variable
+
+
+class TestClass:
+    def test_fast_queries_are_ignored(self):
+        log = slowqueries.SlowQueryLog(threshold_ms=100)
+        assert log.Record("SELECT 1", 0.01) is None
+
+    def test_fingerprint(self):
+        assert slowqueries.fingerprint(
+            "SELECT * FROM client WHERE name = 'x\\'y' AND ID = 12"
+        ) == slowqueries.fingerprint("SELECT * FROM client WHERE name = 'z' AND ID = 3")
+
+    def test_plan_flags(self):
+        flags = slowqueries.plan_flags(
+            [{"table": "client", "type": "ALL", "rows": 100, "Extra": "Using filesort"}]
+        )
+        assert flags == ["full table scan of client (100 rows)", "filesort on client"]
+
+    def test_explained_queries_are_bounded(self):
+        log = slowqueries.SlowQueryLog(
+            threshold_ms=0, explain_sample=1, max_explained=2
+        )
+        for table in ("client", "invoice", "product"):
+            assert log.Record("SELECT * FROM %s" % table, 1) is not None
+        assert list(log._explained) == [
+            slowqueries.fingerprint("SELECT * FROM invoice"),
+            slowqueries.fingerprint("SELECT * FROM product"),
+        ]
+        # A forgotten query is explained again.
+        assert log.Record("SELECT * FROM client", 1) is not None
+
+    def test_slow_queries_are_not_explained_by_default(self):
+        log = slowqueries.SlowQueryLog(threshold_ms=0)
+        assert not log._ShouldExplain(slowqueries.SlowQuery("SELECT 1", 1, "?"))
+
+    def test_slow_queries_are_explained(self, connection, monkeypatch):
+        log = slowqueries.SlowQueryLog(threshold_ms=0, explain_sample=1)
+        written = []
+        monkeypatch.setattr(log, "Write", written.append)
+        monkeypatch.setattr(slowqueries, "_log", log)
+        instrumented = instrumentation.InstrumentedConnection(connection)
+        with instrumented as cursor:
+            cursor.Execute("SELECT * FROM client ORDER BY name")
+        assert not written
+        instrumented.ExplainSlowQueries()
+
+        query = written[0]
+        assert query.caller.startswith("tests/test_slowqueries.py")
+        assert "filesort on client" in query.flags
+        # The same query is not explained again right away.
+        with instrumented as cursor:
+            cursor.Execute("SELECT * FROM client ORDER BY name")
+        assert len(written) == 2
+        assert written[1].plan is None
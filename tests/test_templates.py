@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from invoices import basepages
+
+
+class TestClass:
+    def test_all_templates_compile(self, monkeypatch):
+        monkeypatch.setattr(basepages, "_parser", None)
+        templates = dict(basepages.preload_templates())
+        assert "invoices/invoices.html" in templates
+        assert all(seconds >= 0 for seconds in templates.values())
+        assert basepages.shared_parser() is basepages._parser
+
+    def test_template_errors_stop_preloading(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(basepages, "_parser", None)
+        monkeypatch.setattr(basepages, "TEMPLATE_DIR", str(tmp_path))
+        (tmp_path / "good.html").write_text("[title]")
+        os.mkdir(tmp_path / "parts")
+        (tmp_path / "parts" / "broken.html").write_text("{{ if [title] }} no endif")
+        with pytest.raises(basepages.TemplateError, match="parts/broken.html"):
+            basepages.preload_templates()
+        # The parser that was in use is kept.
+        assert basepages._parser is None